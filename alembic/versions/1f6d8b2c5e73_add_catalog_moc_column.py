@@ -0,0 +1,24 @@
+"""Add Catalog.moc column
+
+Revision ID: 1f6d8b2c5e73
+Revises: 3a7c2e1f9b04
+Create Date: 2026-10-19 10:02:47.915304
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '1f6d8b2c5e73'
+down_revision = '3a7c2e1f9b04'
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import ARRAY
+
+
+def upgrade():
+    op.add_column('catalog', sa.Column('moc', ARRAY(sa.BigInteger()),
+                                       nullable=True))
+
+
+def downgrade():
+    op.drop_column('catalog', 'moc')
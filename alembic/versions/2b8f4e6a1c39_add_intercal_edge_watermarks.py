@@ -0,0 +1,35 @@
+"""Add intercal edge analysis watermarks
+
+Revision ID: 2b8f4e6a1c39
+Revises: 5c2e9a4d7f18
+Create Date: 2026-10-19 14:05:31.772940
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '2b8f4e6a1c39'
+down_revision = '5c2e9a4d7f18'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('catalog',
+                  sa.Column('phot_updated_at', sa.DateTime(timezone=True),
+                            nullable=True))
+    op.execute("UPDATE catalog SET phot_updated_at = created_at")
+    op.add_column('intercal_edge',
+                  sa.Column('analyzed_at', sa.DateTime(timezone=True),
+                            nullable=True))
+    op.add_column('intercal_edge', sa.Column('from_prior', sa.Float(),
+                                             nullable=True))
+    op.add_column('intercal_edge', sa.Column('to_prior', sa.Float(),
+                                             nullable=True))
+
+
+def downgrade():
+    op.drop_column('intercal_edge', 'to_prior')
+    op.drop_column('intercal_edge', 'from_prior')
+    op.drop_column('intercal_edge', 'analyzed_at')
+    op.drop_column('catalog', 'phot_updated_at')
@@ -0,0 +1,63 @@
+"""Add catalog_overlap table
+
+Revision ID: 3a7c2e1f9b04
+Revises: effa43e7773
+Create Date: 2026-10-19 09:12:31.408211
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '3a7c2e1f9b04'
+down_revision = 'effa43e7773'
+
+from alembic import op
+import sqlalchemy as sa
+from geoalchemy2 import Geography
+
+
+def upgrade():
+    op.create_table(
+        'catalog_overlap',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('catalog_a_id', sa.Integer(), nullable=True),
+        sa.Column('catalog_b_id', sa.Integer(), nullable=True),
+        sa.Column('area', sa.Float(), nullable=True),
+        sa.Column('clip', Geography(geometry_type='GEOMETRY', srid=4326),
+                  nullable=True),
+        sa.Column('created_at', sa.DateTime(timezone=True), nullable=False),
+        sa.Column('updated_at', sa.DateTime(timezone=True), nullable=False),
+        sa.ForeignKeyConstraint(
+            ['catalog_a_id'], ['catalog.id'],
+            name=op.f('fk_catalog_overlap_catalog_a_id_catalog'),
+            ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(
+            ['catalog_b_id'], ['catalog.id'],
+            name=op.f('fk_catalog_overlap_catalog_b_id_catalog'),
+            ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id', name=op.f('pk_catalog_overlap')),
+        sa.UniqueConstraint('catalog_a_id', 'catalog_b_id',
+                            name=op.f('uq_catalog_overlap_catalog_a_id'))
+    )
+    op.create_index(op.f('ix_catalog_overlap_catalog_a_id'),
+                    'catalog_overlap', ['catalog_a_id'], unique=False)
+    op.create_index(op.f('ix_catalog_overlap_catalog_b_id'),
+                    'catalog_overlap', ['catalog_b_id'], unique=False)
+
+    # Backfill the overlap graph from existing catalog footprints
+    op.execute(
+        "INSERT INTO catalog_overlap "
+        "(catalog_a_id, catalog_b_id, area, clip, created_at, updated_at) "
+        "SELECT a.id, b.id, "
+        "ST_Area(ST_Intersection(a.footprint, b.footprint), false), "
+        "ST_Intersection(a.footprint, b.footprint), "
+        "now(), now() "
+        "FROM catalog a JOIN catalog b "
+        "ON a.id < b.id AND ST_Intersects(a.footprint, b.footprint)")
+
+
+def downgrade():
+    op.drop_index(op.f('ix_catalog_overlap_catalog_b_id'),
+                  table_name='catalog_overlap')
+    op.drop_index(op.f('ix_catalog_overlap_catalog_a_id'),
+                  table_name='catalog_overlap')
+    op.drop_table('catalog_overlap')
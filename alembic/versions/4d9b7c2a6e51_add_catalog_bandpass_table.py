@@ -0,0 +1,63 @@
+"""Add catalog_bandpass table
+
+Revision ID: 4d9b7c2a6e51
+Revises: 6e1a3f5b8d27
+Create Date: 2026-10-19 15:48:22.530916
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '4d9b7c2a6e51'
+down_revision = '6e1a3f5b8d27'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table(
+        'catalog_bandpass',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('catalog_id', sa.Integer(), nullable=True),
+        sa.Column('bandpass_id', sa.Integer(), nullable=True),
+        sa.Column('n_obs', sa.Integer(), nullable=True),
+        sa.Column('mag_min', sa.Float(), nullable=True),
+        sa.Column('mag_max', sa.Float(), nullable=True),
+        sa.Column('created_at', sa.DateTime(timezone=True), nullable=False),
+        sa.Column('updated_at', sa.DateTime(timezone=True), nullable=False),
+        sa.ForeignKeyConstraint(
+            ['catalog_id'], ['catalog.id'],
+            name=op.f('fk_catalog_bandpass_catalog_id_catalog'),
+            ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(
+            ['bandpass_id'], ['bandpass.id'],
+            name=op.f('fk_catalog_bandpass_bandpass_id_bandpass'),
+            ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id', name=op.f('pk_catalog_bandpass')),
+        sa.UniqueConstraint('catalog_id', 'bandpass_id',
+                            name=op.f('uq_catalog_bandpass_catalog_id'))
+    )
+    op.create_index(op.f('ix_catalog_bandpass_catalog_id'),
+                    'catalog_bandpass', ['catalog_id'], unique=False)
+    op.create_index(op.f('ix_catalog_bandpass_bandpass_id'),
+                    'catalog_bandpass', ['bandpass_id'], unique=False)
+
+    # Backfill the summary from existing observations
+    op.execute(
+        "INSERT INTO catalog_bandpass "
+        "(catalog_id, bandpass_id, n_obs, mag_min, mag_max, "
+        "created_at, updated_at) "
+        "SELECT cs.catalog_id, o.bandpass_id, count(o.id), "
+        "min(o.mag), max(o.mag), now(), now() "
+        "FROM catalog_star cs JOIN observation o "
+        "ON o.catalog_star_id = cs.id "
+        "WHERE cs.catalog_id IS NOT NULL "
+        "GROUP BY cs.catalog_id, o.bandpass_id")
+
+
+def downgrade():
+    op.drop_index(op.f('ix_catalog_bandpass_bandpass_id'),
+                  table_name='catalog_bandpass')
+    op.drop_index(op.f('ix_catalog_bandpass_catalog_id'),
+                  table_name='catalog_bandpass')
+    op.drop_table('catalog_bandpass')
@@ -0,0 +1,51 @@
+"""Add intercal_pair table
+
+Revision ID: 5c2e9a4d7f18
+Revises: 1f6d8b2c5e73
+Create Date: 2026-10-19 13:21:05.448213
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '5c2e9a4d7f18'
+down_revision = '1f6d8b2c5e73'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('intercal_edge', sa.Column('pair_radius', sa.Float(),
+                                             nullable=True))
+    op.create_table(
+        'intercal_pair',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('edge_id', sa.Integer(), nullable=True),
+        sa.Column('match_radius', sa.Float(), nullable=True),
+        sa.Column('from_catalog_star_id', sa.Integer(), nullable=True),
+        sa.Column('to_catalog_star_id', sa.Integer(), nullable=True),
+        sa.Column('created_at', sa.DateTime(timezone=True), nullable=False),
+        sa.Column('updated_at', sa.DateTime(timezone=True), nullable=False),
+        sa.ForeignKeyConstraint(
+            ['edge_id'], ['intercal_edge.id'],
+            name=op.f('fk_intercal_pair_edge_id_intercal_edge'),
+            ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(
+            ['from_catalog_star_id'], ['catalog_star.id'],
+            name=op.f('fk_intercal_pair_from_catalog_star_id_catalog_star'),
+            ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(
+            ['to_catalog_star_id'], ['catalog_star.id'],
+            name=op.f('fk_intercal_pair_to_catalog_star_id_catalog_star'),
+            ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id', name=op.f('pk_intercal_pair'))
+    )
+    op.create_index('ix_intercal_pair_edge_id_match_radius', 'intercal_pair',
+                    ['edge_id', 'match_radius'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_intercal_pair_edge_id_match_radius',
+                  table_name='intercal_pair')
+    op.drop_table('intercal_pair')
+    op.drop_column('intercal_edge', 'pair_radius')
@@ -0,0 +1,33 @@
+"""Add unique constraint on intercal_edge
+
+Revision ID: 6e1a3f5b8d27
+Revises: 2b8f4e6a1c39
+Create Date: 2026-10-19 15:12:40.107385
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '6e1a3f5b8d27'
+down_revision = '2b8f4e6a1c39'
+
+from alembic import op
+
+
+def upgrade():
+    # Drop duplicate edges, keeping the oldest
+    op.execute("""
+        DELETE FROM intercal_edge dup
+        USING intercal_edge keep
+        WHERE dup.id > keep.id
+            AND dup.from_id = keep.from_id
+            AND dup.to_id = keep.to_id
+            AND dup.bandpass_id = keep.bandpass_id
+    """)
+    op.create_unique_constraint(op.f('uq_intercal_edge_from_id'),
+                                'intercal_edge',
+                                ['from_id', 'to_id', 'bandpass_id'])
+
+
+def downgrade():
+    op.drop_constraint(op.f('uq_intercal_edge_from_id'), 'intercal_edge',
+                       type_='unique')
@@ -0,0 +1,75 @@
+"""Add catalog_zeropoint table and calibrated_observation view
+
+Revision ID: 7a4c1e9d3b62
+Revises: 4d9b7c2a6e51
+Create Date: 2026-10-19 16:30:54.216470
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '7a4c1e9d3b62'
+down_revision = '4d9b7c2a6e51'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table(
+        'catalog_zeropoint',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('catalog_id', sa.Integer(), nullable=True),
+        sa.Column('bandpass_id', sa.Integer(), nullable=True),
+        sa.Column('zp', sa.Float(), nullable=True),
+        sa.Column('zp_err', sa.Float(), nullable=True),
+        sa.Column('solution_id', sa.Integer(), nullable=True),
+        sa.Column('created_at', sa.DateTime(timezone=True), nullable=False),
+        sa.Column('updated_at', sa.DateTime(timezone=True), nullable=False),
+        sa.ForeignKeyConstraint(
+            ['catalog_id'], ['catalog.id'],
+            name=op.f('fk_catalog_zeropoint_catalog_id_catalog'),
+            ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(
+            ['bandpass_id'], ['bandpass.id'],
+            name=op.f('fk_catalog_zeropoint_bandpass_id_bandpass'),
+            ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id', name=op.f('pk_catalog_zeropoint')),
+        sa.UniqueConstraint('catalog_id', 'bandpass_id',
+                            name=op.f('uq_catalog_zeropoint_catalog_id'))
+    )
+    op.create_index(op.f('ix_catalog_zeropoint_catalog_id'),
+                    'catalog_zeropoint', ['catalog_id'], unique=False)
+    op.create_index(op.f('ix_catalog_zeropoint_bandpass_id'),
+                    'catalog_zeropoint', ['bandpass_id'], unique=False)
+
+    # Backfill from the intercal metadata of each catalog, which is keyed
+    # by bandpass ID
+    op.execute(
+        "INSERT INTO catalog_zeropoint "
+        "(catalog_id, bandpass_id, zp, zp_err, created_at, updated_at) "
+        "SELECT c.id, b.id, (zp.value->>'zp')::float, "
+        "(zp.value->>'err')::float, now(), now() "
+        "FROM catalog c, json_each(c.meta->'intercal') zp, bandpass b "
+        "WHERE b.id = zp.key::integer")
+
+    op.execute(
+        "CREATE VIEW calibrated_observation AS "
+        "SELECT o.id AS observation_id, o.catalog_star_id, "
+        "cs.catalog_id, o.bandpass_id, "
+        "o.mag + z.zp AS mag, "
+        "sqrt(o.mag_err * o.mag_err "
+        "+ coalesce(z.zp_err, 0.) * coalesce(z.zp_err, 0.)) AS mag_err, "
+        "z.solution_id "
+        "FROM observation o "
+        "JOIN catalog_star cs ON o.catalog_star_id = cs.id "
+        "JOIN catalog_zeropoint z "
+        "ON z.catalog_id = cs.catalog_id AND z.bandpass_id = o.bandpass_id")
+
+
+def downgrade():
+    op.execute("DROP VIEW calibrated_observation")
+    op.drop_index(op.f('ix_catalog_zeropoint_bandpass_id'),
+                  table_name='catalog_zeropoint')
+    op.drop_index(op.f('ix_catalog_zeropoint_catalog_id'),
+                  table_name='catalog_zeropoint')
+    op.drop_table('catalog_zeropoint')
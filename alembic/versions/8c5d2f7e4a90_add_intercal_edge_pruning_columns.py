@@ -0,0 +1,26 @@
+"""Add intercal_edge n_stars and pruned columns
+
+Revision ID: 8c5d2f7e4a90
+Revises: 7a4c1e9d3b62
+Create Date: 2026-10-19 17:41:09.354822
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '8c5d2f7e4a90'
+down_revision = '7a4c1e9d3b62'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('intercal_edge', sa.Column('n_stars', sa.Integer(),
+                                             nullable=True))
+    op.add_column('intercal_edge', sa.Column('pruned', sa.Boolean(),
+                                             nullable=True))
+
+
+def downgrade():
+    op.drop_column('intercal_edge', 'pruned')
+    op.drop_column('intercal_edge', 'n_stars')
@@ -0,0 +1,27 @@
+"""Add intercal_edge overlap_poly column
+
+Revision ID: 9e7f3a1c5b48
+Revises: 8c5d2f7e4a90
+Create Date: 2026-10-19 18:22:37.690153
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '9e7f3a1c5b48'
+down_revision = '8c5d2f7e4a90'
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import ARRAY
+
+
+def upgrade():
+    # Existing edges are filled by re-running prepare_network, or with
+    # starplex.intercal.prep.store_overlap_polygons
+    op.add_column('intercal_edge', sa.Column('overlap_poly',
+                                             ARRAY(sa.Float()),
+                                             nullable=True))
+
+
+def downgrade():
+    op.drop_column('intercal_edge', 'overlap_poly')
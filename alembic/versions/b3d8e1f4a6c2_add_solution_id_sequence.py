@@ -0,0 +1,28 @@
+"""Add catalog_zeropoint solution_id sequence
+
+Revision ID: b3d8e1f4a6c2
+Revises: 9e7f3a1c5b48
+Create Date: 2026-10-19 21:04:12.318846
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'b3d8e1f4a6c2'
+down_revision = '9e7f3a1c5b48'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.execute(sa.schema.CreateSequence(
+        sa.Sequence('catalog_zeropoint_solution_id_seq')))
+    # Continue after any solution IDs already issued
+    op.execute("SELECT setval('catalog_zeropoint_solution_id_seq', "
+               "COALESCE(MAX(solution_id), 0) + 1, false) "
+               "FROM catalog_zeropoint")
+
+
+def downgrade():
+    op.execute(sa.schema.DropSequence(
+        sa.Sequence('catalog_zeropoint_solution_id_seq')))
@@ -0,0 +1,34 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Script to refresh the per-bandpass photometry summary of catalogs.
+"""
+
+import argparse
+
+from starplex.database import connect_to_server, Session
+from starplex.database import CatalogBandpass
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Refresh the catalog_bandpass photometry summary")
+    parser.add_argument('server', action='store',
+        help="Name of server in ~/.starplex.json")
+    parser.add_argument('--catalog', action='store', type=int, nargs='*',
+        help="IDs of catalogs to refresh; all catalogs by default")
+    args = parser.parse_args()
+
+    connect_to_server(args.server)
+    session = Session()
+
+    if args.catalog:
+        for catalog_id in args.catalog:
+            CatalogBandpass.update_catalog(session, catalog_id)
+    else:
+        CatalogBandpass.rebuild(session)
+    session.commit()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Script to compute HEALPix coverages (MOCs) of existing catalog footprints.
+"""
+
+import argparse
+
+from geoalchemy2.shape import to_shape
+
+from starplex.database import connect_to_server, Session
+from starplex.database import Catalog, MOC
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compute Catalog.moc coverages from footprints")
+    parser.add_argument('server', action='store',
+        help="Name of server in ~/.starplex.json")
+    parser.add_argument('--order', action='store', default=10, type=int,
+        help="HEALPix order of the coverage")
+    parser.add_argument('--all', action='store_true', default=False,
+        help="Recompute coverages that already exist")
+    args = parser.parse_args()
+
+    connect_to_server(args.server)
+    session = Session()
+
+    catalogs = session.query(Catalog)\
+        .filter(Catalog.footprint != None)  # NOQA
+    if not args.all:
+        catalogs = catalogs.filter(Catalog.moc == None)  # NOQA
+    for catalog in catalogs:
+        footprint = to_shape(catalog.footprint)
+        polygons = [list(p.exterior.coords) for p in footprint.geoms]
+        catalog.moc = MOC.from_polygons(polygons, order=args.order).to_array()
+    session.commit()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,36 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Script to benchmark the scaling of the intercal solvers on synthetic
+mosaics.
+"""
+
+import argparse
+
+from starplex.intercal.benchmark import run_benchmark
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark intercal solvers on synthetic networks")
+    parser.add_argument('--sizes', action='store', type=int, nargs='+',
+        default=[10, 100, 1000, 10000, 100000],
+        help="Numbers of fields of the synthetic networks")
+    parser.add_argument('--layouts', action='store', nargs='+',
+        default=['grid', 'random'], choices=['grid', 'random'],
+        help="Network layouts")
+    parser.add_argument('--solvers', action='store', nargs='+', default=None,
+        help="Solvers to run; all by default")
+    parser.add_argument('--errors', action='store_true', default=False,
+        help="Also time the zeropoint uncertainty estimate")
+    parser.add_argument('--seed', action='store', type=int, default=0,
+        help="Seed of the synthetic networks")
+    args = parser.parse_args()
+
+    run_benchmark(sizes=args.sizes, layouts=args.layouts,
+                  solvers=args.solvers, estimate_errors=args.errors,
+                  seed=args.seed)
+
+
+if __name__ == '__main__':
+    main()
@@ -7,7 +7,7 @@ been compiled, what the aggregate footprint is, etc..
 
 from sqlalchemy import func
 
-from ..database import CatalogStar, Catalog
+from ..database import CatalogStar, Catalog, MOC
 
 
 def compiled_catalogs(session):
@@ -29,3 +29,12 @@ def compiled_footprint(session, catalogs):
             func.ST_Union(*[catalog.footprint for catalog in catalogs]))\
             .one()[0]
     return agg_footprint
+
+
+def compiled_coverage(session, catalogs):
+    """Returns the :class:``MOC`` union of the compiled catalogs' coverages.
+
+    This is a fast, exact-on-the-sphere alternative to
+    :func:`compiled_footprint`.
+    """
+    return MOC().union(*[catalog.coverage for catalog in catalogs])
@@ -6,22 +6,48 @@ Compile the star catalog using basic PostGIS spatial joins.
 
 from astropy import log
 from ..database import Catalog, CatalogStar, Observation, Star
-from ..overlap import FootprintOverlaps
+from ..database import StoredOverlaps, IndexedOverlaps, CoverageOverlaps
 from ..database.meta.gistools import degree_to_meter
-from .aggprops import compiled_footprint, compiled_catalogs
+from .aggprops import compiled_catalogs
 from .seed import seed_star_table
+from .unaccrete import unaccrete_catalog
 
 
 class SpatialJoiner(object):
-    """Compiles the star catalog using basic PostGIS spatial joins."""
-    def __init__(self, session):
+    """Compiles the star catalog using basic PostGIS spatial joins.
+
+    Parameters
+    ----------
+    session :
+        The active SQLAlchemy session instance.
+    footprint_index : :class:`starplex.database.FootprintIndex`
+        Optional in-process footprint index. If given, the next catalog to
+        accrete is planned locally against the exact union of compiled
+        footprints rather than from the stored overlap graph.
+    use_moc : bool
+        If ``True``, plan accretion with the catalogs' HEALPix coverages
+        (``Catalog.moc``) instead of PostGIS polygons.
+    """
+    def __init__(self, session, footprint_index=None, use_moc=False):
         super(SpatialJoiner, self).__init__()
         self._s = session
+        self._footprint_index = footprint_index
+        self._use_moc = use_moc
 
     def seed_catalog(self, catalog, reset=True):
         """Initialize the star catalog using a seed observational catalog."""
         seed_star_table(self._s, catalog, reset=reset)
 
+    def unaccrete_catalog(self, catalog):
+        """Remove a single observational catalog from the star catalog.
+
+        Stars left without member catalog stars are deleted and only the
+        remaining affected stars are re-aggregated, so a catalog can be
+        replaced (and re-joined with :meth:`join_catalog`) without
+        recompiling the entire ``Star`` table.
+        """
+        return unaccrete_catalog(self._s, catalog)
+
     def accrete_catalogs(self, r_tol, bandpass, instrument=None,
                          no_new=False):
         """Accrete observational catalogs onto the star catalog given
@@ -45,14 +71,21 @@ class SpatialJoiner(object):
         """
         while True:
             catalogs = compiled_catalogs(self._s)
-            footprint = compiled_footprint(self._s, catalogs)
             log.info("Accreted catalogs:\n{}".
                      format([str(c) for c in catalogs]))
-            log.info("Total footprint {}".format(str(footprint)))
-            overlaps = FootprintOverlaps(self._s, footprint,
-                                         exclude=catalogs)
+            if self._use_moc:
+                overlaps = CoverageOverlaps.from_catalogs(self._s, catalogs)
+            elif self._footprint_index is not None:
+                overlaps = IndexedOverlaps.from_catalogs(
+                    self._s, self._footprint_index, catalogs)
+            else:
+                # Candidates are neighbours of the compiled catalogs in the
+                # precomputed overlap graph, ranked by their overlap area
+                # with the union of the compiled footprints
+                overlaps = StoredOverlaps(self._s, catalogs)
             if instrument is not None:
-                overlaps.query.filter(Catalog.instrument == instrument)
+                overlaps.query = overlaps.query.filter(
+                    Catalog.instrument == instrument)
             if overlaps.count == 0:
                 break
             next_catalog = overlaps.largest_overlapping_catalog
@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Tools for removing a single observational catalog from the compiled ``star``
+table without recompiling the whole sky.
+
+Use :func:`unaccrete_catalog` to detach a catalog's stars, delete any stars
+left without members, and re-aggregate the properties of the stars that
+were touched.
+"""
+
+import numpy as np
+from astropy import log
+from sqlalchemy import func, select, literal, Integer, Float
+from sqlalchemy.dialects.postgresql import ARRAY
+
+from ..database import Catalog, CatalogStar, Observation, Star, Magnitude
+from ..database import IntercalPair
+from ..database.meta.schema import utcnow
+
+
+def unaccrete_catalog(session, catalog):
+    """Remove an observational catalog from the compiled ``Star`` table.
+
+    The catalog's :class:`CatalogStar` rows are detached from their stars,
+    stars that are left without any member catalog stars are deleted
+    (along with their magnitudes), and the remaining affected stars are
+    re-aggregated with :func:`reaggregate_stars`. Since the catalog's star
+    memberships change, its photometry is marked as changed so that its
+    intercal edges are re-analyzed.
+
+    Note that the change is *not* committed.
+
+    Parameters
+    ----------
+    session :
+        The active SQLAlchemy session instance.
+    catalog : :class:`starplex.database.Catalog`
+        The catalog to remove from the ``Star`` table.
+
+    Returns
+    -------
+    star_ids : list
+        IDs of the stars that still exist and were re-aggregated.
+    """
+    affected_ids = [r[0] for r in session.query(CatalogStar.star_id)
+                    .filter(CatalogStar.catalog_id == catalog.id)
+                    .filter(CatalogStar.star_id != None)  # NOQA
+                    .distinct()
+                    .all()]
+    log.info("Unaccreting {0} from {1:d} stars".format(
+        str(catalog), len(affected_ids)))
+    if len(affected_ids) == 0:
+        return []
+
+    session.query(CatalogStar)\
+        .filter(CatalogStar.catalog_id == catalog.id)\
+        .update({CatalogStar.star_id: None}, synchronize_session=False)
+    Catalog.touch_photometry(session, [catalog.id])
+    IntercalPair.invalidate(session, [catalog.id])
+
+    # Delete stars that no longer have any member catalog stars;
+    # magnitudes are removed by the ON DELETE CASCADE constraint.
+    members = session.query(CatalogStar.star_id)\
+        .filter(CatalogStar.star_id == Star.id)
+    session.query(Star)\
+        .filter(Star.id.in_(affected_ids))\
+        .filter(~members.exists())\
+        .delete(synchronize_session=False)
+    session.expire_all()
+
+    star_ids = [r[0] for r in session.query(Star.id)
+                .filter(Star.id.in_(affected_ids))
+                .all()]
+    reaggregate_stars(session, star_ids)
+    return star_ids
+
+
+def reaggregate_stars(session, star_ids):
+    """Recompute the positions and magnitudes of the given stars from their
+    member :class:`CatalogStar` rows and observations.
+
+    Positions are the spherical mean of member positions (see
+    :func:`spherical_mean`), with the scatter as the uncertainty.
+    Magnitudes are inverse-variance weighted means of the member
+    observations in each bandpass.
+
+    Note that the change is *not* committed.
+
+    Parameters
+    ----------
+    session :
+        The active SQLAlchemy session instance.
+    star_ids : list
+        IDs of :class:`Star` rows to re-aggregate.
+    """
+    if len(star_ids) == 0:
+        return
+
+    # Positions
+    rows = session.query(CatalogStar.star_id, CatalogStar.ra,
+                         CatalogStar.dec)\
+        .filter(CatalogStar.star_id.in_(star_ids))\
+        .all()
+    if len(rows) > 0:
+        member_ids, ra, dec = [np.array(c) for c in zip(*rows)]
+        ids, index = np.unique(member_ids, return_inverse=True)
+        mean_ra, mean_dec, ra_err, dec_err = spherical_mean(
+            index, ra.astype(float), dec.astype(float), len(ids))
+        _update_positions(session, ids, mean_ra, mean_dec, ra_err, dec_err)
+
+    # Magnitudes
+    session.query(Magnitude)\
+        .filter(Magnitude.star_id.in_(star_ids))\
+        .delete(synchronize_session=False)
+    w = 1. / (Observation.mag_err * Observation.mag_err)
+    mags = select([CatalogStar.star_id,
+                   Observation.bandpass_id,
+                   (func.sum(Observation.mag * w) / func.sum(w)),
+                   func.sqrt(1. / func.sum(w)),
+                   utcnow(),
+                   utcnow()])\
+        .select_from(Observation.__table__.join(
+            CatalogStar.__table__,
+            Observation.catalog_star_id == CatalogStar.id))\
+        .where(CatalogStar.star_id.in_(star_ids))\
+        .where(Observation.mag_err > 0.)\
+        .group_by(CatalogStar.star_id, Observation.bandpass_id)
+    tbl = Magnitude.__table__
+    session.execute(tbl.insert().from_select(
+        [tbl.c.star_id, tbl.c.bandpass_id, tbl.c.mag, tbl.c.mag_err,
+         tbl.c.created_at, tbl.c.updated_at],
+        mags))
+
+
+def spherical_mean(index, ra, dec, n):
+    """Mean positions of groups of points on the sphere.
+
+    Each group's position is the direction of the mean of its members'
+    unit vectors, so groups straddling RA = 0/360 average correctly. The
+    uncertainties are the sample standard deviations of the members' RA
+    (wrapped about the mean RA) and Dec, in degrees, and are NaN for groups
+    with a single member.
+
+    Parameters
+    ----------
+    index : ndarray
+        Group index, ``0 <= index < n``, of each point.
+    ra, dec : ndarray
+        Coordinates of the points, in degrees.
+    n : int
+        Number of groups.
+
+    Returns
+    -------
+    ra, dec, ra_err, dec_err : ndarray
+        Mean position of each group and its scatter, in degrees.
+    """
+    ra_rad = np.radians(ra)
+    dec_rad = np.radians(dec)
+    x = np.bincount(index, np.cos(dec_rad) * np.cos(ra_rad), minlength=n)
+    y = np.bincount(index, np.cos(dec_rad) * np.sin(ra_rad), minlength=n)
+    z = np.bincount(index, np.sin(dec_rad), minlength=n)
+    mean_ra = np.degrees(np.arctan2(y, x)) % 360.
+    mean_dec = np.degrees(np.arctan2(z, np.hypot(x, y)))
+
+    counts = np.bincount(index, minlength=n).astype(float)
+    dra = (ra - mean_ra[index] + 180.) % 360. - 180.
+    ddec = dec - mean_dec[index]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        ra_err = np.sqrt(
+            (np.bincount(index, dra ** 2., minlength=n)
+             - np.bincount(index, dra, minlength=n) ** 2. / counts)
+            / (counts - 1.))
+        dec_err = np.sqrt(
+            (np.bincount(index, ddec ** 2., minlength=n)
+             - np.bincount(index, ddec, minlength=n) ** 2. / counts)
+            / (counts - 1.))
+    ra_err[counts < 2] = np.nan
+    dec_err[counts < 2] = np.nan
+    return mean_ra, mean_dec, ra_err, dec_err
+
+
+def _update_positions(session, star_ids, ra, dec, ra_err, dec_err):
+    """Write star positions with one ``UPDATE ... FROM`` over unnested
+    arrays. NaN uncertainties are stored as NULL.
+    """
+    def _floats(a):
+        return literal([float(v) for v in a], ARRAY(Float))
+
+    nan = literal(float('nan'), Float)
+    values = select([
+        func.unnest(literal([int(i) for i in star_ids],
+                            ARRAY(Integer))).label('star_id'),
+        func.unnest(_floats(ra)).label('ra'),
+        func.unnest(_floats(dec)).label('dec'),
+        func.unnest(_floats(ra_err)).label('ra_err'),
+        func.unnest(_floats(dec_err)).label('dec_err')])\
+        .alias('pos')
+    coord = func.Geography(func.ST_SetSRID(
+        func.ST_MakePoint(values.c.ra, values.c.dec), 4326))
+    tbl = Star.__table__
+    session.execute(
+        tbl.update()
+        .where(tbl.c.id == values.c.star_id)
+        .values(ra=values.c.ra, dec=values.c.dec,
+                ra_err=func.nullif(values.c.ra_err, nan),
+                dec_err=func.nullif(values.c.dec_err, nan),
+                coord=coord))
@@ -1,7 +1,11 @@
 from .meta import connect, connect_to_server, create_all, drop_all
 from .meta import Session, Base, engine
-from .meta import FootprintOverlaps, CatalogOverlaps
+from .meta import FootprintOverlaps, CatalogOverlaps, StoredOverlaps
+from .meta import FootprintIndex, IndexedOverlaps
+from .meta import CoverageOverlaps, MOC
 from .star import Star, Magnitude
 from .observation import Catalog, CatalogStar, Observation
 from .bandpass import Bandpass
-from .intercal import IntercalEdge
+from .intercal import IntercalEdge, IntercalPair, CatalogZeropoint
+from .overlapgraph import CatalogOverlap
+from .photsummary import CatalogBandpass
@@ -5,12 +5,15 @@ ORM tables for the intercal method of calibrating multi-field photometric
 catalogs.
 """
 
-from sqlalchemy import Column, Integer, Float
-from sqlalchemy import ForeignKey
+from sqlalchemy import Column, Integer, Float, DateTime, Boolean
+from sqlalchemy import ForeignKey, Index, UniqueConstraint, Sequence
+from sqlalchemy import func, select, literal, or_, event, DDL
+from sqlalchemy.dialects.postgresql import ARRAY
 from sqlalchemy.orm import aliased
 
 from .meta import Base, UniqueMixin
-from .observation import Catalog
+from .meta.schema import utcnow
+from .observation import Catalog, CatalogStar, Observation
 from .bandpass import Bandpass
 
 
@@ -20,6 +23,7 @@ class IntercalEdge(UniqueMixin, Base):
     an edge in a directed graph.
     """
     __tablename__ = 'intercal_edge'
+    __table_args__ = (UniqueConstraint('from_id', 'to_id', 'bandpass_id'),)
 
     id = Column(Integer, primary_key=True)
     from_id = Column(Integer,
@@ -30,6 +34,23 @@ class IntercalEdge(UniqueMixin, Base):
                          ForeignKey('bandpass.id', ondelete='CASCADE'))
     delta = Column(Float)
     delta_err = Column(Float)
+    # Match radius (arcsec) of the cross-match pairs most recently stored
+    # for this edge in ``intercal_pair``, or None if no pairs are stored.
+    # Pairs at other radii may also be stored.
+    pair_radius = Column(Float)
+    # Time the edge was last analyzed and the prior zeropoints of the from
+    # and to catalogs it was analyzed with.
+    analyzed_at = Column(DateTime(timezone=True))
+    from_prior = Column(Float)
+    to_prior = Column(Float)
+    # Vertices of the (largest polygon part of the) footprint overlap, in
+    # q3c flattened ``[ra0, dec0, ra1, dec1, ...]`` format
+    overlap_poly = Column(ARRAY(Float))
+    # Number of matched stars used to compute ``delta``
+    n_stars = Column(Integer)
+    # Edges flagged by :func:`starplex.intercal.prune_network` are left out
+    # of the solution.
+    pruned = Column(Boolean, default=False)
 
     def __init__(self, from_catalog, to_catalog, bandpass, delta, delta_err):
         self.from_id = from_catalog.id
@@ -79,3 +100,190 @@ class IntercalEdge(UniqueMixin, Base):
             return True
 
         return False
+
+
+class IntercalPair(Base):
+    """SQLAlchemy table for storing the cross-matched catalog stars of an
+    :class:`IntercalEdge`, so that edges can be re-analyzed without
+    repeating the spatial cross-match.
+    """
+    __tablename__ = 'intercal_pair'
+    __table_args__ = (Index('ix_intercal_pair_edge_id_match_radius',
+                            'edge_id', 'match_radius'),)
+
+    id = Column(Integer, primary_key=True)
+    edge_id = Column(Integer,
+                     ForeignKey('intercal_edge.id', ondelete='CASCADE'))
+    match_radius = Column(Float)
+    from_catalog_star_id = Column(
+        Integer, ForeignKey('catalog_star.id', ondelete='CASCADE'))
+    to_catalog_star_id = Column(
+        Integer, ForeignKey('catalog_star.id', ondelete='CASCADE'))
+
+    def __repr__(self):
+        return "<IntercalPair(%i)>" % self.id
+
+    @staticmethod
+    def invalidate(session, catalog_ids):
+        """Delete the stored cross-match pairs of all edges involving the
+        given catalogs, and reset the edges' ``pair_radius``, so that the
+        edges are cross-matched again when next analyzed. Use this when the
+        catalogs' stars or photometry change. Note that the change is *not*
+        committed.
+        """
+        catalog_ids = [int(i) for i in catalog_ids]
+        if len(catalog_ids) == 0:
+            return
+        edges = IntercalEdge.__table__
+        pairs = IntercalPair.__table__
+        involved = or_(edges.c.from_id.in_(catalog_ids),
+                       edges.c.to_id.in_(catalog_ids))
+        session.execute(pairs.delete().where(
+            pairs.c.edge_id.in_(select([edges.c.id]).where(involved))))
+        session.execute(edges.update()
+                        .where(involved)
+                        .where(edges.c.pair_radius != None)  # NOQA
+                        .values(pair_radius=None))
+
+
+# Issues ``CatalogZeropoint.solution_id`` values; a sequence, rather than
+# max(solution_id) + 1, so that concurrent solves never share an ID.
+SOLUTION_ID_SEQ = Sequence('catalog_zeropoint_solution_id_seq',
+                           metadata=Base.metadata)
+
+
+class CatalogZeropoint(Base):
+    """SQLAlchemy table for the intercal zeropoint of a catalog in a
+    bandpass.
+
+    Calibrated magnitudes are ``observation.mag + zp``; see
+    :meth:`calibrated_photometry`. ``solution_id`` identifies the
+    :func:`starplex.intercal.solve_network` run that produced the zeropoint
+    (``None`` for zeropoints copied from priors or backfilled from catalog
+    metadata).
+    """
+    __tablename__ = 'catalog_zeropoint'
+    __table_args__ = (UniqueConstraint('catalog_id', 'bandpass_id'),)
+
+    id = Column(Integer, primary_key=True)
+    catalog_id = Column(Integer,
+                        ForeignKey('catalog.id', ondelete='CASCADE'),
+                        index=True)
+    bandpass_id = Column(Integer,
+                         ForeignKey('bandpass.id', ondelete='CASCADE'),
+                         index=True)
+    zp = Column(Float)
+    zp_err = Column(Float)
+    solution_id = Column(Integer)
+
+    def __repr__(self):
+        return "<CatalogZeropoint(%i)>" % self.id
+
+    @staticmethod
+    def next_solution_id(session):
+        """A new, unique ``solution_id`` drawn from the
+        ``catalog_zeropoint_solution_id_seq`` sequence.
+        """
+        return session.execute(select([SOLUTION_ID_SEQ.next_value()]))\
+            .scalar()
+
+    @staticmethod
+    def replace(session, bandpass_id, catalog_ids, zps, zp_errs,
+                solution_id=None):
+        """Replace the zeropoints of many catalogs in a bandpass with one
+        ``DELETE`` and one ``INSERT ... SELECT`` over unnested arrays.
+
+        Note that the change is *not* committed.
+
+        Parameters
+        ----------
+        session :
+            The active SQLAlchemy session instance.
+        bandpass_id : int
+            Bandpass of the zeropoints.
+        catalog_ids : list
+            IDs of the catalogs.
+        zps, zp_errs : list
+            Zeropoint and its uncertainty for each catalog.
+        solution_id : int
+            Optional ID of the solution that produced the zeropoints.
+        """
+        catalog_ids = [int(i) for i in catalog_ids]
+        if len(catalog_ids) == 0:
+            return
+        tbl = CatalogZeropoint.__table__
+        session.execute(tbl.delete()
+                        .where(tbl.c.bandpass_id == bandpass_id)
+                        .where(tbl.c.catalog_id.in_(catalog_ids)))
+        values = select([
+            func.unnest(literal(catalog_ids, ARRAY(Integer))),
+            literal(bandpass_id),
+            func.unnest(literal([float(z) for z in zps], ARRAY(Float))),
+            func.unnest(literal([float(e) for e in zp_errs], ARRAY(Float))),
+            literal(solution_id, Integer),
+            utcnow(),
+            utcnow()])
+        session.execute(tbl.insert().from_select(
+            [tbl.c.catalog_id, tbl.c.bandpass_id, tbl.c.zp, tbl.c.zp_err,
+             tbl.c.solution_id, tbl.c.created_at, tbl.c.updated_at],
+            values))
+
+    @staticmethod
+    def calibrated_photometry(session, bandpass_id, catalog_ids=None):
+        """Query calibrated photometry of all observations in a bandpass
+        whose catalogs have a zeropoint.
+
+        The zeropoints are applied in the database with a single join (the
+        same relation as the ``calibrated_observation`` view), so the
+        query can be streamed with ``yield_per`` for large catalogs.
+
+        Parameters
+        ----------
+        session :
+            The active SQLAlchemy session instance.
+        bandpass_id : int
+            Bandpass of the photometry.
+        catalog_ids : list
+            Optional list of catalog IDs to restrict the query to.
+
+        Returns
+        -------
+        query :
+            Query of ``(catalog_star_id, catalog_id, mag, mag_err)`` rows,
+            where ``mag`` is calibrated and ``mag_err`` includes the
+            zeropoint uncertainty.
+        """
+        zp_err = func.coalesce(CatalogZeropoint.zp_err, 0.)
+        q = session.query(
+            Observation.catalog_star_id,
+            CatalogStar.catalog_id,
+            (Observation.mag + CatalogZeropoint.zp).label('mag'),
+            func.sqrt(Observation.mag_err * Observation.mag_err
+                      + zp_err * zp_err).label('mag_err'))\
+            .join(CatalogStar, Observation.catalog_star_id == CatalogStar.id)\
+            .join(CatalogZeropoint,
+                  (CatalogZeropoint.catalog_id == CatalogStar.catalog_id)
+                  & (CatalogZeropoint.bandpass_id
+                     == Observation.bandpass_id))\
+            .filter(Observation.bandpass_id == bandpass_id)
+        if catalog_ids is not None:
+            q = q.filter(CatalogStar.catalog_id.in_(catalog_ids))
+        return q
+
+
+# The ``calibrated_observation`` view of calibrated photometry, created and
+# dropped with the tables by ``create_all`` and ``drop_all``.
+event.listen(Base.metadata, 'after_create', DDL(
+    "CREATE OR REPLACE VIEW calibrated_observation AS "
+    "SELECT o.id AS observation_id, o.catalog_star_id, "
+    "cs.catalog_id, o.bandpass_id, "
+    "o.mag + z.zp AS mag, "
+    "sqrt(o.mag_err * o.mag_err "
+    "+ coalesce(z.zp_err, 0.) * coalesce(z.zp_err, 0.)) AS mag_err, "
+    "z.solution_id "
+    "FROM observation o "
+    "JOIN catalog_star cs ON o.catalog_star_id = cs.id "
+    "JOIN catalog_zeropoint z "
+    "ON z.catalog_id = cs.catalog_id AND z.bandpass_id = o.bandpass_id"))
+event.listen(Base.metadata, 'before_drop', DDL(
+    "DROP VIEW IF EXISTS calibrated_observation"))
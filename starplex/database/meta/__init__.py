@@ -3,4 +3,7 @@ from .base import Session, Base, engine
 from .schema import SurrogatePK
 from .orm import UniqueMixin
 from .gistools import point_str, multipolygon_str
-from .overlaps import FootprintOverlaps, CatalogOverlaps
+from .overlaps import FootprintOverlaps, CatalogOverlaps, StoredOverlaps
+from .overlaps import CoverageOverlaps
+from .moc import MOC
+from .footprintindex import FootprintIndex, IndexedOverlaps
@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+In-process footprint engine for answering overlap questions without PostGIS
+round trips.
+
+:class:`FootprintIndex` loads every ``Catalog.footprint`` once into shapely
+geometries indexed by an ``STRtree``. Overlap, intersection and area queries
+are then answered locally. The index tracks a watermark of the ``catalog``
+table (and ORM changes made in this process) so that it reloads itself when
+catalogs are added, changed or deleted.
+
+:class:`IndexedOverlaps` exposes the index through the same interface as the
+PostGIS-backed overlap classes in :mod:`starplex.database.meta.overlaps`.
+
+This engine requires shapely, which is an optional dependency.
+
+Shapely treats (RA, Dec) as planar coordinates, so intersections are
+computed with straight edges in (RA, Dec). Areas are computed on the sphere
+(see :func:`geography_area`) and given in square meters, as for the PostGIS
+geography areas of the other overlap classes.
+"""
+
+from sqlalchemy import func, event
+
+from ..observation import Catalog
+from .overlaps import OverlapBase
+from .gistools import spherical_polygon_area
+
+
+# Incremented whenever this process changes a Catalog through the ORM
+_catalog_generation = [0]
+
+
+def _bump_generation(mapper, connection, target):
+    _catalog_generation[0] += 1
+
+
+for _evt in ('after_insert', 'after_update', 'after_delete'):
+    event.listen(Catalog, _evt, _bump_generation)
+
+
+def geography_area(geom):
+    """Area of a shapely (multi)polygon with (RA,Dec) vertices on the
+    sphere, in square meters (as ``ST_Area(geography, false)``).
+    Non-polygonal parts have no area.
+    """
+    if geom.is_empty:
+        return 0.
+    if hasattr(geom, 'geoms'):
+        return sum(geography_area(g) for g in geom.geoms)
+    if geom.geom_type != 'Polygon':
+        return 0.
+    area = spherical_polygon_area(geom.exterior.coords)
+    for ring in geom.interiors:
+        area -= spherical_polygon_area(ring.coords)
+    return area
+
+
+class FootprintIndex(object):
+    """In-memory spatial index of all catalog footprints.
+
+    Example
+    -------
+
+    >>> index = FootprintIndex()
+    >>> index.refresh(session)
+    >>> overlaps = index.overlaps(index.footprint(catalog.id),
+    ...                           exclude=[catalog.id])
+    """
+    def __init__(self):
+        super(FootprintIndex, self).__init__()
+        self._ids = []
+        self._geoms = []
+        self._lookup = {}
+        self._geom_index = {}
+        self._tree = None
+        self._watermark = None
+        self._generation = None
+
+    @property
+    def catalog_ids(self):
+        """IDs of indexed catalogs."""
+        return list(self._ids)
+
+    def _query_watermark(self, session):
+        """Summary of the catalog table used to detect changes."""
+        return tuple(session.query(func.count(Catalog.id),
+                                   func.max(Catalog.id),
+                                   func.max(Catalog.updated_at)).one())
+
+    def is_stale(self, session):
+        """``True`` if the catalog table changed since the index was
+        loaded.
+        """
+        if self._watermark is None:
+            return True
+        if self._generation != _catalog_generation[0]:
+            return True
+        return self._watermark != self._query_watermark(session)
+
+    def refresh(self, session, force=False):
+        """Reload the index if it is stale (or if ``force`` is ``True``)."""
+        if force or self.is_stale(session):
+            self.load(session)
+
+    def load(self, session):
+        """Load all catalog footprints and build the ``STRtree``."""
+        from shapely.strtree import STRtree
+        from geoalchemy2.shape import to_shape
+
+        self._generation = _catalog_generation[0]
+        self._watermark = self._query_watermark(session)
+        rows = session.query(Catalog.id, Catalog.footprint)\
+            .filter(Catalog.footprint != None)\
+            .order_by(Catalog.id)\
+            .all()  # NOQA
+        self._ids = [r[0] for r in rows]
+        self._geoms = [to_shape(r[1]) for r in rows]
+        self._lookup = dict(zip(self._ids, range(len(self._ids))))
+        self._geom_index = dict((id(g), i) for i, g in enumerate(self._geoms))
+        if len(self._geoms) > 0:
+            self._tree = STRtree(self._geoms)
+        else:
+            self._tree = None
+
+    def footprint(self, catalog_id):
+        """Shapely footprint geometry of a catalog."""
+        return self._geoms[self._lookup[catalog_id]]
+
+    def _candidates(self, geom):
+        """Indices of footprints whose bounding boxes intersect ``geom``."""
+        if self._tree is None:
+            return []
+        hits = self._tree.query(geom)
+        if len(hits) > 0 and hasattr(hits[0], 'geom_type'):
+            # shapely < 2 returns geometries rather than indices
+            return sorted(self._geom_index[id(g)] for g in hits)
+        return sorted(int(i) for i in hits)
+
+    def overlapping(self, geom, exclude=None):
+        """IDs of catalogs whose footprints intersect ``geom``.
+
+        Parameters
+        ----------
+        geom :
+            A shapely geometry.
+        exclude : list
+            Optional list of catalog IDs to exclude.
+        """
+        excluded = set(exclude) if exclude is not None else set()
+        return [self._ids[i] for i in self._candidates(geom)
+                if self._ids[i] not in excluded
+                and self._geoms[i].intersects(geom)]
+
+    def overlaps(self, geom, exclude=None):
+        """List of ``(catalog_id, clip, area)`` tuples for every catalog
+        intersecting ``geom``, where ``clip`` is the shapely intersection
+        and ``area`` its area in square meters.
+        """
+        results = []
+        for catalog_id in self.overlapping(geom, exclude=exclude):
+            clip = self.footprint(catalog_id).intersection(geom)
+            results.append((catalog_id, clip, geography_area(clip)))
+        return results
+
+    def intersection(self, catalog_id_1, catalog_id_2):
+        """Shapely intersection of two catalog footprints."""
+        return self.footprint(catalog_id_1).intersection(
+            self.footprint(catalog_id_2))
+
+    def area(self, catalog_id_1, catalog_id_2=None):
+        """Area of a catalog footprint, or of the intersection of two
+        catalog footprints, in square meters.
+        """
+        if catalog_id_2 is None:
+            return geography_area(self.footprint(catalog_id_1))
+        return geography_area(self.intersection(catalog_id_1, catalog_id_2))
+
+    def union(self, catalog_ids):
+        """Shapely union of several catalog footprints."""
+        from shapely.ops import unary_union
+        return unary_union([self.footprint(i) for i in catalog_ids])
+
+
+class IndexedOverlaps(OverlapBase):
+    """Queries catalogs that overlap a footprint using an in-process
+    :class:`FootprintIndex`.
+
+    Overlapping catalog IDs, clips and areas are computed locally; only the
+    :class:`Catalog` rows themselves are fetched from the database, in one
+    query. Clips are shapely geometries (one per overlap, wrapped in a tuple
+    to match the other overlap classes) and areas are in square meters.
+
+    The query can be customized by chaining to the ``query`` attributed. e.g.
+
+       indexed_overlaps.query.filter(Catalog.instrument == my_instrument)
+
+    Parameters
+    ----------
+    session :
+        The active SQLAlchemy session instance.
+    index : :class:`FootprintIndex`
+        The footprint index; it is refreshed if stale.
+    footprint :
+        Shapely geometry to find overlaps against.
+    exclude : list
+        Optional list of :class:`Catalog` instances to exclude.
+    """
+    def __init__(self, session, index, footprint, exclude=None):
+        super(IndexedOverlaps, self).__init__(session, footprint)
+        index.refresh(session)
+        self._index = index
+        excluded = [c.id for c in exclude] if exclude is not None else None
+        self._local = dict((r[0], r[1:])
+                           for r in index.overlaps(footprint,
+                                                   exclude=excluded))
+        ids = list(self._local.keys())
+        if len(ids) > 0:
+            self.query = session.query(Catalog)\
+                .filter(Catalog.id.in_(ids))\
+                .order_by(Catalog.id)
+        else:
+            self.query = session.query(Catalog).filter(Catalog.id == None)  # NOQA
+
+    @classmethod
+    def from_catalogs(cls, session, index, catalogs):
+        """Find overlaps against the union of several catalogs' footprints,
+        excluding those catalogs.
+        """
+        index.refresh(session)
+        footprint = index.union([c.id for c in catalogs])
+        return cls(session, index, footprint, exclude=catalogs)
+
+    def _query_clips(self):
+        """Fill the ``clips`` and ``areas`` caches from the local index."""
+        self._clips = []
+        self._areas = []
+        for catalog in self._overlapping_catalogs:
+            clip, area = self._local[catalog.id]
+            self._clips.append((clip,))
+            self._areas.append(area)
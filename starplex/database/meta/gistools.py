@@ -6,6 +6,8 @@ Utilities for working with Postgres/PostGIS.
 
 import math
 
+import numpy as np
+
 
 R_EARTH = 6371008.7714  # assumed earth radius, meters
 
@@ -18,6 +20,26 @@ def sq_meter_to_sq_degree(A):
     return A * f * f
 
 
+def spherical_polygon_area(vertices):
+    """Area, in square meters, of a polygon ring with (RA,Dec) vertices and
+    great circle edges on the sphere of radius ``R_EARTH``.
+
+    This matches ``ST_Area(geography, false)`` in PostGIS. The ring may be
+    open or closed, and in either orientation.
+    """
+    v = np.radians(np.asarray(vertices, dtype=float))
+    if len(v) < 3:
+        return 0.
+    lon1, lat1 = v[:, 0], v[:, 1]
+    lon2, lat2 = np.roll(lon1, -1), np.roll(lat1, -1)
+    dlon = (lon2 - lon1 + np.pi) % (2. * np.pi) - np.pi
+    t1 = np.tan(lat1 / 2.)
+    t2 = np.tan(lat2 / 2.)
+    # spherical excess of each edge's triangle with the pole
+    excess = 2. * np.arctan2(np.tan(dlon / 2.) * (t1 + t2), 1. + t1 * t2)
+    return abs(excess.sum()) * R_EARTH * R_EARTH
+
+
 def degree_to_meter(d):
     """Convert degrees on the sky to effective meters (for geography type)."""
     return d * math.pi * R_EARTH / 180.
@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+HEALPix multi-order coverage (MOC) representation of catalog footprints.
+
+A :class:`MOC` is stored as a sorted list of disjoint, half-open intervals of
+NESTED HEALPix cell indices at the maximum order, ``MAX_ORDER = 29``. Any
+coverage at a coarser order ``k`` maps onto this representation by shifting
+its cell indices by ``2 * (29 - k)`` bits, so coverages computed at different
+orders can be combined directly. Union, intersection and area are then
+integer interval operations that are exact on the sphere.
+
+Converting footprint polygons into a MOC requires healpy, which is an
+optional dependency. All other operations only need numpy.
+"""
+
+import math
+
+import numpy as np
+
+
+MAX_ORDER = 29
+N_CELLS_MAX = 12 * 4 ** MAX_ORDER
+SKY_AREA = 4. * math.pi * (180. / math.pi) ** 2.  # square degrees
+
+
+class MOC(object):
+    """Multi-order coverage map of a region of the sky.
+
+    Parameters
+    ----------
+    intervals : ndarray, (n, 2)
+        Half-open ``[start, end)`` intervals of NESTED HEALPix cells at
+        ``MAX_ORDER``. Intervals are normalized (sorted and merged).
+    """
+    def __init__(self, intervals=None):
+        super(MOC, self).__init__()
+        if intervals is None:
+            intervals = np.empty((0, 2), dtype=np.int64)
+        self.intervals = _normalize(np.asarray(intervals, dtype=np.int64)
+                                    .reshape(-1, 2))
+
+    def __repr__(self):
+        return "<MOC(%i intervals)>" % self.intervals.shape[0]
+
+    def __eq__(self, other):
+        return np.array_equal(self.intervals, other.intervals)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __or__(self, other):
+        return self.union(other)
+
+    def __and__(self, other):
+        return self.intersection(other)
+
+    @classmethod
+    def from_cells(cls, order, cells):
+        """Build a MOC from NESTED HEALPix cell indices at ``order``."""
+        cells = np.unique(np.asarray(cells, dtype=np.int64))
+        shift = 2 * (MAX_ORDER - order)
+        intervals = np.column_stack((cells << shift, (cells + 1) << shift))
+        return cls(intervals)
+
+    @classmethod
+    def from_polygons(cls, polygons, order=10):
+        """Build a MOC covering polygons with (RA, Dec) vertices.
+
+        Cells touching each polygon are included, so the coverage is a
+        conservative superset of the footprint at the resolution of
+        ``order``. Polygons must be convex, as for catalog footprints
+        computed from a WCS.
+
+        Parameters
+        ----------
+        polygons : list
+            List of polygons, each a list of (RA, Dec) vertices in degrees.
+        order : int
+            HEALPix order (``nside = 2 ** order``) of the coverage.
+        """
+        import healpy
+
+        nside = 2 ** order
+        cells = []
+        for polygon in polygons:
+            verts = np.array(polygon, dtype=float)
+            # drop an explicit closing vertex
+            if np.allclose(verts[0], verts[-1]):
+                verts = verts[:-1]
+            vecs = healpy.ang2vec(verts[:, 0], verts[:, 1], lonlat=True)
+            cells.append(healpy.query_polygon(nside, vecs,
+                                              inclusive=True, nest=True))
+        if len(cells) == 0:
+            return cls()
+        return cls.from_cells(order, np.concatenate(cells))
+
+    @classmethod
+    def from_array(cls, arr):
+        """Build a MOC from its flattened interval representation (as
+        stored in the ``Catalog.moc`` column).
+        """
+        if arr is None:
+            return cls()
+        return cls(np.asarray(arr, dtype=np.int64).reshape(-1, 2))
+
+    def to_array(self):
+        """Flattened ``[start0, end0, start1, end1, ...]`` list of
+        intervals, suitable for the ``Catalog.moc`` column.
+        """
+        return [int(v) for v in self.intervals.flatten()]
+
+    @property
+    def is_empty(self):
+        return self.intervals.shape[0] == 0
+
+    @property
+    def n_cells(self):
+        """Number of covered cells at ``MAX_ORDER``."""
+        return int(np.sum(self.intervals[:, 1] - self.intervals[:, 0]))
+
+    @property
+    def area(self):
+        """Covered area in square degrees."""
+        return SKY_AREA * float(self.n_cells) / float(N_CELLS_MAX)
+
+    def union(self, *others):
+        """Union of this MOC with one or more other MOCs."""
+        return MOC(_combine([self] + list(others), 1))
+
+    def intersection(self, other):
+        """Intersection of this MOC with another MOC."""
+        return MOC(_combine([self, other], 2))
+
+    def intersects(self, other):
+        """``True`` if this MOC overlaps another MOC."""
+        return not self.intersection(other).is_empty
+
+
+def union(mocs):
+    """Union of a sequence of MOCs, computed in a single pass."""
+    mocs = list(mocs)
+    if len(mocs) == 0:
+        return MOC()
+    return MOC(_combine(mocs, 1))
+
+
+def intersecting_pairs(mocs):
+    """Find every pair of intersecting MOCs in a sequence.
+
+    The intervals of all MOCs are swept together, so the cost scales with
+    the number of overlapping intervals rather than the number of pairs of
+    MOCs.
+
+    Parameters
+    ----------
+    mocs : list
+        Sequence of :class:`MOC` instances.
+
+    Returns
+    -------
+    pairs : ndarray, (n, 2)
+        Sorted, unique ``(i, j)`` index pairs with ``i < j`` of MOCs that
+        intersect.
+    """
+    mocs = list(mocs)
+    n_intervals = [m.intervals.shape[0] for m in mocs]
+    if sum(n_intervals) == 0:
+        return np.empty((0, 2), dtype=np.int64)
+    labels = np.repeat(np.arange(len(mocs)), n_intervals)
+    intervals = np.concatenate([m.intervals for m in mocs])
+    order = np.argsort(intervals[:, 0], kind='mergesort')
+    starts = intervals[order, 0]
+    ends = intervals[order, 1]
+    labels = labels[order]
+    # each interval overlaps the following intervals that start before it
+    # ends; pairs starting earlier are found from the other interval
+    stop = np.searchsorted(starts, ends, side='left')
+    counts = stop - np.arange(starts.shape[0]) - 1
+    first = np.repeat(np.arange(starts.shape[0]), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts,
+                                                  counts)
+    second = first + 1 + offsets
+    a = labels[first]
+    b = labels[second]
+    keep = a != b
+    lo = np.minimum(a, b)[keep]
+    hi = np.maximum(a, b)[keep]
+    codes = np.unique(lo * len(mocs) + hi)
+    return np.column_stack((codes // len(mocs), codes % len(mocs)))
+
+
+def _normalize(intervals):
+    """Sort and merge overlapping or adjacent intervals."""
+    if intervals.shape[0] == 0:
+        return intervals
+    intervals = intervals[intervals[:, 1] > intervals[:, 0]]
+    return _combine_intervals([intervals], 1)
+
+
+def _combine(mocs, threshold):
+    return _combine_intervals([m.intervals for m in mocs], threshold)
+
+
+def _combine_intervals(interval_sets, threshold):
+    """Sweep the boundaries of several interval sets, keeping the ranges
+    covered by at least ``threshold`` sets.
+
+    With ``threshold=1`` this is the union; with two normalized sets and
+    ``threshold=2`` it is their intersection.
+    """
+    intervals = np.concatenate(interval_sets)
+    if intervals.shape[0] == 0:
+        return np.empty((0, 2), dtype=np.int64)
+    bounds = np.concatenate((intervals[:, 0], intervals[:, 1]))
+    steps = np.concatenate((np.ones(intervals.shape[0], dtype=np.int64),
+                            -np.ones(intervals.shape[0], dtype=np.int64)))
+    # process ends before starts at the same boundary so that touching
+    # intervals of different sets do not count as overlapping
+    order = np.lexsort((steps, bounds))
+    bounds = bounds[order]
+    depth = np.cumsum(steps[order])
+    inside = depth >= threshold
+    # transitions into and out of coverage
+    prev_inside = np.concatenate(([False], inside[:-1]))
+    starts = bounds[inside & ~prev_inside]
+    ends = bounds[~inside & prev_inside]
+    merged = np.column_stack((starts, ends))
+    merged = merged[merged[:, 1] > merged[:, 0]]
+    if merged.shape[0] > 1:
+        # join runs of adjacent intervals
+        new_run = np.concatenate(([True], merged[1:, 0] != merged[:-1, 1]))
+        run_end = np.concatenate((new_run[1:], [True]))
+        merged = np.column_stack((merged[new_run, 0], merged[run_end, 1]))
+    return merged
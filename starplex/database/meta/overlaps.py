@@ -5,13 +5,19 @@ Module for finding footprint overlaps.
 
 Use :class:`FootprintOverlaps` to finding Catalogs that overlap an arbitrary
 PostGIS multipolygon instance, or :class:`CatalogOverlaps` to find Catalogs
-that overlap a specific Catalog.
+that overlap a specific Catalog. :class:`StoredOverlaps` finds Catalogs that
+overlap any of a set of Catalogs by reading the precomputed
+``catalog_overlap`` graph rather than running a spatial join.
+:class:`CoverageOverlaps` finds Catalogs whose HEALPix coverage (MOC)
+overlaps a given coverage.
 """
 
-from sqlalchemy import func, not_
+from sqlalchemy import func, not_, or_, and_, case
 
 from ..observation import Catalog
-# from .gistools import sq_meter_to_sq_degree
+from ..overlapgraph import CatalogOverlap
+from .moc import MOC
+from .gistools import sq_meter_to_sq_degree
 
 
 class OverlapBase(object):
@@ -66,34 +72,40 @@ class OverlapBase(object):
         if self._overlapping_catalogs is None:
             self._query_overlaps()
         if self._clips is None:
-            self._clips = []
-            for catalog in self._overlapping_catalogs:
-                clip = self._s.\
-                    query(func.ST_Intersection(
-                          catalog.footprint, self._main_footprint)).\
-                    one()
-                self._clips.append(clip)
+            self._query_clips()
         return self._clips
 
     @property
     def areas(self):
         """Returns area of each overlap, as a list. Areas are given in
-        square degrees.
+        square meters, as for PostGIS geography areas.
         """
         if self._overlapping_catalogs is None:
             self._query_overlaps()
         if self._areas is None:
-            self._areas = []
-            for clip in self.clips:
-                A = 0.
-                for part in clip:
-                    A += self._s.scalar(part.ST_Area(use_spheroid=False))
-                # Since clips area created by ST_Intersection, they are
-                # polygons in WK84 (Lat long), thus the areas should
-                # automatically be in square degrees.
-                self._areas.append(A)
+            self._query_clips()
         return self._areas
 
+    def _query_clips(self):
+        """Compute the intersection polygons and areas of all overlaps in a
+        single query, caching both ``clips`` and ``areas``.
+        """
+        clip = func.ST_Intersection(Catalog.footprint, self._main_footprint)
+        sq = self.query\
+            .with_entities(Catalog.id.label('catalog_id'), clip.label('clip'))\
+            .subquery()
+        # Clips are geography polygons, so their (spherical) areas are in
+        # square meters.
+        rows = self._s.query(sq.c.catalog_id, sq.c.clip,
+                             func.ST_Area(sq.c.clip, False)).all()
+        results = dict((r[0], (r[1], r[2])) for r in rows)
+        self._clips = []
+        self._areas = []
+        for catalog in self._overlapping_catalogs:
+            clip, area = results[catalog.id]
+            self._clips.append((clip,))
+            self._areas.append(float(area) if area is not None else 0.)
+
     @property
     def largest_overlapping_catalog(self):
         """Convenience accessor for Catalog entry with the largest overlap."""
@@ -166,3 +178,152 @@ class CatalogOverlaps(OverlapBase):
                 Catalog.footprint, self._main_footprint))\
             .filter(Catalog.id != main_catalog.id)
         return q
+
+
+class StoredOverlaps(OverlapBase):
+    """Queries catalogs that overlap any of a set of principal catalogs using
+    the precomputed ``catalog_overlap`` graph.
+
+    Clips are the stored intersection polygons with each principal catalog
+    the overlapping catalog touches. Areas are those of the union of these
+    stored intersections, i.e., of the overlap with the union of the
+    principal footprints, so principal catalogs that overlap each other are
+    not counted twice.
+
+    The query can be customized by chaining to the ``query`` attributed. e.g.
+
+       stored_overlaps.query.filter(Catalog.instrument == my_instrument)
+
+    Parameters
+    ----------
+    session :
+        The active SQLAlchemy session instance.
+    catalogs : list
+        The principal :class:`Catalog` instances to find overlaps against.
+    exclude : list
+        Optional list of :class:`Catalog` instances to exclude. The principal
+        catalogs are always excluded.
+    """
+    def __init__(self, session, catalogs, exclude=None):
+        super(StoredOverlaps, self).__init__(session, None)
+        self._principal_ids = [c.id for c in catalogs]
+        self._excluded_ids = list(self._principal_ids)
+        if exclude is not None:
+            self._excluded_ids.extend([c.id for c in exclude])
+        self.query = self._query_from_graph()
+
+    def _edge_filter(self):
+        """Filter for overlap edges attached to a principal catalog."""
+        return or_(CatalogOverlap.catalog_a_id.in_(self._principal_ids),
+                   CatalogOverlap.catalog_b_id.in_(self._principal_ids))
+
+    def _neighbour_id(self):
+        """Expression for the non-principal end of an overlap edge."""
+        return case([(CatalogOverlap.catalog_a_id.in_(self._principal_ids),
+                      CatalogOverlap.catalog_b_id)],
+                    else_=CatalogOverlap.catalog_a_id)
+
+    def _query_from_graph(self):
+        """Query for catalogs adjacent to the principal catalogs in the
+        overlap graph.
+        """
+        neighbours = self._s.query(self._neighbour_id())\
+            .filter(self._edge_filter())
+        q = self._s.query(Catalog)\
+            .filter(Catalog.id.in_(neighbours.subquery()))
+        if len(self._excluded_ids) > 0:
+            q = q.filter(not_(Catalog.id.in_(self._excluded_ids)))
+        return q
+
+    def _query_clips(self):
+        """Read the stored intersection polygons of all overlaps and the
+        areas of their unions, caching both ``clips`` and ``areas``.
+        """
+        ids = [c.id for c in self._overlapping_catalogs]
+        clips = dict((i, []) for i in ids)
+        areas = dict((i, 0.) for i in ids)
+        if len(ids) > 0:
+            sq = self._s.query(self._neighbour_id().label('catalog_id'),
+                               CatalogOverlap.clip.label('clip'))\
+                .filter(or_(and_(CatalogOverlap.catalog_a_id.in_(ids),
+                                 CatalogOverlap.catalog_b_id.in_(
+                                     self._principal_ids)),
+                            and_(CatalogOverlap.catalog_b_id.in_(ids),
+                                 CatalogOverlap.catalog_a_id.in_(
+                                     self._principal_ids))))\
+                .subquery()
+            for catalog_id, clip in self._s.query(sq.c.catalog_id,
+                                                  sq.c.clip):
+                clips[catalog_id].append(clip)
+            union = func.ST_Union(func.geometry(sq.c.clip))
+            rows = self._s.query(sq.c.catalog_id,
+                                 func.ST_Area(func.Geography(union), False))\
+                .group_by(sq.c.catalog_id)\
+                .all()
+            for catalog_id, area in rows:
+                if area is not None:
+                    areas[catalog_id] = float(area)
+        self._clips = [tuple(clips[i]) for i in ids]
+        self._areas = [areas[i] for i in ids]
+
+
+class CoverageOverlaps(OverlapBase):
+    """Queries catalogs whose HEALPix coverage overlaps the given coverage.
+
+    All catalog coverages are read in one query and intersected locally with
+    integer interval operations. Clips are :class:`MOC` instances (wrapped in
+    a tuple to match the other overlap classes) and areas are in square
+    meters, as for the other overlap classes. Catalogs without a coverage
+    are ignored.
+
+    The query can be customized by chaining to the ``query`` attributed. e.g.
+
+       coverage_overlaps.query.filter(Catalog.instrument == my_instrument)
+
+    Parameters
+    ----------
+    session :
+        The active SQLAlchemy session instance.
+    coverage : :class:`MOC`
+        The coverage to find overlaps against.
+    exclude : list
+        Optional list of :class:`Catalog` instances to exclude.
+    """
+    def __init__(self, session, coverage, exclude=None):
+        super(CoverageOverlaps, self).__init__(session, None)
+        self.coverage = coverage
+        excluded = set([c.id for c in exclude]) if exclude else set()
+        rows = session.query(Catalog.id, Catalog.moc)\
+            .filter(Catalog.moc != None)\
+            .all()  # NOQA
+        self._local = {}
+        for catalog_id, moc in rows:
+            if catalog_id in excluded:
+                continue
+            clip = coverage.intersection(MOC.from_array(moc))
+            if not clip.is_empty:
+                self._local[catalog_id] = clip
+        ids = list(self._local.keys())
+        if len(ids) > 0:
+            self.query = session.query(Catalog)\
+                .filter(Catalog.id.in_(ids))\
+                .order_by(Catalog.id)
+        else:
+            self.query = session.query(Catalog).filter(Catalog.id == None)  # NOQA
+
+    @classmethod
+    def from_catalogs(cls, session, catalogs):
+        """Find overlaps against the union of several catalogs' coverages,
+        excluding those catalogs.
+        """
+        coverage = MOC().union(*[c.coverage for c in catalogs])
+        return cls(session, coverage, exclude=catalogs)
+
+    def _query_clips(self):
+        """Fill the ``clips`` and ``areas`` caches from the local
+        intersections.
+        """
+        self._clips = [(self._local[c.id],)
+                       for c in self._overlapping_catalogs]
+        sq_degree = sq_meter_to_sq_degree(1.)
+        self._areas = [clip[0].area / sq_degree for clip in self._clips]
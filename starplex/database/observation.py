@@ -22,14 +22,19 @@ Two resources for using PostGIS in astronomy are:
 - http://skyview.gsfc.nasa.gov/xaminblog/index.php/tag/postgis/
 """
 
-from sqlalchemy import Column, Integer, String, Float
+import json
+
+from sqlalchemy import Column, Integer, BigInteger, String, Float, DateTime
+from sqlalchemy import Text, func, select, literal, cast
 from geoalchemy2 import Geography
 from sqlalchemy import ForeignKey
 from sqlalchemy.orm import relationship, backref
-from sqlalchemy.dialects.postgresql import JSON
+from sqlalchemy.dialects.postgresql import JSON, ARRAY
 from sqlalchemy.ext.mutable import MutableDict
 
 from .meta import Base, UniqueMixin, multipolygon_str
+from .meta.schema import utcnow
+from .meta.moc import MOC
 
 
 class Catalog(UniqueMixin, Base):
@@ -40,7 +45,13 @@ class Catalog(UniqueMixin, Base):
     name = Column(String)
     instrument = Column(String)
     footprint = Column(Geography(geometry_type='MULTIPOLYGON', srid=4326))
+    # HEALPix multi-order coverage as flattened MAX_ORDER cell intervals
+    moc = Column(ARRAY(BigInteger))
     meta = Column(MutableDict.as_mutable(JSON), default={})
+    # Time the catalog's photometry last changed. Unlike ``updated_at`` this
+    # is not bumped by metadata writes, so derived products (such as
+    # intercal edges) can tell whether they are out of date.
+    phot_updated_at = Column(DateTime(timezone=True), default=utcnow())
 
     catalog_stars = relationship("CatalogStar", backref="catalog",
                                  passive_deletes=True)
@@ -66,11 +77,76 @@ class Catalog(UniqueMixin, Base):
     def __repr__(self):
         return "<Catalog(%i)>" % self.id
 
+    @property
+    def coverage(self):
+        """The :class:`starplex.database.meta.moc.MOC` coverage of this
+        catalog's footprint (empty if it has not been computed).
+        """
+        return MOC.from_array(self.moc)
+
+    @staticmethod
+    def touch_photometry(session, catalog_ids):
+        """Mark the photometry of catalogs as changed with a single
+        ``UPDATE``, so that intercal edges involving these catalogs are
+        re-analyzed (see :func:`starplex.intercal.stale_edge_ids`).
+
+        Cross-match pairs stored for these edges should be dropped as well,
+        with :meth:`starplex.database.IntercalPair.invalidate`. Note that the
+        change is *not* committed.
+
+        Parameters
+        ----------
+        session :
+            The active SQLAlchemy session instance.
+        catalog_ids : list
+            IDs of the catalogs whose photometry changed.
+        """
+        catalog_ids = [int(i) for i in catalog_ids]
+        if len(catalog_ids) == 0:
+            return
+        tbl = Catalog.__table__
+        session.execute(tbl.update()
+                        .where(tbl.c.id.in_(catalog_ids))
+                        .values(phot_updated_at=utcnow()))
+
+    @staticmethod
+    def bulk_update_meta(session, metas):
+        """Replace the ``meta`` of many catalogs with a single
+        ``UPDATE ... FROM`` statement.
+
+        The new metadata are sent as two arrays that are unnested into a
+        ``(id, meta)`` relation server-side, so the write is one round trip
+        regardless of the number of catalogs. Catalog instances already
+        loaded in the session are not refreshed. Note that the change is
+        *not* committed.
+
+        Parameters
+        ----------
+        session :
+            The active SQLAlchemy session instance.
+        metas : dict
+            New ``meta`` dictionary of each catalog, keyed by catalog ID.
+        """
+        if len(metas) == 0:
+            return
+        ids = [int(i) for i in metas.keys()]
+        docs = [json.dumps(metas[i]) for i in metas.keys()]
+        values = select([
+            func.unnest(literal(ids, ARRAY(Integer))).label('id'),
+            func.unnest(literal(docs, ARRAY(Text))).label('meta')])\
+            .alias('new_meta')
+        tbl = Catalog.__table__
+        session.execute(tbl.update()
+                        .where(tbl.c.id == values.c.id)
+                        .values(meta=cast(values.c.meta, JSON)))
+
     def delete(self, session):
         """Delete this catalog and cleanup orphan catalog stars and
         observations.
         """
-        # ForeignKey constrains CASCADE on delete
+        # ForeignKey constrains CASCADE on delete; this also removes the
+        # catalog's intercal edges and their stored pairs, so no intercal
+        # state of other catalogs needs invalidating.
         session.delete(self)
         session.commit()
         # Clean up any orphan CatalogStars
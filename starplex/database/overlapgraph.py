@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+ORM table for the persistent graph of catalog footprint overlaps.
+
+Each row of ``catalog_overlap`` is an undirected edge between two catalogs
+whose footprints intersect, stored once with ``catalog_a_id < catalog_b_id``,
+along with the intersection polygon and its area. Rows are maintained
+incrementally by :func:`starplex.ingest.init_catalog` so that overlap
+consumers can read precomputed edges instead of re-running spatial joins.
+"""
+
+from sqlalchemy import Column, Integer, Float
+from sqlalchemy import ForeignKey, UniqueConstraint
+from sqlalchemy import func, select, or_
+from geoalchemy2 import Geography
+
+from .meta import Base
+from .meta.schema import utcnow
+from .observation import Catalog
+from .intercal import IntercalEdge, IntercalPair
+
+
+class CatalogOverlap(Base):
+    """SQLAlchemy table for representing the intersection between the
+    footprints of two catalogs.
+    """
+    __tablename__ = 'catalog_overlap'
+    __table_args__ = (UniqueConstraint('catalog_a_id', 'catalog_b_id'),)
+
+    id = Column(Integer, primary_key=True)
+    catalog_a_id = Column(Integer,
+                          ForeignKey('catalog.id', ondelete='CASCADE'),
+                          index=True)
+    catalog_b_id = Column(Integer,
+                          ForeignKey('catalog.id', ondelete='CASCADE'),
+                          index=True)
+    area = Column(Float)
+    clip = Column(Geography(geometry_type='GEOMETRY', srid=4326))
+
+    def __repr__(self):
+        return "<CatalogOverlap(%i)>" % self.id
+
+    @staticmethod
+    def update_catalog(session, catalog):
+        """Replace the overlap edges of a single catalog.
+
+        The footprint search uses the GiST index on ``catalog.footprint``.
+        The catalog must already be flushed so that it has an ``id``.
+        The overlap polygons and cross-match pairs stored on the catalog's
+        intercal edges are cleared, since they derive from its overlaps.
+        Note that the change is *not* committed.
+        """
+        tbl = CatalogOverlap.__table__
+        session.execute(tbl.delete().where(
+            or_(tbl.c.catalog_a_id == catalog.id,
+                tbl.c.catalog_b_id == catalog.id)))
+        edges = IntercalEdge.__table__
+        session.execute(edges.update()
+                        .where(or_(edges.c.from_id == catalog.id,
+                                   edges.c.to_id == catalog.id))
+                        .where(edges.c.overlap_poly != None)  # NOQA
+                        .values(overlap_poly=None))
+        IntercalPair.invalidate(session, [catalog.id])
+        if catalog.footprint is None:
+            return
+        main = Catalog.__table__.alias('main')
+        session.execute(CatalogOverlap._insert_from(
+            main, main.c.id == catalog.id))
+
+    @staticmethod
+    def rebuild(session):
+        """Recompute the entire overlap graph from the ``catalog`` table.
+
+        The overlap polygons and cross-match pairs stored on all intercal
+        edges are cleared. Note that the change is *not* committed.
+        """
+        session.execute(CatalogOverlap.__table__.delete())
+        edges = IntercalEdge.__table__
+        session.execute(edges.update()
+                        .where(edges.c.overlap_poly != None)  # NOQA
+                        .values(overlap_poly=None))
+        session.execute(IntercalPair.__table__.delete())
+        session.execute(edges.update()
+                        .where(edges.c.pair_radius != None)  # NOQA
+                        .values(pair_radius=None))
+        main = Catalog.__table__.alias('main')
+        session.execute(CatalogOverlap._insert_from(main, None))
+
+    @staticmethod
+    def _insert_from(main, main_filter):
+        """Build an ``INSERT ... SELECT`` of overlap edges between the
+        ``main`` catalogs (optionally filtered) and all other catalogs.
+        """
+        other = Catalog.__table__.alias('other')
+        clip = func.ST_Intersection(main.c.footprint, other.c.footprint)
+        sel = select([func.least(main.c.id, other.c.id),
+                      func.greatest(main.c.id, other.c.id),
+                      func.ST_Area(clip, False),
+                      clip,
+                      utcnow(),
+                      utcnow()])\
+            .where(func.ST_Intersects(main.c.footprint, other.c.footprint))
+        if main_filter is not None:
+            sel = sel.where(main_filter)\
+                .where(other.c.id != main.c.id)
+        else:
+            sel = sel.where(main.c.id < other.c.id)
+        tbl = CatalogOverlap.__table__
+        return tbl.insert().from_select(
+            [tbl.c.catalog_a_id, tbl.c.catalog_b_id, tbl.c.area, tbl.c.clip,
+             tbl.c.created_at, tbl.c.updated_at],
+            sel)
+
+    @staticmethod
+    def edges(session, catalog_ids=None):
+        """Query ``(catalog_a_id, catalog_b_id, area)`` for all overlap
+        edges, optionally restricted to edges whose ends are both in
+        ``catalog_ids``.
+        """
+        q = session.query(CatalogOverlap.catalog_a_id,
+                          CatalogOverlap.catalog_b_id,
+                          CatalogOverlap.area)
+        if catalog_ids is not None:
+            q = q.filter(CatalogOverlap.catalog_a_id.in_(catalog_ids))\
+                .filter(CatalogOverlap.catalog_b_id.in_(catalog_ids))
+        return q
+
+    @staticmethod
+    def pair(session, catalog_id_1, catalog_id_2):
+        """Return the :class:`CatalogOverlap` for a pair of catalogs (in
+        either order), or ``None`` if they do not overlap.
+        """
+        a, b = sorted((catalog_id_1, catalog_id_2))
+        return session.query(CatalogOverlap)\
+            .filter(CatalogOverlap.catalog_a_id == a)\
+            .filter(CatalogOverlap.catalog_b_id == b)\
+            .first()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+ORM table summarizing each catalog's photometry per bandpass.
+
+Each row of ``catalog_bandpass`` records that a catalog has observations in
+a bandpass, with the number of observations and their magnitude range. Rows
+are maintained by :func:`starplex.ingest.add_observations` so that lookups
+such as "which catalogs are observed in this bandpass" touch this small
+table instead of grouping the ``observation`` table.
+"""
+
+from sqlalchemy import Column, Integer, Float
+from sqlalchemy import ForeignKey, UniqueConstraint
+from sqlalchemy import func, select
+
+from .meta import Base
+from .meta.schema import utcnow
+from .observation import CatalogStar, Observation
+
+
+class CatalogBandpass(Base):
+    """SQLAlchemy table for the photometric summary of a catalog in a
+    bandpass.
+    """
+    __tablename__ = 'catalog_bandpass'
+    __table_args__ = (UniqueConstraint('catalog_id', 'bandpass_id'),)
+
+    id = Column(Integer, primary_key=True)
+    catalog_id = Column(Integer,
+                        ForeignKey('catalog.id', ondelete='CASCADE'),
+                        index=True)
+    bandpass_id = Column(Integer,
+                         ForeignKey('bandpass.id', ondelete='CASCADE'),
+                         index=True)
+    n_obs = Column(Integer)
+    mag_min = Column(Float)
+    mag_max = Column(Float)
+
+    def __repr__(self):
+        return "<CatalogBandpass(%i)>" % self.id
+
+    @staticmethod
+    def update_catalog(session, catalog_id):
+        """Recompute the summary rows of a single catalog.
+
+        Note that the change is *not* committed.
+        """
+        tbl = CatalogBandpass.__table__
+        session.execute(tbl.delete().where(tbl.c.catalog_id == catalog_id))
+        cs = CatalogStar.__table__
+        session.execute(CatalogBandpass._insert_from(
+            cs.c.catalog_id == catalog_id))
+
+    @staticmethod
+    def rebuild(session):
+        """Recompute the entire summary from the ``observation`` table.
+
+        Note that the change is *not* committed.
+        """
+        session.execute(CatalogBandpass.__table__.delete())
+        session.execute(CatalogBandpass._insert_from(None))
+
+    @staticmethod
+    def _insert_from(catalog_filter):
+        """Build an ``INSERT ... SELECT`` of the summary rows of all
+        catalogs (optionally filtered).
+        """
+        cs = CatalogStar.__table__
+        obs = Observation.__table__
+        sel = select([cs.c.catalog_id,
+                      obs.c.bandpass_id,
+                      func.count(obs.c.id),
+                      func.min(obs.c.mag),
+                      func.max(obs.c.mag),
+                      utcnow(),
+                      utcnow()])\
+            .select_from(cs.join(obs, obs.c.catalog_star_id == cs.c.id))\
+            .where(cs.c.catalog_id != None)  # NOQA
+        if catalog_filter is not None:
+            sel = sel.where(catalog_filter)
+        sel = sel.group_by(cs.c.catalog_id, obs.c.bandpass_id)
+        tbl = CatalogBandpass.__table__
+        return tbl.insert().from_select(
+            [tbl.c.catalog_id, tbl.c.bandpass_id, tbl.c.n_obs,
+             tbl.c.mag_min, tbl.c.mag_max,
+             tbl.c.created_at, tbl.c.updated_at],
+            sel)
+
+    @staticmethod
+    def catalog_ids(bandpass_id):
+        """Select the IDs of catalogs with observations in a bandpass, for
+        use as a subquery.
+        """
+        tbl = CatalogBandpass.__table__
+        return select([tbl.c.catalog_id])\
+            .where(tbl.c.bandpass_id == bandpass_id)\
+            .where(tbl.c.n_obs > 0)
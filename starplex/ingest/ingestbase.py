@@ -12,6 +12,7 @@ from sqlalchemy.sql import func, select
 from sqlalchemy import Integer
 
 from ..database import Catalog, CatalogStar, Observation, Bandpass
+from ..database import CatalogOverlap, CatalogBandpass, MOC, IntercalPair
 # from ..database.meta import point_str
 
 
@@ -43,7 +44,7 @@ def catalog_exists(session, name, instrument):
 
 
 def init_catalog(session, name, instrument, band_names, band_system,
-                 footprint_polys=None, meta=None):
+                 footprint_polys=None, meta=None, moc_order=10):
     """Insert a new observational catalog. Follow this up with
     insert_observations.
 
@@ -63,6 +64,10 @@ def init_catalog(session, name, instrument, band_names, band_system,
         List of footprint polyons of the catalogs footprint on the sky.
     meta : dict
         Metadata passed to the Catalog's `meta` JSON field.
+    moc_order : int
+        HEALPix order of the catalog's multi-order coverage, computed from
+        ``footprint_polys``. Requires healpy; the coverage is skipped (with a
+        warning) if healpy is not installed.
     """
     if not meta:
         meta = {}
@@ -70,10 +75,20 @@ def init_catalog(session, name, instrument, band_names, band_system,
     catalog = Catalog.as_unique(session, name, instrument,
                                 footprints=footprint_polys, **meta)
     session.add(catalog)
+    if footprint_polys is not None and catalog.moc is None:
+        try:
+            catalog.moc = MOC.from_polygons(footprint_polys,
+                                            order=moc_order).to_array()
+        except ImportError:
+            log.warning("healpy not installed; skipping MOC for {0}".format(
+                name))
     # Ensure the bandpass exists
     for n in band_names:
         bp = Bandpass.as_unique(session, n, band_system)
         session.add(bp)
+    session.flush()
+    # Maintain the footprint overlap graph
+    CatalogOverlap.update_catalog(session, catalog)
     session.commit()
 
 
@@ -85,7 +100,10 @@ def add_observations(session, name, instrument, band_names, band_system,
 
     :func:`init_catalog` should be called first to ensure the Catalog and
     Bandpass rows are added. This function can be called several times to
-    append stars in several batches to the catalog.
+    append stars in several batches to the catalog. The catalog's
+    ``catalog_bandpass`` summary rows are refreshed after each call, and its
+    photometry is marked as changed so that its intercal edges are
+    re-analyzed (and re-matched).
 
     Parameters
     ----------
@@ -185,6 +203,12 @@ def add_observations(session, name, instrument, band_names, band_system,
         session.execute(CatalogStar.__table__.insert(), cstars)
         session.execute(Observation.__table__.insert(), obs_list)
         session.commit()
+    # Maintain the per-bandpass photometry summary
+    CatalogBandpass.update_catalog(session, catalog_id)
+    # Intercal edges of this catalog are now out of date
+    Catalog.touch_photometry(session, [catalog_id])
+    IntercalPair.invalidate(session, [catalog_id])
+    session.commit()
 
 
 def _max_id(session, tbl):
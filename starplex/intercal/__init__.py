@@ -13,11 +13,23 @@ The pipeline is run with three successive functions
 2. ``analyze_network()``
 3. ``solve_network()``
 
+``analyze_network_parallel()`` can be used in place of ``analyze_network()``
+to analyze the network across several worker processes. Pass
+``incremental=True`` to either to only re-analyze edges whose catalogs or
+priors changed since their last analysis. ``analyze_network_multiband()``
+analyzes the networks of several bandpasses with a single cross-match per
+pair of fields.
+
+Optionally, run ``prune_network()`` between ``analyze_network()`` and
+``solve_network()`` to leave weak edges of dense networks out of the solution.
+
 If there are isolated fields that are not part of the network, run
 ``copy_prior_of_unattached`` as well.
 """
 
 from .refmanager import set_zeropoint_reference, unset_zeropoint_reference
 from .prep import prepare_network
-from .analyze import analyze_network
+from .analyze import analyze_network, analyze_network_parallel
+from .analyze import analyze_network_multiband
+from .prune import prune_network
 from .solve import solve_network, copy_prior_of_unattached
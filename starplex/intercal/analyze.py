@@ -4,78 +4,486 @@
 Analyze the network of field-to-field zeropoint difference.
 """
 
+import multiprocessing
+from itertools import groupby
+
 import numpy as np
 import astropy.stats
 
-from sqlalchemy import func
-from sqlalchemy.orm import aliased
+from sqlalchemy import func, or_, create_engine
+from sqlalchemy.orm import aliased, sessionmaker
 from geoalchemy2.shape import to_shape
 
 from ..database import Catalog, CatalogStar, Bandpass, Observation
 from ..database import IntercalEdge
-from ..database import CatalogOverlaps
+from ..database import CatalogOverlap
+from ..database.meta.schema import utcnow
 from ..utils.timer import Timer
+from .photcache import PhotometryCache, XMATCH_DTYPE
+from .pairs import store_pairs, read_pairs, has_pairs
+from .starmatch import StarMatches
+from .zpstats import bootstrap_weighted_mean, batch_zp_deltas, make_rng
 
 
-def analyze_network(session, bandpass, prior_zp_delta_key='zp_offset'):
+def analyze_network(session, bandpass, prior_zp_delta_key='zp_offset',
+                    edge_ids=None, commit_every=None, cache_bytes=None,
+                    n_boot=1000, seed=None, stats_batch=None,
+                    pair_radius=None, incremental=False, use_stars=False):
     """Compute zeropoint offsets for all pairs of fields (edges in the graph).
 
-    .. todo:: Add a way to paginating so multiple processors can work on
-       this task in separate sessions.
+    Use :func:`analyze_network_parallel` to split this work across several
+    processes, each with its own database session.
+
+    Parameters
+    ----------
+    session :
+        The active SQLAlchemy session instance.
+    bandpass : :class:`starplex.database.Bandpass`
+        Bandpass of the network to analyze.
+    prior_zp_delta_key : str
+        Catalog metadata key of the prior zeropoint offsets.
+    edge_ids : list
+        Optional list of :class:`IntercalEdge` IDs to restrict the analysis
+        to (a page of the network).
+    commit_every : int
+        If set, commit the session after every ``commit_every`` edges so
+        that results are written back in batches. By default nothing is
+        committed.
+    cache_bytes : int
+        If set, read each catalog's photometry once into a
+        :class:`starplex.intercal.photcache.PhotometryCache` of this size
+        and cross-match edges locally with a KD-tree, rather than running
+        a q3c join for every edge. At most one of ``cache_bytes``,
+        ``pair_radius`` and ``use_stars`` selects how edges are
+        cross-matched; without any of them each edge is cross-matched with
+        a q3c join. Passing more than one raises ``ValueError``.
+    n_boot : int
+        Number of bootstrap resamples used to estimate ``delta_err``.
+    seed :
+        Seed (or ``numpy.random`` generator) for the bootstrap, making the
+        analysis reproducible.
+    stats_batch : int
+        If set, accumulate the matched stars of this many edges and compute
+        their statistics together with
+        :func:`starplex.intercal.zpstats.batch_zp_deltas`, which is much
+        faster when most edges have only a few matched stars.
+    pair_radius : float
+        If set, cross-match each edge once with this radius (arcsec) and
+        store the matched catalog stars in the ``intercal_pair`` table.
+        Edges whose pairs are already stored at this radius are analyzed
+        from the stored pairs without repeating the cross-match.
+    incremental : bool
+        If ``True``, only analyze edges that are out of date (see
+        :func:`stale_edge_ids`).
+    use_stars : bool
+        If ``True``, take each edge's cross-matches from the compiled
+        :class:`starplex.database.Star` memberships of the catalog stars
+        (see :class:`starplex.intercal.starmatch.StarMatches`). The matched
+        photometry of all edges is read up-front in a single query, so this
+        requires that the ``star`` table is compiled.
     """
+    _check_match_options(cache_bytes, pair_radius, use_stars)
+    if incremental:
+        edge_ids = stale_edge_ids(session, bandpass,
+                                  prior_zp_delta_key=prior_zp_delta_key,
+                                  edge_ids=edge_ids)
+        print "{0:d} stale edges".format(len(edge_ids))
+        if len(edge_ids) == 0:
+            return
     from_cat = aliased(Catalog)
     to_cat = aliased(Catalog)
     q = session.query(IntercalEdge, from_cat, to_cat).\
         join(from_cat, IntercalEdge.from_id == from_cat.id).\
         join(to_cat, IntercalEdge.to_id == to_cat.id).\
         filter(IntercalEdge.bandpass_id == bandpass.id)
-    for edge, from_cat, to_cat in q:
-        from_meta = from_cat.meta
-        to_meta = to_cat.meta
+    if edge_ids is not None:
+        q = q.filter(IntercalEdge.id.in_(edge_ids))
+    # Visit edges grouped by catalog so cached photometry is reused
+    q = q.order_by(IntercalEdge.from_id, IntercalEdge.to_id)
+    if use_stars:
+        with Timer() as timer:
+            phot_cache = StarMatches(session, bandpass.id, edge_ids=edge_ids)
+        print "Read star matches of {0:d} edges in {1:.1f} s".format(
+            phot_cache.n_edges, timer.interval)
+    elif cache_bytes is not None:
+        phot_cache = PhotometryCache(session, max_bytes=cache_bytes)
+    else:
+        phot_cache = None
+    rng = make_rng(seed)
+    pending = []  # matched edges awaiting batched statistics
+    # Load the page up-front so that batch commits do not disturb the cursor
+    for i, (edge, from_cat, to_cat) in enumerate(q.all()):
+        if commit_every is not None and i > 0 and i % commit_every == 0:
+            session.commit()
         print "Edge %i" % edge.id
         # Get prior zp correction estimates
-        try:
-            from_prior_zp \
-                = from_meta[
-                    prior_zp_delta_key][str(edge.bandpass_id)]['zp_delta']
-        except:
-            from_prior_zp = 0.
-        try:
-            to_prior_zp \
-                = to_meta[
-                    prior_zp_delta_key][str(edge.bandpass_id)]['zp_delta']
-        except:
-            to_prior_zp = 0.
+        from_prior_zp = _prior_zp(from_cat.meta, prior_zp_delta_key,
+                                  edge.bandpass_id)
+        to_prior_zp = _prior_zp(to_cat.meta, prior_zp_delta_key,
+                                edge.bandpass_id)
         print "Prior ZPs: %.2e %.2e" % (from_prior_zp, to_prior_zp)
+        if stats_batch is not None:
+            try:
+                delta, delta_err = _match_deltas(session, edge,
+                                                 from_prior_zp, to_prior_zp,
+                                                 phot_cache=phot_cache,
+                                                 pair_radius=pair_radius)
+            except NoOverlappingStars:
+                # This edge is useless, so delete it
+                session.delete(edge)
+                continue
+            pending.append((edge, delta, delta_err,
+                            from_prior_zp, to_prior_zp))
+            if len(pending) >= stats_batch:
+                _update_edges_batch(session, pending, n_boot, rng)
+                pending = []
+            continue
         try:
-            delta, delta_err = _compute_zp_delta(session, edge,
-                                                 from_prior_zp, to_prior_zp)
+            delta, delta_err, n_stars = _compute_zp_delta(
+                session, edge, from_prior_zp, to_prior_zp,
+                phot_cache=phot_cache, n_boot=n_boot, rng=rng,
+                pair_radius=pair_radius)
         except NoOverlappingStars:
             # This edge is useless, so delete it
             session.delete(edge)
             continue
         print "Deltas", delta, delta_err
         # Update the edge
-        edge.delta = float(delta)
-        edge.delta_err = float(delta_err)
+        _set_edge(edge, delta, delta_err, n_stars,
+                  from_prior_zp, to_prior_zp)
+    if len(pending) > 0:
+        _update_edges_batch(session, pending, n_boot, rng)
+    if commit_every is not None:
+        session.commit()
+
 
+def _check_match_options(cache_bytes, pair_radius, use_stars):
+    """Raise ``ValueError`` if more than one cross-matching method is
+    selected.
+    """
+    options = (('cache_bytes', cache_bytes is not None),
+               ('pair_radius', pair_radius is not None),
+               ('use_stars', use_stars))
+    selected = [name for name, on in options if on]
+    if len(selected) > 1:
+        raise ValueError("Only one of cache_bytes, pair_radius and "
+                         "use_stars can be set; got {0}".format(
+                             ", ".join(selected)))
+
+
+def _update_edges_batch(session, pending, n_boot, rng):
+    """Compute the zeropoint offsets of a batch of matched edges in one
+    vectorized pass and update (or delete) the edges.
 
-def _compute_zp_delta(session, edge, from_prior_zp, to_prior_zp):
-    """Compute photometric zeropoint difference between two catalogs."""
+    Parameters
+    ----------
+    pending : list
+        List of ``(edge, delta, delta_err, from_prior_zp, to_prior_zp)``
+        for each matched edge.
+    """
+    edge_index = np.concatenate([np.repeat(i, len(p[1]))
+                                 for i, p in enumerate(pending)])
+    delta = np.concatenate([p[1] for p in pending])
+    delta_err = np.concatenate([p[2] for p in pending])
     with Timer() as timer:
-        phot = _xmatch(session, edge)
-    print "Matched in {0:.1f} minutes".format(timer.interval / 60.)
+        mean, mean_err, n_used = batch_zp_deltas(
+            edge_index, delta, delta_err, len(pending),
+            n_boot=n_boot, rng=rng)
+    print "Computed {0:d} edges in {1:.2f} s".format(len(pending),
+                                                     timer.interval)
+    for p, m, m_err, n in zip(pending, mean, mean_err, n_used):
+        edge = p[0]
+        if not np.isfinite(m):
+            # This edge is useless, so delete it
+            session.delete(edge)
+            continue
+        _set_edge(edge, m, m_err, n, p[3], p[4])
 
-    # Apply prior ZP offsets
-    phot['from_mag'] += from_prior_zp
-    phot['to_mag'] += to_prior_zp
 
-    # Compute zeropoint shift
-    delta = phot['from_mag'] - phot['to_mag']
+def _set_edge(edge, delta, delta_err, n_stars, from_prior_zp, to_prior_zp):
+    """Update an edge with its zeropoint offset and record the priors it
+    was analyzed with.
+    """
+    edge.delta = float(delta)
+    edge.delta_err = float(delta_err)
+    edge.n_stars = int(n_stars)
+    edge.from_prior = float(from_prior_zp)
+    edge.to_prior = float(to_prior_zp)
+    edge.analyzed_at = utcnow()
+
+
+def stale_edge_ids(session, bandpass, prior_zp_delta_key='zp_offset',
+                   edge_ids=None):
+    """IDs of the edges of a bandpass's network that need to be analyzed.
+
+    An edge is stale if it has no ``delta``, if it has not been analyzed
+    since the photometry of either catalog changed (see
+    :meth:`starplex.database.Catalog.touch_photometry`), or if the prior
+    zeropoint of either catalog differs from the one it was analyzed with.
+
+    Parameters
+    ----------
+    session :
+        The active SQLAlchemy session instance.
+    bandpass : :class:`starplex.database.Bandpass`
+        Bandpass of the network.
+    prior_zp_delta_key : str
+        Catalog metadata key of the prior zeropoint offsets.
+    edge_ids : list
+        Optional list of :class:`IntercalEdge` IDs to restrict the check to.
+    """
+    from_cat = aliased(Catalog)
+    to_cat = aliased(Catalog)
+    changed = or_(IntercalEdge.delta == None,  # NOQA
+                  IntercalEdge.analyzed_at == None,  # NOQA
+                  IntercalEdge.analyzed_at < from_cat.phot_updated_at,
+                  IntercalEdge.analyzed_at < to_cat.phot_updated_at)
+    q = session.query(IntercalEdge.id, IntercalEdge.from_id,
+                      IntercalEdge.to_id, IntercalEdge.from_prior,
+                      IntercalEdge.to_prior, changed).\
+        join(from_cat, IntercalEdge.from_id == from_cat.id).\
+        join(to_cat, IntercalEdge.to_id == to_cat.id).\
+        filter(IntercalEdge.bandpass_id == bandpass.id)
+    if edge_ids is not None:
+        q = q.filter(IntercalEdge.id.in_(edge_ids))
+    edges = q.order_by(IntercalEdge.id).all()
+    if len(edges) == 0:
+        return []
+    catalog_ids = set([e[1] for e in edges]) | set([e[2] for e in edges])
+    priors = dict((catalog_id, _prior_zp(meta, prior_zp_delta_key,
+                                         bandpass.id))
+                  for catalog_id, meta in session.query(Catalog.id,
+                                                        Catalog.meta).
+                  filter(Catalog.id.in_(catalog_ids)))
+    return [edge_id
+            for edge_id, from_id, to_id, from_prior, to_prior, is_changed
+            in edges
+            if is_changed
+            or from_prior != priors[from_id]
+            or to_prior != priors[to_id]]
+
+
+def _prior_zp(meta, prior_zp_delta_key, bandpass_id):
+    """Prior zeropoint offset of a catalog from its metadata, or 0."""
+    try:
+        return meta[prior_zp_delta_key][str(bandpass_id)]['zp_delta']
+    except:
+        return 0.
+
+
+def analyze_network_multiband(session, bandpasses,
+                              prior_zp_delta_key='zp_offset',
+                              commit_every=None, n_boot=1000, seed=None,
+                              match_radius=1.):
+    """Compute zeropoint offsets for the edges of several bandpasses'
+    networks, cross-matching each pair of catalogs only once.
+
+    The edges of all bandpasses are grouped by catalog pair. For each pair,
+    one q3c cross-match pulls the observations of the matched stars in all
+    of the pair's bandpasses (see :func:`_xmatch_multiband`), and the
+    zeropoint offsets of all bands are computed together with
+    :func:`starplex.intercal.zpstats.batch_zp_deltas`. Each band's
+    :class:`IntercalEdge` row is then updated, or deleted if the band has
+    too few matched stars.
+
+    Parameters
+    ----------
+    session :
+        The active SQLAlchemy session instance.
+    bandpasses : list
+        :class:`starplex.database.Bandpass` instances of the networks to
+        analyze. Their networks must already be prepared with
+        :func:`starplex.intercal.prepare_network`.
+    prior_zp_delta_key : str
+        Catalog metadata key of the prior zeropoint offsets.
+    commit_every : int
+        If set, commit the session after every ``commit_every`` catalog
+        pairs. By default nothing is committed.
+    n_boot : int
+        Number of bootstrap resamples used to estimate ``delta_err``.
+    seed :
+        Seed (or ``numpy.random`` generator) for the bootstrap.
+    match_radius : float
+        Cross-match radius, in arcseconds.
+    """
+    bandpass_ids = sorted(bp.id for bp in bandpasses)
+    edges = session.query(IntercalEdge).\
+        filter(IntercalEdge.bandpass_id.in_(bandpass_ids)).\
+        order_by(IntercalEdge.from_id, IntercalEdge.to_id,
+                 IntercalEdge.bandpass_id).\
+        all()
+    catalog_ids = set([e.from_id for e in edges]) \
+        | set([e.to_id for e in edges])
+    if len(catalog_ids) == 0:
+        return
+    metas = dict(session.query(Catalog.id, Catalog.meta).
+                 filter(Catalog.id.in_(catalog_ids)).
+                 all())
+    rng = make_rng(seed)
+    pairs = groupby(edges, key=lambda e: (e.from_id, e.to_id))
+    for i, ((from_id, to_id), pair_edges) in enumerate(pairs):
+        if commit_every is not None and i > 0 and i % commit_every == 0:
+            session.commit()
+        pair_edges = list(pair_edges)
+        band_ids = [e.bandpass_id for e in pair_edges]
+        print "Edges {0} {1}".format([e.id for e in pair_edges], band_ids)
+        from_prior_zp = np.array([_prior_zp(metas[from_id],
+                                            prior_zp_delta_key, b)
+                                  for b in band_ids])
+        to_prior_zp = np.array([_prior_zp(metas[to_id],
+                                          prior_zp_delta_key, b)
+                                for b in band_ids])
+        with Timer() as timer:
+            try:
+                phot = _xmatch_multiband(session, pair_edges[0], band_ids,
+                                         match_radius)
+            except NoOverlappingStars:
+                # These edges are useless, so delete them
+                for edge in pair_edges:
+                    session.delete(edge)
+                continue
+        print "Matched in {0:.1f} minutes".format(timer.interval / 60.)
+        band_index = np.searchsorted(band_ids, phot['bandpass_id'])
+        delta = (phot['from_mag'] + from_prior_zp[band_index]) \
+            - (phot['to_mag'] + to_prior_zp[band_index])
+        delta_err = np.hypot(phot['from_mag_err'], phot['to_mag_err'])
+        mean, mean_err, n_used = batch_zp_deltas(
+            band_index, delta, delta_err, len(band_ids),
+            n_boot=n_boot, rng=rng)
+        for k, edge in enumerate(pair_edges):
+            if not np.isfinite(mean[k]):
+                # This edge is useless, so delete it
+                session.delete(edge)
+                continue
+            _set_edge(edge, mean[k], mean_err[k], n_used[k],
+                      from_prior_zp[k], to_prior_zp[k])
+    if commit_every is not None:
+        session.commit()
+
+
+def analyze_network_parallel(session, bandpass, processes,
+                             prior_zp_delta_key='zp_offset',
+                             commit_every=100, cache_bytes=None,
+                             n_boot=1000, seed=None, stats_batch=None,
+                             pair_radius=None, incremental=False,
+                             use_stars=False):
+    """Compute zeropoint offsets for all edges of the network using several
+    worker processes.
+
+    The network's :class:`IntercalEdge` IDs are split into ``processes``
+    disjoint pages. Each worker opens its own engine and session, runs
+    :func:`analyze_network` on its page, and commits its results in batches
+    of ``commit_every`` edges.
+
+    Parameters
+    ----------
+    session :
+        The active SQLAlchemy session instance, used to list the edges.
+    bandpass : :class:`starplex.database.Bandpass`
+        Bandpass of the network to analyze.
+    processes : int
+        Number of worker processes.
+    prior_zp_delta_key : str
+        Catalog metadata key of the prior zeropoint offsets.
+    commit_every : int
+        Number of edges each worker analyzes between commits.
+    cache_bytes : int
+        Size of each worker's photometry cache (see :func:`analyze_network`;
+        at most one of ``cache_bytes``, ``pair_radius`` and ``use_stars``
+        can be set).
+    n_boot : int
+        Number of bootstrap resamples used to estimate ``delta_err``.
+    seed : int
+        Base seed of the bootstrap; each page is seeded with ``seed`` plus
+        its page number.
+    stats_batch : int
+        Number of edges whose statistics are computed together (see
+        :func:`analyze_network`).
+    pair_radius : float
+        Match radius of stored cross-match pairs (see
+        :func:`analyze_network`).
+    incremental : bool
+        If ``True``, only analyze edges that are out of date (see
+        :func:`stale_edge_ids`). Stale edges are found once, before the
+        pages are split, so the work stays balanced.
+    use_stars : bool
+        Take cross-matches from compiled star memberships (see
+        :func:`analyze_network`).
+    """
+    _check_match_options(cache_bytes, pair_radius, use_stars)
+    if incremental:
+        edge_ids = stale_edge_ids(session, bandpass,
+                                  prior_zp_delta_key=prior_zp_delta_key)
+    else:
+        edge_ids = [r[0] for r in session.query(IntercalEdge.id).
+                    filter(IntercalEdge.bandpass_id == bandpass.id).
+                    order_by(IntercalEdge.id).
+                    all()]
+    if len(edge_ids) == 0:
+        return
+    pages = [page.tolist() for page in np.array_split(edge_ids, processes)
+             if len(page) > 0]
+    url = session.get_bind().url
+    jobs = [(url, bandpass.id, page, prior_zp_delta_key, commit_every,
+             cache_bytes, n_boot, seed + i if seed is not None else None,
+             stats_batch, pair_radius, use_stars)
+            for i, page in enumerate(pages)]
+    pool = multiprocessing.Pool(processes)
+    try:
+        pool.map(_analyze_page, jobs)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _analyze_page(args):
+    """Worker for :func:`analyze_network_parallel` that analyzes a page of
+    edges in its own engine and session.
+    """
+    url, bandpass_id, edge_ids, prior_zp_delta_key, commit_every, \
+        cache_bytes, n_boot, seed, stats_batch, pair_radius, use_stars = args
+    engine = create_engine(url)
+    session = sessionmaker(bind=engine)()
+    try:
+        bandpass = session.query(Bandpass).\
+            filter(Bandpass.id == bandpass_id).\
+            one()
+        analyze_network(session, bandpass,
+                        prior_zp_delta_key=prior_zp_delta_key,
+                        edge_ids=edge_ids,
+                        commit_every=commit_every,
+                        cache_bytes=cache_bytes,
+                        n_boot=n_boot, seed=seed,
+                        stats_batch=stats_batch,
+                        pair_radius=pair_radius,
+                        use_stars=use_stars)
+    except:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+        engine.dispose()
+
+
+def _compute_zp_delta(session, edge, from_prior_zp, to_prior_zp,
+                      phot_cache=None, n_boot=1000, rng=None,
+                      pair_radius=None):
+    """Compute photometric zeropoint difference between two catalogs.
+
+    Returns
+    -------
+    mean, mean_err : float
+        Zeropoint difference and its bootstrap uncertainty.
+    n_stars : int
+        Number of matched stars used.
+    """
+    delta, delta_err = _match_deltas(session, edge,
+                                     from_prior_zp, to_prior_zp,
+                                     phot_cache=phot_cache,
+                                     pair_radius=pair_radius)
     print "Number of diffs:", len(delta)
     if len(delta) < 5:
         raise NoOverlappingStars
-    delta_err = np.hypot(phot['from_mag_err'], phot['to_mag_err'])
     filtered_phot = astropy.stats.funcs.sigma_clip(delta, sig=3)
     filtered_delta = filtered_phot.data[~filtered_phot.mask]
     print "Number of filtered diffs", len(filtered_delta)
@@ -89,14 +497,40 @@ def _compute_zp_delta(session, edge, from_prior_zp, to_prior_zp):
     mean = _weighted_mean(filtered_delta, filtered_delta_err)
 
     # Do a bootstrap uncertainty analysis
-    means = []
-    for i in xrange(1000):
-        idx = np.random.randint(low=0,
-                                high=filtered_delta.shape[0] - 1,
-                                size=delta.shape)
-        m = _weighted_mean(filtered_delta[idx], filtered_delta_err[idx])
-        means.append(m)
-    return mean, np.std(np.array(means))
+    means = bootstrap_weighted_mean(filtered_delta, filtered_delta_err,
+                                    n_boot=n_boot, rng=rng)
+    return mean, np.std(means), len(filtered_delta)
+
+
+def _match_deltas(session, edge, from_prior_zp, to_prior_zp,
+                  phot_cache=None, pair_radius=None):
+    """Cross-match the stars of an edge and return the magnitude
+    differences (with prior ZP offsets applied) and their uncertainties.
+
+    The stars are matched from the pairs stored at ``pair_radius`` if it is
+    set, from ``phot_cache`` (a photometry cache or compiled star matches)
+    if it is set, or else with a q3c join. Setting both raises
+    ``ValueError``.
+    """
+    if pair_radius is not None and phot_cache is not None:
+        raise ValueError("Set only one of phot_cache and pair_radius")
+    with Timer() as timer:
+        if pair_radius is not None:
+            phot = _xmatch_pairs(session, edge, pair_radius)
+        elif phot_cache is not None:
+            phot = phot_cache.xmatch(edge)
+        else:
+            phot = _xmatch(session, edge)
+    print "Matched in {0:.1f} minutes".format(timer.interval / 60.)
+
+    # Apply prior ZP offsets
+    phot['from_mag'] += from_prior_zp
+    phot['to_mag'] += to_prior_zp
+
+    # Compute zeropoint shift
+    delta = phot['from_mag'] - phot['to_mag']
+    delta_err = np.hypot(phot['from_mag_err'], phot['to_mag_err'])
+    return delta, delta_err
 
 
 class NoOverlappingStars(BaseException):
@@ -121,7 +555,7 @@ def _xmatch(session, edge):
     from_bp = aliased(Bandpass)
     to_bp = aliased(Bandpass)
 
-    overlap_polygon = _make_q3c_polygon(_get_overlap_polygon(session, edge))
+    overlap_polygon = _q3c_overlap_polygon(session, edge)
     q = session.query(from_obs.mag,
                       from_obs.mag_err,
                       to_obs.mag,
@@ -152,15 +586,87 @@ def _xmatch(session, edge):
     return data
 
 
+def _xmatch_pairs(session, edge, match_radius):
+    """Join photometric measurements of the stored cross-match pairs of an
+    edge, cross-matching and storing the pairs first if none are stored at
+    this match radius.
+    """
+    if edge.pair_radius != match_radius \
+            and not has_pairs(session, edge, match_radius):
+        overlap_polygon = _q3c_overlap_polygon(session, edge)
+        store_pairs(session, edge, match_radius, overlap_polygon)
+    return read_pairs(session, edge, match_radius)
+
+
+def _xmatch_multiband(session, edge, bandpass_ids, match_radius=1.):
+    """Join photometric measurements of the two catalogs of an edge in
+    several bandpasses with a single cross-match.
+
+    Returns
+    -------
+    data : ndarray
+        Structured array with ``bandpass_id``, ``from_mag``,
+        ``from_mag_err``, ``to_mag`` and ``to_mag_err`` fields, with one
+        row per matched star and bandpass observed in both catalogs.
+    """
+    from_cstar = aliased(CatalogStar)
+    to_cstar = aliased(CatalogStar)
+    from_obs = aliased(Observation)
+    to_obs = aliased(Observation)
+
+    overlap_polygon = _q3c_overlap_polygon(session, edge)
+    q = session.query(from_obs.bandpass_id,
+                      from_obs.mag,
+                      from_obs.mag_err,
+                      to_obs.mag,
+                      to_obs.mag_err).\
+        filter(to_cstar.catalog_id == edge.to_id).\
+        filter(from_cstar.catalog_id == edge.from_id).\
+        filter(func.q3c_poly_query(to_cstar.ra,
+                                   to_cstar.dec,
+                                   overlap_polygon)).\
+        filter(func.q3c_join(to_cstar.ra,
+                             to_cstar.dec,
+                             from_cstar.ra,
+                             from_cstar.dec,
+                             match_radius / 3600.)).\
+        filter(from_obs.catalog_star_id == from_cstar.id).\
+        filter(to_obs.catalog_star_id == to_cstar.id).\
+        filter(from_obs.bandpass_id.in_(bandpass_ids)).\
+        filter(to_obs.bandpass_id == from_obs.bandpass_id)
+    dt = np.dtype([('bandpass_id', int)] + XMATCH_DTYPE.descr)
+    return np.array(q.all(), dtype=dt)
+
+
+def _q3c_overlap_polygon(session, edge):
+    """Overlap polygon of an edge in q3c (flattened) list format, as stored
+    on the edge by :func:`starplex.intercal.prepare_network`, or computed
+    from the overlap graph if it is not stored.
+    """
+    if edge.overlap_poly is not None:
+        return list(edge.overlap_poly)
+    return _make_q3c_polygon(_get_overlap_polygon(session, edge))
+
+
 def _get_overlap_polygon(session, edge):
-    """Get polygon of the overlap area of this graph edge."""
-    principal_catalog = session.query(Catalog).\
-        filter(Catalog.id == edge.from_id).\
-        one()
-    cat_overlaps = CatalogOverlaps(session, principal_catalog)
-    cat_overlaps.query = cat_overlaps.query.filter(Catalog.id == edge.to_id)
-    part = cat_overlaps.clips[0][0]  # to get just one polygon
-    s = to_shape(part)
+    """Get polygon of the overlap area of this graph edge.
+
+    Raises :class:`NoOverlappingStars` if the catalogs have no overlap
+    graph row, or if their overlap has no polygon part (e.g. the footprints
+    only touch along an edge).
+    """
+    overlap = CatalogOverlap.pair(session, edge.from_id, edge.to_id)
+    if overlap is None or overlap.clip is None:
+        raise NoOverlappingStars
+    s = to_shape(overlap.clip)
+    if hasattr(s, 'geoms'):
+        # use the largest polygon part of a multi-part overlap
+        parts = [g for g in s.geoms if g.geom_type == 'Polygon']
+        if len(parts) == 0:
+            raise NoOverlappingStars
+        s = max(parts, key=lambda g: g.area)
+    elif s.geom_type != 'Polygon':
+        raise NoOverlappingStars
     x, y = s.exterior.xy
     poly = np.array(zip(x, y))
     return poly
@@ -0,0 +1,273 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Scaling benchmark of the intercal network solvers on synthetic mosaics.
+
+Synthetic networks have known true zeropoints, noisy zeropoint differences
+and a fraction of reference fields. Two layouts are generated:
+
+- ``'grid'``: fields on a square grid, each overlapping its horizontal,
+  vertical and diagonal neighbours.
+- ``'random'``: fields scattered at random, overlapping every field within
+  a radius chosen for a given mean number of neighbours (only the largest
+  connected component is kept).
+
+Each solver path of :func:`starplex.intercal.solve_network` is run in a
+fresh worker process that builds its own network, reporting the wall time,
+the peak resident memory added by the solve and the RMS error of the
+recovered zeropoints. No database is needed. Run it with
+``scripts/starplex_intercal_benchmark.py``.
+"""
+
+import multiprocessing
+import resource
+import sys
+
+import numpy as np
+from scipy.spatial import cKDTree
+from scipy.sparse.csgraph import connected_components
+import scipy.sparse
+
+from ..utils.timer import Timer
+from .solve import _solve, _zeropoint_errors
+
+
+# (solver, use_cython) paths and the largest network each is run on by
+# default; basinhopping with Nelder-Mead does not scale past small networks.
+SOLVER_PATHS = [
+    ('basinhopping', True, 100),
+    ('basinhopping', False, 100),
+    ('L-BFGS-B', True, 100000),
+    ('L-BFGS-B', False, 100000),
+    ('CG', True, 100000),
+    ('lsqr', False, 100000),
+    ('lsmr', False, 100000),
+    ('normal', False, 100000),
+]
+
+NETWORK_DTYPE = np.dtype([('from_id', int), ('to_id', int),
+                          ('delta', float), ('delta_err', float)])
+
+
+def grid_mosaic(n_fields, reference_fraction=0.05, zp_scatter=0.05,
+                err_range=(0.005, 0.02), seed=0):
+    """Synthetic network of fields on a square grid.
+
+    Parameters
+    ----------
+    n_fields : int
+        Approximate number of fields; rounded to a square grid.
+    reference_fraction : float
+        Fraction of fields that are zeropoint references (at least one).
+    zp_scatter : float
+        Standard deviation of the true zeropoints.
+    err_range : tuple
+        Range of the uniformly distributed ``delta_err``.
+    seed : int
+        Seed of the random network.
+
+    Returns
+    -------
+    catalog_ids : list
+        Sorted catalog IDs.
+    network : ndarray
+        Structured array of edges, as read by
+        :func:`starplex.intercal.solve_network`.
+    is_reference : ndarray
+        Boolean array, ``True`` for reference fields.
+    zp : ndarray
+        True zeropoint correction of each field relative to its (zero)
+        prior; zero for the reference fields.
+    """
+    side = max(int(round(np.sqrt(n_fields))), 2)
+    index = np.arange(side * side).reshape(side, side)
+    pairs = [(index[:, :-1], index[:, 1:]),  # horizontal
+             (index[:-1, :], index[1:, :]),  # vertical
+             (index[:-1, :-1], index[1:, 1:]),  # diagonals
+             (index[:-1, 1:], index[1:, :-1])]
+    i = np.concatenate([a.flatten() for a, b in pairs])
+    j = np.concatenate([b.flatten() for a, b in pairs])
+    return _make_network(side * side, i, j, reference_fraction, zp_scatter,
+                         err_range, np.random.RandomState(seed))
+
+
+def random_mosaic(n_fields, mean_degree=6., reference_fraction=0.05,
+                  zp_scatter=0.05, err_range=(0.005, 0.02), seed=0):
+    """Synthetic network of randomly placed, overlapping fields.
+
+    Fields are scattered uniformly in a unit square and overlap all fields
+    within a radius giving ``mean_degree`` neighbours on average. Only the
+    largest connected component is kept, so the network may have somewhat
+    fewer than ``n_fields`` fields. Other parameters and the returned
+    values are as for :func:`grid_mosaic`.
+    """
+    rs = np.random.RandomState(seed)
+    xy = rs.uniform(0., 1., size=(n_fields, 2))
+    radius = np.sqrt(mean_degree / (np.pi * n_fields))
+    pairs = np.array(sorted(cKDTree(xy).query_pairs(radius)), dtype=int)
+    pairs = pairs.reshape(-1, 2)
+    # keep the largest connected component
+    adjacency = scipy.sparse.coo_matrix(
+        (np.ones(len(pairs)), (pairs[:, 0], pairs[:, 1])),
+        shape=(n_fields, n_fields)).tocsr()
+    _, labels = connected_components(adjacency, directed=False)
+    largest = np.argmax(np.bincount(labels))
+    keep = np.where(labels == largest)[0]
+    relabel = -np.ones(n_fields, dtype=int)
+    relabel[keep] = np.arange(len(keep))
+    pairs = relabel[pairs]
+    pairs = pairs[(pairs >= 0).all(axis=1)]
+    return _make_network(len(keep), pairs[:, 0], pairs[:, 1],
+                         reference_fraction, zp_scatter, err_range, rs)
+
+
+def _make_network(n_fields, i, j, reference_fraction, zp_scatter,
+                  err_range, rs):
+    """Build the network arrays of fields joined by edges ``i -> j``."""
+    catalog_ids = np.arange(1, n_fields + 1)
+    zp = zp_scatter * rs.randn(n_fields)
+    n_ref = max(int(reference_fraction * n_fields), 1)
+    is_reference = np.zeros(n_fields, dtype=bool)
+    is_reference[rs.permutation(n_fields)[:n_ref]] = True
+    # references are calibrated, so their priors (zero) are exact
+    zp[is_reference] = 0.
+    network = np.zeros(len(i), dtype=NETWORK_DTYPE)
+    network['from_id'] = catalog_ids[i]
+    network['to_id'] = catalog_ids[j]
+    network['delta_err'] = rs.uniform(err_range[0], err_range[1], len(i))
+    network['delta'] = zp[j] - zp[i] \
+        + network['delta_err'] * rs.randn(len(i))
+    return catalog_ids.tolist(), network, is_reference, zp
+
+
+def recovery_rms(z, zp, is_reference):
+    """RMS zeropoint error after normalizing the solution so that the
+    reference fields match their true zeropoints on average, as
+    :func:`starplex.intercal.solve_network` does with the priors.
+    """
+    z = z - np.mean(z[is_reference] - zp[is_reference])
+    return np.sqrt(np.mean((z - zp) ** 2.))
+
+
+MOSAICS = {'grid': grid_mosaic, 'random': random_mosaic}
+
+
+def run_solver(layout, n_fields, solver, use_cython, estimate_errors=False,
+               seed=0):
+    """Run one solver path on a synthetic mosaic in a fresh worker process.
+
+    The network is built inside the worker, so the parent process never
+    holds the networks, and the worker's peak memory is measured relative
+    to a baseline taken once the network is built.
+
+    Parameters
+    ----------
+    layout : str
+        Network layout, ``'grid'`` or ``'random'``.
+    n_fields : int
+        Number of fields of the synthetic network.
+    solver : str
+        Solver name (see ``SOLVER_PATHS``).
+    use_cython : bool
+        Use the Cython objective function.
+    estimate_errors : bool
+        Also time the zeropoint uncertainty estimate.
+    seed : int
+        Seed of the synthetic network.
+
+    Returns
+    -------
+    result : dict
+        ``n_fields`` and ``n_edges`` of the network, ``time``, the wall
+        time of the solve in seconds, ``peak_mb``, the growth of the peak
+        resident memory of the worker during the solve in MB, ``rms``, the
+        RMS zeropoint recovery error, and, with ``estimate_errors``,
+        ``err_time``, the time to estimate the zeropoint uncertainties.
+    """
+    pool = multiprocessing.Pool(1)
+    try:
+        return pool.apply(_run_solver,
+                          ((layout, n_fields, solver, use_cython,
+                            estimate_errors, seed),))
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _run_solver(args):
+    """Worker for :func:`run_solver`."""
+    layout, n_fields, solver, use_cython, estimate_errors, seed = args
+    catalog_ids, network, is_reference, zp = MOSAICS[layout](n_fields,
+                                                             seed=seed)
+    baseline_mb = _peak_memory_mb()
+    with Timer() as timer:
+        z = _solve(catalog_ids, network, is_reference, solver, use_cython)
+    result = {'n_fields': len(catalog_ids),
+              'n_edges': len(network),
+              'time': timer.interval,
+              'rms': recovery_rms(z, zp, is_reference)}
+    if estimate_errors:
+        with Timer() as timer:
+            _zeropoint_errors(catalog_ids, network, is_reference)
+        result['err_time'] = timer.interval
+    result['peak_mb'] = _peak_memory_mb() - baseline_mb
+    return result
+
+
+def _peak_memory_mb():
+    """Peak resident memory of this process in MB."""
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return maxrss / 1024. ** 2.  # bytes
+    return maxrss / 1024.  # kilobytes
+
+
+def run_benchmark(sizes=(10, 100, 1000, 10000, 100000),
+                  layouts=('grid', 'random'), solvers=None,
+                  estimate_errors=False, seed=0):
+    """Run every solver path on synthetic mosaics of increasing size.
+
+    Parameters
+    ----------
+    sizes : list
+        Numbers of fields of the synthetic networks.
+    layouts : list
+        Network layouts, ``'grid'`` and/or ``'random'``.
+    solvers : list
+        Optional list of solver names to run (see ``SOLVER_PATHS``). Each
+        path is only run on networks up to its size limit.
+    estimate_errors : bool
+        Also time the zeropoint uncertainty estimate.
+    seed : int
+        Seed of the synthetic networks.
+
+    Returns
+    -------
+    results : list
+        One dict per run, with the ``layout``, ``solver`` and ``cython`` of
+        the run along with the results of :func:`run_solver`.
+    """
+    results = []
+    print "{0:>7s} {1:>8s} {2:>8s} {3:>13s} {4:>6s} {5:>9s} {6:>9s} " \
+        "{7:>9s}".format('layout', 'fields', 'edges', 'solver', 'cython',
+                         'time (s)', 'peak (MB)', 'rms')
+    for layout in layouts:
+        for size in sizes:
+            for solver, use_cython, max_fields in SOLVER_PATHS:
+                if solvers is not None and solver not in solvers:
+                    continue
+                if size > max_fields:
+                    continue
+                result = run_solver(layout, size, solver, use_cython,
+                                    estimate_errors=estimate_errors,
+                                    seed=seed)
+                result.update({'layout': layout,
+                               'solver': solver,
+                               'cython': use_cython})
+                results.append(result)
+                print "{0:>7s} {1:8d} {2:8d} {3:>13s} {4:>6s} {5:9.3f} " \
+                    "{6:9.1f} {7:9.2e}".format(
+                        layout, result['n_fields'], result['n_edges'],
+                        solver, str(use_cython), result['time'],
+                        result['peak_mb'], result['rms'])
+    return results
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Decompose the intercal network into connected components.
+
+Fields in different connected components of the overlap graph share no
+edges, so their zeropoints are independent and each component can be
+solved (and normalized against its own reference fields) separately.
+"""
+
+import numpy as np
+import scipy.sparse
+from scipy.sparse.csgraph import connected_components, minimum_spanning_tree
+
+from .linsolve import index_network
+
+
+def network_components(catalog_ids, network):
+    """Label the connected component of each catalog in the network.
+
+    Parameters
+    ----------
+    catalog_ids : list
+        Sorted catalog IDs of the network (the parameter vector).
+    network : ndarray
+        Structured array of edges with ``from_id`` and ``to_id`` fields.
+
+    Returns
+    -------
+    n_components : int
+        Number of connected components.
+    labels : ndarray
+        Component label of each catalog in ``catalog_ids``.
+    """
+    n = len(catalog_ids)
+    from_index, to_index = index_network(catalog_ids, network)
+    adjacency = scipy.sparse.coo_matrix(
+        (np.ones(len(from_index)), (from_index, to_index)),
+        shape=(n, n)).tocsr()
+    return connected_components(adjacency, directed=False)
+
+
+def split_network(catalog_ids, network, labels):
+    """Split the network into one sub-network per connected component.
+
+    Returns
+    -------
+    components : list
+        List of ``(index, component_catalog_ids, component_network)`` where
+        ``index`` are the positions of the component's catalogs in
+        ``catalog_ids``.
+    """
+    catalog_ids = np.asarray(catalog_ids)
+    from_index, _ = index_network(catalog_ids, network)
+    edge_labels = labels[from_index]
+    edge_order = np.argsort(edge_labels, kind='mergesort')
+    edge_bounds = np.searchsorted(edge_labels[edge_order],
+                                  np.arange(labels.max() + 2))
+    components = []
+    for label in xrange(labels.max() + 1):
+        index = np.where(labels == label)[0]
+        edges = edge_order[edge_bounds[label]:edge_bounds[label + 1]]
+        components.append((index, catalog_ids[index].tolist(),
+                           network[edges]))
+    return components
+
+
+def backbone_edges(n_fields, from_index, to_index, cost):
+    """Find a minimum-cost spanning forest of the network.
+
+    The forest has the same connected components as the full network, so
+    every other edge can be removed without disconnecting any field from
+    the reference fields of its component.
+
+    Parameters
+    ----------
+    n_fields : int
+        Number of fields (parameters).
+    from_index, to_index : ndarray
+        Parameter indices of the fields at either end of each edge.
+    cost : ndarray
+        Positive cost of each edge, such as its ``delta_err``.
+
+    Returns
+    -------
+    backbone : ndarray
+        Boolean array, ``True`` for edges in the spanning forest. Of
+        several edges between the same pair of fields, only the cheapest
+        can be in the forest.
+    """
+    from_index = np.asarray(from_index)
+    to_index = np.asarray(to_index)
+    cost = np.asarray(cost, dtype=float)
+    backbone = np.zeros(len(cost), dtype=bool)
+    if len(cost) == 0:
+        return backbone
+    # undirected pair codes; keep the cheapest edge of each pair
+    lo = np.minimum(from_index, to_index)
+    hi = np.maximum(from_index, to_index)
+    codes = lo * n_fields + hi
+    order = np.lexsort((cost, codes))
+    first = np.concatenate(([True], codes[order][1:] != codes[order][:-1]))
+    unique_edges = order[first]
+    graph = scipy.sparse.coo_matrix(
+        (cost[unique_edges], (lo[unique_edges], hi[unique_edges])),
+        shape=(n_fields, n_fields)).tocsr()
+    tree = minimum_spanning_tree(graph).tocoo()
+    tree_codes = np.minimum(tree.row, tree.col) * n_fields \
+        + np.maximum(tree.row, tree.col)
+    # map tree pairs back to their (cheapest) edges
+    unique_codes = codes[unique_edges]
+    backbone[unique_edges[np.searchsorted(unique_codes, tree_codes)]] = True
+    return backbone
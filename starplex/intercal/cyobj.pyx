@@ -1,23 +1,52 @@
+import numpy as np
+from cython.parallel import prange
+
+
 cdef class IntercalObjective:
     # Memoryviews - all are 1D, length n_terms
     cdef long [:] from_index
     cdef long [:] to_index
     cdef double[:] delta
+    # Inverse uncertainty of each term, so that the objective is chi-square
     cdef double [:] weight
 
     # Number of terms in obj func (edges in network)
     cdef long n_terms
 
+    # Number of parameters (fields in network)
+    cdef long n_params
+
+    # Edge indices sorted by from/to parameter, with CSR-style pointers,
+    # so the gradient can be accumulated per parameter without races.
+    cdef long [:] from_order
+    cdef long [:] from_ptr
+    cdef long [:] to_order
+    cdef long [:] to_ptr
+
     def __init__(self, long[:] from_index,
                        long[:] to_index,
                        double[:] delta,
                        double[:] weight,
-                       long n_terms):
+                       long n_terms,
+                       long n_params=-1):
         self.from_index = from_index
         self.to_index = to_index
         self.delta = delta
         self.weight = weight
         self.n_terms = n_terms
+        fi = np.asarray(from_index)
+        ti = np.asarray(to_index)
+        if n_params < 0:
+            n_params = max(fi.max(), ti.max()) + 1
+        self.n_params = n_params
+        self.from_order = np.argsort(fi, kind='mergesort').astype(np.int_)
+        self.to_order = np.argsort(ti, kind='mergesort').astype(np.int_)
+        self.from_ptr = np.concatenate(
+            ([0], np.cumsum(np.bincount(fi, minlength=n_params)))
+        ).astype(np.int_)
+        self.to_ptr = np.concatenate(
+            ([0], np.cumsum(np.bincount(ti, minlength=n_params)))
+        ).astype(np.int_)
 
     def __call__(self, double[:] x):
         cdef long i
@@ -29,3 +58,41 @@ cdef class IntercalObjective:
                                   - x[self.to_index[i]])
             F += f * f
         return F
+
+    def value_and_grad(self, double[:] x, bint parallel=False):
+        """Return the objective value and its gradient with respect to
+        ``x``. With ``parallel=True`` the edge and parameter loops run
+        across OpenMP threads (if the extension is built with OpenMP).
+        """
+        cdef long i, k, p
+        cdef double F = 0.
+        cdef double f
+        cdef double gp
+        cdef double[:] g = np.empty(self.n_terms, dtype=np.float64)
+        grad_arr = np.zeros(self.n_params, dtype=np.float64)
+        cdef double[:] grad = grad_arr
+
+        if parallel:
+            for i in prange(self.n_terms, nogil=True):
+                f = self.weight[i] * (self.delta[i]
+                                      + x[self.from_index[i]]
+                                      - x[self.to_index[i]])
+                F += f * f
+                g[i] = 2. * self.weight[i] * f
+            for p in prange(self.n_params, nogil=True):
+                gp = 0.
+                for k in range(self.from_ptr[p], self.from_ptr[p + 1]):
+                    gp = gp + g[self.from_order[k]]
+                for k in range(self.to_ptr[p], self.to_ptr[p + 1]):
+                    gp = gp - g[self.to_order[k]]
+                grad[p] = gp
+        else:
+            for i in range(self.n_terms):
+                f = self.weight[i] * (self.delta[i]
+                                      + x[self.from_index[i]]
+                                      - x[self.to_index[i]])
+                F += f * f
+                f = 2. * self.weight[i] * f
+                grad[self.from_index[i]] += f
+                grad[self.to_index[i]] -= f
+        return F, grad_arr
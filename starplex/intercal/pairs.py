@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Persistent cross-match pairs for intercal edges.
+
+The matched ``(from_catalog_star_id, to_catalog_star_id)`` pairs of each
+edge are stored once in the ``intercal_pair`` table, keyed by edge and match
+radius. Re-analyzing the network with new priors, clipping or bootstrap
+settings is then an indexed read of the stored pairs joined to their
+observations.
+"""
+
+import numpy as np
+
+from sqlalchemy import func, select, literal
+from sqlalchemy.orm import aliased
+
+from ..database import CatalogStar, Observation, IntercalPair
+from ..database.meta.schema import utcnow
+from .photcache import XMATCH_DTYPE
+
+
+def store_pairs(session, edge, match_radius, overlap_polygon):
+    """Cross-match the stars of an edge in the database and store the pairs.
+
+    Any pairs previously stored for the edge at this match radius are
+    replaced; pairs stored at other radii are kept. Note that the change is
+    *not* committed.
+
+    Parameters
+    ----------
+    session :
+        The active SQLAlchemy session instance.
+    edge : :class:`starplex.database.IntercalEdge`
+        The edge to cross-match.
+    match_radius : float
+        Cross-match radius, in arcseconds.
+    overlap_polygon : list
+        Overlap polygon of the edge in q3c (flattened) list format.
+    """
+    pairs = IntercalPair.__table__
+    session.execute(pairs.delete()
+                    .where(pairs.c.edge_id == edge.id)
+                    .where(pairs.c.match_radius == float(match_radius)))
+    from_cs = CatalogStar.__table__.alias('from_cs')
+    to_cs = CatalogStar.__table__.alias('to_cs')
+    sel = select([literal(edge.id), literal(float(match_radius)),
+                  from_cs.c.id, to_cs.c.id, utcnow(), utcnow()])\
+        .where(from_cs.c.catalog_id == edge.from_id)\
+        .where(to_cs.c.catalog_id == edge.to_id)\
+        .where(func.q3c_poly_query(to_cs.c.ra, to_cs.c.dec,
+                                   overlap_polygon))\
+        .where(func.q3c_join(to_cs.c.ra, to_cs.c.dec,
+                             from_cs.c.ra, from_cs.c.dec,
+                             match_radius / 3600.))
+    session.execute(pairs.insert().from_select(
+        [pairs.c.edge_id, pairs.c.match_radius,
+         pairs.c.from_catalog_star_id, pairs.c.to_catalog_star_id,
+         pairs.c.created_at, pairs.c.updated_at],
+        sel))
+    edge.pair_radius = float(match_radius)
+
+
+def has_pairs(session, edge, match_radius):
+    """``True`` if cross-match pairs are stored for an edge at this match
+    radius.
+    """
+    return session.query(IntercalPair.id)\
+        .filter(IntercalPair.edge_id == edge.id)\
+        .filter(IntercalPair.match_radius == float(match_radius))\
+        .first() is not None
+
+
+def read_pairs(session, edge, match_radius, bandpass_id=None):
+    """Read the photometry of an edge's stored pairs.
+
+    Parameters
+    ----------
+    session :
+        The active SQLAlchemy session instance.
+    edge : :class:`starplex.database.IntercalEdge`
+        The edge whose pairs are read.
+    match_radius : float
+        Cross-match radius of the stored pairs, in arcseconds.
+    bandpass_id : int
+        Bandpass of the photometry; defaults to the edge's bandpass.
+
+    Returns
+    -------
+    data : ndarray
+        Structured array with ``from_mag``, ``from_mag_err``, ``to_mag``
+        and ``to_mag_err`` fields.
+    """
+    if bandpass_id is None:
+        bandpass_id = edge.bandpass_id
+    from_obs = aliased(Observation)
+    to_obs = aliased(Observation)
+    q = session.query(from_obs.mag, from_obs.mag_err,
+                      to_obs.mag, to_obs.mag_err).\
+        select_from(IntercalPair).\
+        join(from_obs,
+             from_obs.catalog_star_id == IntercalPair.from_catalog_star_id).\
+        join(to_obs,
+             to_obs.catalog_star_id == IntercalPair.to_catalog_star_id).\
+        filter(IntercalPair.edge_id == edge.id).\
+        filter(IntercalPair.match_radius == float(match_radius)).\
+        filter(from_obs.bandpass_id == bandpass_id).\
+        filter(to_obs.bandpass_id == bandpass_id)
+    return np.array(q.all(), dtype=XMATCH_DTYPE)
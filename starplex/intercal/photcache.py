@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Memory-bounded cache of per-catalog photometry for intercal cross-matching.
+
+Rather than running a q3c join in Postgres for every edge, the photometry of
+each (catalog, bandpass) pair is read once into contiguous NumPy arrays and
+edges are matched locally with a KD-tree. Catalogs are evicted in
+least-recently-used order once the cache exceeds its memory budget.
+"""
+
+from collections import OrderedDict
+import math
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from ..database import CatalogStar, Observation
+
+
+XMATCH_DTYPE = np.dtype([('from_mag', float),
+                         ('from_mag_err', float),
+                         ('to_mag', float),
+                         ('to_mag_err', float)])
+
+
+class CatalogPhotometry(object):
+    """Photometry of one catalog in one bandpass.
+
+    Attributes
+    ----------
+    ra, dec, mag, mag_err : ndarray
+        Contiguous arrays, one entry per observed star.
+    """
+    def __init__(self, ra, dec, mag, mag_err):
+        super(CatalogPhotometry, self).__init__()
+        self.ra = np.ascontiguousarray(ra, dtype=float)
+        self.dec = np.ascontiguousarray(dec, dtype=float)
+        self.mag = np.ascontiguousarray(mag, dtype=float)
+        self.mag_err = np.ascontiguousarray(mag_err, dtype=float)
+        self._tree = None
+
+    def __len__(self):
+        return self.ra.shape[0]
+
+    @property
+    def xyz(self):
+        """Unit vectors of the star positions, (n, 3)."""
+        ra = np.radians(self.ra)
+        dec = np.radians(self.dec)
+        return np.column_stack((np.cos(dec) * np.cos(ra),
+                                np.cos(dec) * np.sin(ra),
+                                np.sin(dec)))
+
+    @property
+    def tree(self):
+        """KD-tree of the star positions (built on first use)."""
+        if self._tree is None:
+            self._tree = cKDTree(self.xyz)
+        return self._tree
+
+    @property
+    def nbytes(self):
+        """Approximate memory footprint, including the KD-tree."""
+        n = self.ra.nbytes + self.dec.nbytes + self.mag.nbytes \
+            + self.mag_err.nbytes
+        if self._tree is not None:
+            n += 2 * 3 * self.ra.nbytes  # positions and tree nodes
+        return n
+
+
+class PhotometryCache(object):
+    """LRU cache of :class:`CatalogPhotometry` keyed by
+    ``(catalog_id, bandpass_id)``.
+
+    Parameters
+    ----------
+    session :
+        The active SQLAlchemy session instance.
+    max_bytes : int
+        Memory budget of the cache. The least-recently-used catalogs are
+        evicted when it is exceeded.
+    match_radius : float
+        Cross-match radius, in arcseconds.
+    """
+    def __init__(self, session, max_bytes=512 * 1024 ** 2, match_radius=1.):
+        super(PhotometryCache, self).__init__()
+        self._s = session
+        self.max_bytes = max_bytes
+        self.match_radius = match_radius
+        self._cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def nbytes(self):
+        """Current memory footprint of the cache."""
+        return sum(p.nbytes for p in self._cache.values())
+
+    def get(self, catalog_id, bandpass_id):
+        """Photometry of a catalog in a bandpass, loaded from the database
+        on a cache miss.
+        """
+        key = (catalog_id, bandpass_id)
+        if key in self._cache:
+            self.hits += 1
+            phot = self._cache.pop(key)
+        else:
+            self.misses += 1
+            phot = self._load(catalog_id, bandpass_id)
+        self._cache[key] = phot  # most recently used
+        self._evict()
+        return phot
+
+    def _load(self, catalog_id, bandpass_id):
+        """Read a catalog's photometry in one query."""
+        q = self._s.query(CatalogStar.ra, CatalogStar.dec,
+                          Observation.mag, Observation.mag_err).\
+            join(Observation, Observation.catalog_star_id == CatalogStar.id).\
+            filter(CatalogStar.catalog_id == catalog_id).\
+            filter(Observation.bandpass_id == bandpass_id)
+        dt = np.dtype([('ra', float), ('dec', float),
+                       ('mag', float), ('mag_err', float)])
+        data = np.array(q.all(), dtype=dt)
+        return CatalogPhotometry(data['ra'], data['dec'],
+                                 data['mag'], data['mag_err'])
+
+    def _evict(self):
+        """Drop least-recently-used entries until within budget, always
+        keeping the most recent entry.
+        """
+        while len(self._cache) > 1 and self.nbytes > self.max_bytes:
+            self._cache.popitem(last=False)
+
+    def xmatch(self, edge):
+        """Join photometric measurements of the two catalogs of an edge.
+
+        Each star of the ``from`` catalog is matched to its nearest
+        neighbour in the ``to`` catalog within ``match_radius``.
+
+        Returns
+        -------
+        data : ndarray
+            Structured array with ``from_mag``, ``from_mag_err``,
+            ``to_mag`` and ``to_mag_err`` fields, as for
+            :func:`starplex.intercal.analyze._xmatch`.
+        """
+        to_phot = self.get(edge.to_id, edge.bandpass_id)
+        from_phot = self.get(edge.from_id, edge.bandpass_id)
+        return match_photometry(from_phot, to_phot, self.match_radius)
+
+
+def match_photometry(from_phot, to_phot, match_radius):
+    """Match two :class:`CatalogPhotometry` with the ``to`` catalog's
+    KD-tree.
+
+    Parameters
+    ----------
+    from_phot, to_phot : :class:`CatalogPhotometry`
+        Photometry of the two catalogs.
+    match_radius : float
+        Cross-match radius, in arcseconds.
+    """
+    if len(from_phot) == 0 or len(to_phot) == 0:
+        return np.zeros(0, dtype=XMATCH_DTYPE)
+    chord = 2. * math.sin(math.radians(match_radius / 3600.) / 2.)
+    dist, idx = to_phot.tree.query(from_phot.xyz, k=1,
+                                   distance_upper_bound=chord)
+    matched = np.where(np.isfinite(dist))[0]
+    data = np.empty(matched.shape[0], dtype=XMATCH_DTYPE)
+    data['from_mag'] = from_phot.mag[matched]
+    data['from_mag_err'] = from_phot.mag_err[matched]
+    data['to_mag'] = to_phot.mag[idx[matched]]
+    data['to_mag_err'] = to_phot.mag_err[idx[matched]]
+    return data
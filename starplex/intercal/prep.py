@@ -4,45 +4,208 @@
 Prepare a network of fields for inter-field calibration.
 """
 
-from ..database import Catalog, CatalogStar, Observation, IntercalEdge
-from ..database import CatalogOverlaps
+import numpy as np
 
+from sqlalchemy import func, select, literal, and_, or_, text
 
-def prepare_network(session, bandpass):
+from ..database import Catalog, IntercalEdge
+from ..database import CatalogOverlap, CatalogBandpass
+from ..database.meta.schema import utcnow
+from ..database.meta.moc import MOC, intersecting_pairs
+from ..database.meta.gistools import sq_meter_to_sq_degree
+
+
+def prepare_network(session, bandpass, use_moc=False, use_graph=True,
+                    min_moc_area=0., refine_moc=False):
     """Find the network of overlapping fields for this bandpass and prepare
     rows in the `intercal_edge` table.
+
+    The whole edge set is found and inserted in one ``INSERT ... SELECT``
+    statement. Each pair of overlapping catalogs gives one edge with
+    ``from_id < to_id``; pairs that already have an edge (in either
+    direction) are skipped. The overlap polygon of each edge is then stored
+    on the edge in q3c format with a single ``UPDATE`` (see
+    :func:`store_overlap_polygons`). Note that the change is *not*
+    committed.
+
+    Parameters
+    ----------
+    session :
+        The active SQLAlchemy session instance.
+    bandpass : :class:`starplex.database.Bandpass`
+        Bandpass of the network.
+    use_moc : bool
+        If ``True``, overlaps are found in-process from the intersections
+        of the catalogs' HEALPix coverages (``Catalog.moc``), in place of
+        the footprint polygons, and the new edges are inserted in bulk.
+        Catalogs without a coverage are left out.
+    use_graph : bool
+        If ``True`` (default), overlaps are read from the stored
+        ``catalog_overlap`` graph. Otherwise the footprints are intersected
+        with a spatial self-join over ``catalog``. Ignored with
+        ``use_moc``.
+    min_moc_area : float
+        With ``use_moc``, minimum area (square meters) of the intersection
+        of two coverages for the catalogs to get an edge. Coverages are
+        supersets of the footprints, so footprints that only touch can
+        share a few boundary cells; such edges are deleted when analyzed
+        (see :func:`starplex.intercal.analyze_network`), or can be left out
+        up front with this threshold or ``refine_moc``.
+    refine_moc : bool
+        With ``use_moc``, also require the footprints to overlap with a
+        positive area in the ``catalog_overlap`` graph.
+
+    Returns
+    -------
+    n_edges : int
+        Number of edges added.
+    """
+    if use_moc:
+        n_edges = _insert_moc_edges(session, bandpass, min_moc_area,
+                                    refine_moc)
+    else:
+        n_edges = session.execute(
+            _insert_edges(bandpass, use_graph)).rowcount
+    print "Added {0:d} edges".format(n_edges)
+    store_overlap_polygons(session, bandpass)
+    return n_edges
+
+
+def store_overlap_polygons(session, bandpass, overwrite=False):
+    """Store the overlap polygon of each edge of a bandpass's network in
+    ``IntercalEdge.overlap_poly``, so analysis can run the q3c polygon query
+    without reading and converting the overlap geometry.
+
+    The polygons are computed in the database from the ``catalog_overlap``
+    graph with one ``UPDATE ... FROM``. As in
+    :func:`starplex.intercal.analyze._get_overlap_polygon`, the exterior
+    ring of the largest polygon part of each overlap is used.
+
+    Parameters
+    ----------
+    session :
+        The active SQLAlchemy session instance.
+    bandpass : :class:`starplex.database.Bandpass`
+        Bandpass of the network.
+    overwrite : bool
+        If ``True``, recompute polygons that are already stored. Stored
+        polygons are cleared whenever the catalog overlaps they derive from
+        are rewritten (see
+        :meth:`starplex.database.CatalogOverlap.update_catalog`), so
+        this is only needed if ``catalog_overlap`` was changed by other
+        means.
+    """
+    sql = """
+        UPDATE intercal_edge
+        SET overlap_poly = largest.poly
+        FROM (
+            SELECT DISTINCT ON (parts.edge_id)
+                parts.edge_id,
+                ARRAY(
+                    SELECT CASE WHEN k % 2 = 1
+                        THEN ST_X(ST_PointN(ST_ExteriorRing(parts.geom),
+                                            (k + 1) / 2))
+                        ELSE ST_Y(ST_PointN(ST_ExteriorRing(parts.geom),
+                                            k / 2))
+                        END
+                    FROM generate_series(
+                        1, 2 * ST_NPoints(ST_ExteriorRing(parts.geom))) k
+                    ORDER BY k) AS poly
+            FROM (
+                SELECT e.id AS edge_id,
+                    (ST_Dump(o.clip::geometry)).geom AS geom
+                FROM intercal_edge e
+                JOIN catalog_overlap o
+                    ON o.catalog_a_id = least(e.from_id, e.to_id)
+                    AND o.catalog_b_id = greatest(e.from_id, e.to_id)
+                WHERE e.bandpass_id = :bandpass_id
+                    AND (:overwrite OR e.overlap_poly IS NULL)
+            ) parts
+            WHERE GeometryType(parts.geom) = 'POLYGON'
+            ORDER BY parts.edge_id, ST_Area(parts.geom) DESC
+        ) largest
+        WHERE intercal_edge.id = largest.edge_id
+    """
+    result = session.execute(text(sql), {"bandpass_id": bandpass.id,
+                                         "overwrite": overwrite})
+    print "Stored overlap polygons of {0:d} edges".format(result.rowcount)
+
+
+def _edge_exists(bandpass, from_id, to_id):
+    """Correlated ``EXISTS`` for an edge, or its reverse, in the bandpass."""
+    e = IntercalEdge.__table__.alias('e')
+    return select([e.c.id]).\
+        where(e.c.bandpass_id == bandpass.id).\
+        where(or_(and_(e.c.from_id == from_id, e.c.to_id == to_id),
+                  and_(e.c.from_id == to_id, e.c.to_id == from_id))).\
+        exists()
+
+
+def _insert_edges(bandpass, use_graph):
+    """Build the ``INSERT ... SELECT`` of all new edges of the network."""
+    network = CatalogBandpass.catalog_ids(bandpass.id)
+    if use_graph:
+        ov = CatalogOverlap.__table__
+        from_id = ov.c.catalog_a_id
+        to_id = ov.c.catalog_b_id
+        sel = select([from_id, to_id])
+    else:
+        a = Catalog.__table__.alias('a')
+        b = Catalog.__table__.alias('b')
+        from_id = a.c.id
+        to_id = b.c.id
+        sel = select([from_id, to_id]).\
+            where(from_id < to_id).\
+            where(func.ST_Intersects(a.c.footprint, b.c.footprint))
+    sel = sel.\
+        where(from_id.in_(network)).\
+        where(to_id.in_(network)).\
+        where(~_edge_exists(bandpass, from_id, to_id))
+    sel = sel.column(literal(bandpass.id)).\
+        column(utcnow()).\
+        column(utcnow())
+    tbl = IntercalEdge.__table__
+    return tbl.insert().from_select(
+        [tbl.c.from_id, tbl.c.to_id, tbl.c.bandpass_id,
+         tbl.c.created_at, tbl.c.updated_at],
+        sel)
+
+
+def _insert_moc_edges(session, bandpass, min_area, refine):
+    """Find overlapping catalogs from the intersections of their coverages
+    and insert the new edges with a single bulk ``INSERT``.
+
+    Pairs are kept if their coverages intersect with an area (in square
+    meters) larger than ``min_area`` and, with ``refine``, if their
+    footprints overlap with a positive area in the ``catalog_overlap``
+    graph.
     """
-    catalogs = session.query(Catalog).\
-        join(CatalogStar).\
-        join(Observation).\
-        filter(Observation.bandpass == bandpass).\
-        group_by(Catalog.id)
-    network_catalogs = session.query(Catalog.id).\
-        join(CatalogStar).\
-        join(Observation).\
-        filter(Observation.bandpass == bandpass).\
-        group_by(Catalog.id).\
-        all()
-
-    for catalog in catalogs:
-        print catalog.name
-        # Get overlapping fields
-        overlaps = CatalogOverlaps(session, catalog)
-        overlaps.query = overlaps.query.\
-            filter(Catalog.id.in_(network_catalogs))
-        overlap_count = overlaps.count
-        print "overlap count", overlaps.count
-        if overlap_count == 0:
-            continue
-
-        # For each overlap, ensure the edge is unique (or its inverse) and
-        # add it to IntercalEdge
-        for to_catalog in overlaps.catalogs:
-            if IntercalEdge.edge_exists(session,
-                                        catalog, to_catalog,
-                                        bandpass):
-                # skip this
-                continue
-
-            edge = IntercalEdge(catalog, to_catalog, bandpass, None, None)
-            session.add(edge)
+    network = CatalogBandpass.catalog_ids(bandpass.id)
+    rows = session.query(Catalog.id, Catalog.moc).\
+        filter(Catalog.id.in_(network)).\
+        filter(Catalog.moc != None).\
+        order_by(Catalog.id).\
+        all()  # NOQA
+    ids = np.array([r[0] for r in rows], dtype=int)
+    mocs = [MOC.from_array(r[1]) for r in rows]
+    sq_degree = sq_meter_to_sq_degree(1.)
+    pairs = [(ids[i], ids[j]) for i, j in intersecting_pairs(mocs)
+             if mocs[i].intersection(mocs[j]).area / sq_degree > min_area]
+    if refine:
+        overlapping = set(
+            (a, b) for a, b in
+            session.query(CatalogOverlap.catalog_a_id,
+                          CatalogOverlap.catalog_b_id).
+            filter(CatalogOverlap.catalog_a_id.in_(network)).
+            filter(CatalogOverlap.catalog_b_id.in_(network)).
+            filter(CatalogOverlap.area > 0.))
+        pairs = [p for p in pairs if p in overlapping]
+    existing = set((min(r), max(r)) for r in
+                   session.query(IntercalEdge.from_id, IntercalEdge.to_id).
+                   filter(IntercalEdge.bandpass_id == bandpass.id))
+    values = [{"from_id": int(a), "to_id": int(b),
+               "bandpass_id": bandpass.id}
+              for a, b in pairs if (a, b) not in existing]
+    if len(values) > 0:
+        session.execute(IntercalEdge.__table__.insert(), values)
+    return len(values)
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Prune weak edges from the intercal network before solving.
+
+Dense mosaics produce many sliver overlaps with only a handful of matched
+stars and large ``delta_err``. These edges add solver cost but almost no
+information. :func:`prune_network` flags them as ``pruned`` so that
+:func:`starplex.intercal.solve_network` leaves them out, while always
+keeping a minimum-``delta_err`` spanning forest of the network so that no
+field is disconnected from the reference fields of its component.
+"""
+
+import numpy as np
+import scipy.sparse
+from scipy.sparse.csgraph import connected_components
+
+from sqlalchemy import func, and_
+
+from ..database import IntercalEdge, CatalogOverlap
+from .linsolve import index_network
+from .components import backbone_edges
+
+
+def prune_network(session, bandpass, min_stars=None, min_area=None,
+                  max_delta_err=None):
+    """Flag weak edges of a bandpass's network as pruned.
+
+    An edge is weak if it fails any of the given thresholds. Weak edges are
+    pruned unless they belong to the network's backbone (see
+    :func:`starplex.intercal.components.backbone_edges`), so the connected
+    components of the network, and thus the connectivity of every field to
+    the reference fields, are preserved. Edges with an unusable ``delta``
+    are never part of the backbone. Previous pruning flags of the bandpass
+    are reset. Note that the change is *not* committed.
+
+    Parameters
+    ----------
+    session :
+        The active SQLAlchemy session instance.
+    bandpass : :class:`starplex.database.Bandpass`
+        Bandpass of the network.
+    min_stars : int
+        Minimum number of matched stars (``IntercalEdge.n_stars``).
+    min_area : float
+        Minimum footprint overlap area (``CatalogOverlap.area``), in
+        square meters of the PostGIS geography sphere (see
+        :func:`starplex.database.meta.gistools.sq_meter_to_sq_degree`).
+        Edges without a ``catalog_overlap`` row have no area and are never
+        pruned by this threshold.
+    max_delta_err : float
+        Maximum zeropoint difference uncertainty.
+
+    Returns
+    -------
+    report : dict
+        ``n_edges``, the number of edges, ``n_pruned``, the number of
+        pruned edges, and ``n_components``, the number of connected
+        components (unchanged by pruning).
+    """
+    q = session.query(IntercalEdge.id, IntercalEdge.from_id,
+                      IntercalEdge.to_id, IntercalEdge.delta,
+                      IntercalEdge.delta_err, IntercalEdge.n_stars,
+                      CatalogOverlap.area).\
+        outerjoin(CatalogOverlap,
+                  and_(CatalogOverlap.catalog_a_id
+                       == func.least(IntercalEdge.from_id,
+                                     IntercalEdge.to_id),
+                       CatalogOverlap.catalog_b_id
+                       == func.greatest(IntercalEdge.from_id,
+                                        IntercalEdge.to_id))).\
+        filter(IntercalEdge.bandpass_id == bandpass.id).\
+        order_by(IntercalEdge.id)
+    dt = [('id', int), ('from_id', int), ('to_id', int), ('delta', float),
+          ('delta_err', float), ('n_stars', float), ('area', float)]
+    network = np.array([tuple(np.nan if v is None else v for v in r)
+                        for r in q.all()], dtype=np.dtype(dt))
+    tbl = IntercalEdge.__table__
+    if len(network) == 0:
+        return {'n_edges': 0, 'n_pruned': 0, 'n_components': 0}
+
+    usable = np.isfinite(network['delta']) \
+        & np.isfinite(network['delta_err']) \
+        & (network['delta_err'] > 0.)
+    weak = ~usable
+    # NaN comparisons are False, so missing statistics never prune an edge
+    if min_stars is not None:
+        weak |= network['n_stars'] < min_stars
+    if min_area is not None:
+        weak |= network['area'] < min_area
+    if max_delta_err is not None:
+        weak |= network['delta_err'] > max_delta_err
+
+    catalog_ids = np.unique(
+        np.concatenate((network['from_id'], network['to_id'])))
+    from_index, to_index = index_network(catalog_ids, network)
+    backbone = np.zeros(len(network), dtype=bool)
+    backbone[usable] = backbone_edges(len(catalog_ids),
+                                      from_index[usable], to_index[usable],
+                                      network['delta_err'][usable])
+    pruned = weak & ~backbone
+
+    # Check that pruning preserves the connected components before
+    # writing anything
+    n_before = _count_components(len(catalog_ids), from_index[usable],
+                                 to_index[usable])
+    n_after = _count_components(len(catalog_ids), from_index[~pruned],
+                                to_index[~pruned])
+    if n_after != n_before:
+        raise RuntimeError("Pruning would split the network from {0:d} "
+                           "into {1:d} components".format(n_before, n_after))
+
+    session.execute(tbl.update().
+                    where(tbl.c.bandpass_id == bandpass.id).
+                    values(pruned=False))
+    pruned_ids = network['id'][pruned].tolist()
+    if len(pruned_ids) > 0:
+        session.execute(tbl.update().
+                        where(tbl.c.id.in_(pruned_ids)).
+                        values(pruned=True))
+    print "Pruned {0:d} of {1:d} edges".format(len(pruned_ids),
+                                               len(network))
+    return {'n_edges': len(network), 'n_pruned': len(pruned_ids),
+            'n_components': n_after}
+
+
+def _count_components(n_fields, from_index, to_index):
+    adjacency = scipy.sparse.coo_matrix(
+        (np.ones(len(from_index)), (from_index, to_index)),
+        shape=(n_fields, n_fields)).tocsr()
+    return connected_components(adjacency, directed=False)[0]
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Build the intercal objective extension with OpenMP, so that
+``IntercalObjective.value_and_grad(parallel=True)`` runs across threads.
+
+If the compiler cannot build an OpenMP program (e.g. Apple clang without
+libomp), the extension is built without OpenMP and ``parallel=True`` runs
+serially.
+"""
+
+import os
+import shutil
+import tempfile
+from distutils import ccompiler, sysconfig
+from distutils.extension import Extension
+from distutils import log
+
+OPENMP_TEST = """
+#include <omp.h>
+int main(void) { return omp_get_max_threads() > 0 ? 0 : 1; }
+"""
+
+
+def get_extensions():
+    compile_args, link_args = openmp_flags()
+    src = os.path.join(os.path.relpath(os.path.dirname(__file__)),
+                       'cyobj.pyx')
+    return [Extension('starplex.intercal.cyobj', [src],
+                      include_dirs=['numpy'],
+                      extra_compile_args=compile_args,
+                      extra_link_args=link_args)]
+
+
+def openmp_flags():
+    """Compile and link arguments enabling OpenMP, or empty lists if the
+    compiler does not support it.
+    """
+    compiler = ccompiler.new_compiler()
+    sysconfig.customize_compiler(compiler)
+    if compiler.compiler_type == 'msvc':
+        flags = (['/openmp'], [])
+    else:
+        flags = (['-fopenmp'], ['-fopenmp'])
+    if _compiles(compiler, *flags):
+        return flags
+    log.warn("OpenMP is not supported by the compiler; building "
+             "starplex.intercal.cyobj without it, so "
+             "value_and_grad(parallel=True) will run serially")
+    return [], []
+
+
+def _compiles(compiler, compile_args, link_args):
+    """``True`` if a minimal OpenMP program compiles and links."""
+    tmpdir = tempfile.mkdtemp()
+    try:
+        src = os.path.join(tmpdir, 'test_openmp.c')
+        with open(src, 'w') as f:
+            f.write(OPENMP_TEST)
+        objs = compiler.compile([src], output_dir=tmpdir,
+                                extra_postargs=compile_args)
+        compiler.link_executable(objs, os.path.join(tmpdir, 'test_openmp'),
+                                 extra_postargs=link_args)
+        return True
+    except Exception as e:
+        log.debug("OpenMP test failed: {0}".format(e))
+        return False
+    finally:
+        shutil.rmtree(tmpdir)
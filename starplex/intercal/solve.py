@@ -5,11 +5,22 @@ Solve the network of inter-field zeropoint differences.
 """
 
 
+import multiprocessing
+
 import numpy as np
-from scipy.optimize import basinhopping
+from scipy.optimize import basinhopping, minimize
+from sqlalchemy import or_
 
-from ..database import Catalog, IntercalEdge, CatalogStar, Observation
+from ..database import Catalog, IntercalEdge, CatalogBandpass
+from ..database import CatalogZeropoint
+from ..utils.timer import Timer
 from .cyobj import IntercalObjective
+from .linsolve import index_network, design_matrix, solve_sparse
+from .linsolve import zeropoint_errors
+from .components import network_components, split_network
+
+
+GRADIENT_SOLVERS = ('L-BFGS-B', 'CG')
 
 
 def copy_prior_of_unattached(session, bandpass,
@@ -28,54 +39,326 @@ def copy_prior_of_unattached(session, bandpass,
     network = np.array(q.all(), dtype=np.dtype(dt))
     networked_catalog_ids = np.unique(
         np.concatenate((network['from_id'], network['to_id']))).tolist()
-    all_catalog_ids = np.array(session.query(Catalog.id).
-        join(CatalogStar).
-        join(Observation).
-        filter(Observation.bandpass == bandpass).
-        group_by(Catalog.id).
-        all())
+    all_catalog_ids = np.array(session.execute(
+        CatalogBandpass.catalog_ids(bandpass.id)).fetchall())
     isolated_catalog_ids = np.setdiff1d(all_catalog_ids,
                                         networked_catalog_ids,
-                                        assume_unique=False)
-    for catalog_id in isolated_catalog_ids:
-        catalog = session.query(Catalog).\
-            filter(Catalog.id == int(catalog_id)).one()
-        print "Updating intercal zp for isolated catalog", catalog
-        meta = catalog.meta
-        try:
-            prior_zp = meta[prior_zp_delta_key][str(bandpass.id)]['zp_delta']
-        except:
-            prior_zp = 0.
-
-        if 'intercal' not in meta:
-            meta['intercal'] = {}
-        meta['intercal'][str(bandpass.id)] = {"zp": float(prior_zp),
-                                              "err": float(0.)}  # FIXME
-        catalog.meta = meta
-        session.query(Catalog).\
-            filter(Catalog.id == catalog_id).\
-            update({'meta', meta})
+                                        assume_unique=False).tolist()
+    if len(isolated_catalog_ids) == 0:
+        return
+    print "Updating intercal zp for isolated catalogs", isolated_catalog_ids
+    priors, _ = _network_priors(session, isolated_catalog_ids, bandpass,
+                                prior_zp_delta_key)
+    # Isolated catalogs are not constrained by the network
+    write_intercal_zeropoints(session, bandpass, isolated_catalog_ids,
+                              priors, np.zeros(len(priors)))
 
 
 def solve_network(session, bandpass, prior_zp_delta_key='zp_offset',
-                  use_cython=True):
+                  use_cython=True, solver='basinhopping', by_component=False,
+                  processes=1, estimate_errors=False, warm_start=False):
     """Solve for ZP offsets to unify the photometry, respecting the
     zeropoint calibration of designated reference frames.
 
-    The computed zeropoints are embedded in the each catalog's `intercal.zp`
-    and `intercal.zp_err` metadata fields. The zeropoints are intended to
-    be total, taking into account the prior_zp_delta_key field.
+    Edges flagged by :func:`starplex.intercal.prune.prune_network` are left
+    out.
+
+    The computed zeropoints are stored in the ``catalog_zeropoint`` table
+    and embedded in the each catalog's `intercal.zp` and `intercal.zp_err`
+    metadata fields. The zeropoints are intended to be total, taking into
+    account the prior_zp_delta_key field.
+
+    Parameters
+    ----------
+    session :
+        The active SQLAlchemy session instance.
+    bandpass : :class:`starplex.database.Bandpass`
+        Bandpass of the network to solve.
+    prior_zp_delta_key : str
+        Catalog metadata key of the prior zeropoint offsets.
+    use_cython : bool
+        Use the Cython objective function with the ``'basinhopping'`` and
+        gradient-based solvers.
+    solver : str
+        ``'basinhopping'`` to minimize the objective with
+        ``scipy.optimize.basinhopping``, ``'L-BFGS-B'`` or ``'CG'`` to
+        minimize it with ``scipy.optimize.minimize`` using the analytic
+        gradient, or one of ``'lsqr'``, ``'lsmr'``
+        or ``'normal'`` to solve the weighted linear least-squares problem
+        directly with ``scipy.sparse.linalg``
+        (see :mod:`starplex.intercal.linsolve`). The sparse solvers weight
+        each edge by ``1 / delta_err`` and hold reference fields at their
+        prior zeropoints, and the mean zeropoint of each component without
+        a reference field at the mean of its priors.
+    by_component : bool
+        If ``True``, split the network into connected components and solve
+        each independently, normalized against the reference fields it
+        contains. Components without a reference field keep their prior
+        zeropoints.
+    processes : int
+        Number of worker processes used to solve components in parallel
+        when ``by_component`` is ``True``.
+    estimate_errors : bool
+        If ``True``, estimate the uncertainty of each zeropoint from the
+        sparse normal matrix of the network, whatever the solver (see
+        :func:`starplex.intercal.linsolve.zeropoint_errors`). Uncertainties
+        are relative to the reference fields. With ``by_component``, fields
+        of components without a reference keep their priors and get zero
+        uncertainty; otherwise their uncertainties are relative to the
+        component's mean zeropoint, as solved by the sparse solvers.
+        Without ``estimate_errors`` the uncertainties are written as zero.
+        The estimate costs about as much as a sparse factorization of the
+        network, and can take longer than the solve itself for large
+        networks (under a minute for 100,000 fields).
+    warm_start : bool
+        If ``True``, start the solver from the zeropoints stored in
+        ``catalog_zeropoint`` by the previous solution (minus the priors),
+        so it converges quickly when only a few fields or edges changed.
+        Catalogs without a stored zeropoint start from their prior.
+
+    Returns
+    -------
+    report : dict
+        Summary of the solution, including the ``solution_id`` of the
+        zeropoints written to ``catalog_zeropoint``. With ``by_component``,
+        it includes ``n_components`` and ``unreferenced``, a list of the
+        catalog IDs of each component that has no reference field.
     """
-    # Prepare the objective function
+    # Prepare the objective function, leaving out pruned edges
     q = session.query(IntercalEdge.from_id, IntercalEdge.to_id,
                       IntercalEdge.delta, IntercalEdge.delta_err).\
-        filter(IntercalEdge.bandpass_id == bandpass.id)
+        filter(IntercalEdge.bandpass_id == bandpass.id).\
+        filter(or_(IntercalEdge.pruned == None,  # NOQA
+                   IntercalEdge.pruned == False))  # NOQA
     dt = [('from_id', int), ('to_id', int), ('delta', float),
           ('delta_err', float)]
     network = np.array(q.all(), dtype=np.dtype(dt))
     catalog_ids = np.unique(
         np.concatenate((network['from_id'], network['to_id']))).tolist()
+    priors, is_reference = _network_priors(session, catalog_ids, bandpass,
+                                           prior_zp_delta_key)
+    if warm_start:
+        z0 = _stored_zeropoints(session, catalog_ids, bandpass, priors) \
+            - priors
+    else:
+        z0 = None
+
+    report = {'n_catalogs': len(catalog_ids)}
+    if by_component:
+        zeropoints, components, unreferenced = _solve_components(
+            catalog_ids, network, is_reference, solver, use_cython,
+            processes, z0=z0)
+        zeropoints = zeropoints + priors
+        report['n_components'] = len(components)
+        report['unreferenced'] = unreferenced
+        for ids in unreferenced:
+            print "No reference in component, using priors:", ids
+        corr = 0.
+        diff = priors[is_reference] - zeropoints[is_reference]
+    else:
+        zeropoints = _solve(catalog_ids, network, is_reference, solver,
+                            use_cython, z0=z0)
+
+        # Add the prior ZP to this result
+        zeropoints = zeropoints + priors
+        reference_catalog_ids = np.array(catalog_ids)[is_reference]
+        reference_priors = priors[is_reference]
+        reference_solved_zps = zeropoints[is_reference]
+
+        print "reference_catalog_ids", reference_catalog_ids
+        print "reference_priors", reference_priors
+        print "reference_solved_zps", reference_solved_zps
+
+        # Fit a zp normalization so that the ZP of the reference fields
+        # matches that of the prior zp
+        diff = reference_priors - reference_solved_zps
+        corr = np.mean(diff)
+        # FIXME Is this the right way to assess normalization uncertainty?
+        # if len(diff) >= 5:
+        #     corr_err = np.std(diff)
+        # else:
+        #     corr_err = 0.
+        # Finally, normalize zeropoints
+        zeropoints += corr
+
+    print 'ZEROPOINTS', zeropoints
+    print 'Correction', corr
+    print 'Correction scatter', diff.std()
+    print 'diffs', diff
+    if estimate_errors:
+        with Timer() as timer:
+            zeropoint_errs = _zeropoint_errors(catalog_ids, network,
+                                               is_reference)
+        print "Estimated zeropoint errors in {0:.2f} s".format(
+            timer.interval)
+        if by_component:
+            for ids in unreferenced:
+                zeropoint_errs[np.searchsorted(catalog_ids, ids)] = 0.
+    else:
+        zeropoint_errs = np.zeros(len(zeropoints))
+    # Persist the intercal zeropoints
+    solution_id = CatalogZeropoint.next_solution_id(session)
+    write_intercal_zeropoints(session, bandpass, catalog_ids, zeropoints,
+                              zeropoint_errs, solution_id=solution_id)
+    report['solution_id'] = solution_id
+    return report
+
+
+def write_intercal_zeropoints(session, bandpass, catalog_ids, zeropoints,
+                              zeropoint_errs, solution_id=None):
+    """Write intercal zeropoints to the ``catalog_zeropoint`` table (see
+    :meth:`starplex.database.CatalogZeropoint.replace`) and into the
+    ``intercal`` metadata of the catalogs, with one query to read their
+    metadata and one bulk ``UPDATE`` (see
+    :meth:`starplex.database.Catalog.bulk_update_meta`).
+
+    Note that the change is *not* committed.
+
+    Parameters
+    ----------
+    session :
+        The active SQLAlchemy session instance.
+    bandpass : :class:`starplex.database.Bandpass`
+        Bandpass of the zeropoints.
+    catalog_ids : list
+        IDs of the catalogs.
+    zeropoints, zeropoint_errs : ndarray
+        Zeropoint and its uncertainty for each catalog.
+    solution_id : int
+        Optional ID of the solution that produced the zeropoints.
+    """
+    if len(catalog_ids) == 0:
+        return
+    CatalogZeropoint.replace(session, bandpass.id, catalog_ids,
+                             zeropoints, zeropoint_errs,
+                             solution_id=solution_id)
+    metas = dict(session.query(Catalog.id, Catalog.meta).
+                 filter(Catalog.id.in_(catalog_ids)).
+                 all())
+    new_metas = {}
+    for catalog_id, z, z_err in zip(catalog_ids, zeropoints, zeropoint_errs):
+        meta = dict(metas[catalog_id] or {})
+        intercal = dict(meta.get('intercal', {}))
+        intercal[str(bandpass.id)] = {"zp": float(z), "err": float(z_err)}
+        meta['intercal'] = intercal
+        new_metas[catalog_id] = meta
+    Catalog.bulk_update_meta(session, new_metas)
+
+
+def _network_priors(session, catalog_ids, bandpass, prior_zp_delta_key):
+    """Read the prior zeropoint and reference status of every catalog in
+    the network with a single query.
+
+    Returns
+    -------
+    priors : ndarray
+        Prior zeropoint offset of each catalog (0 if not set).
+    is_reference : ndarray
+        Boolean array, ``True`` for zeropoint reference catalogs.
+    """
+    metas = dict(session.query(Catalog.id, Catalog.meta).
+                 filter(Catalog.id.in_(catalog_ids)).
+                 all())
+    priors = np.zeros(len(catalog_ids))
+    is_reference = np.zeros(len(catalog_ids), dtype=bool)
+    for i, catalog_id in enumerate(catalog_ids):
+        meta = metas[catalog_id]
+        try:
+            priors[i] = meta[prior_zp_delta_key][str(bandpass.id)]['zp_delta']
+        except:
+            priors[i] = 0.
+        try:
+            is_reference[i] = meta['intercal_reference'] == True  # NOQA
+        except:
+            pass
+    return priors, is_reference
+
+
+def _stored_zeropoints(session, catalog_ids, bandpass, default):
+    """Read the stored zeropoint of every catalog in the network, using
+    ``default`` for catalogs without one.
+    """
+    stored = dict(session.query(CatalogZeropoint.catalog_id,
+                                CatalogZeropoint.zp).
+                  filter(CatalogZeropoint.bandpass_id == bandpass.id).
+                  filter(CatalogZeropoint.catalog_id.in_(catalog_ids)).
+                  filter(CatalogZeropoint.zp != None).  # NOQA
+                  all())
+    print "Warm start from {0:d} stored zeropoints".format(len(stored))
+    return np.array([stored.get(catalog_id, d)
+                     for catalog_id, d in zip(catalog_ids, default)])
 
+
+def _solve(catalog_ids, network, is_reference, solver, use_cython,
+           z0=None):
+    """Solve for the zeropoint corrections (relative to the priors) with
+    the given solver, optionally starting from the corrections ``z0``.
+    """
+    if solver == 'basinhopping':
+        return _solve_basinhopping(catalog_ids, network, use_cython, z0=z0)
+    elif solver in GRADIENT_SOLVERS:
+        return _solve_gradient(catalog_ids, network, use_cython, solver,
+                               z0=z0)
+    else:
+        return _solve_linear(catalog_ids, network, is_reference, solver,
+                             z0=z0)
+
+
+def _solve_component(args):
+    """Solve one connected component and normalize it against its
+    reference fields. Returns ``None`` if the component has no reference.
+    """
+    catalog_ids, network, is_reference, solver, use_cython, z0 = args
+    if not np.any(is_reference):
+        return None
+    z = _solve(catalog_ids, network, is_reference, solver, use_cython,
+               z0=z0)
+    # Normalize so that the references keep their prior zeropoints
+    return z - np.mean(z[is_reference])
+
+
+def _solve_components(catalog_ids, network, is_reference, solver,
+                      use_cython, processes, z0=None):
+    """Solve each connected component of the network independently.
+
+    Returns
+    -------
+    zeropoints : ndarray
+        Zeropoint corrections (relative to the priors) of all catalogs;
+        zero for catalogs in components without a reference field.
+    components : list
+        Catalog IDs of each component.
+    unreferenced : list
+        Catalog IDs of each component without a reference field.
+    """
+    n_components, labels = network_components(catalog_ids, network)
+    components = split_network(catalog_ids, network, labels)
+    print "Solving {0:d} network components".format(n_components)
+    jobs = [(ids, net, is_reference[index], solver, use_cython,
+             z0[index] if z0 is not None else None)
+            for index, ids, net in components]
+    if processes > 1:
+        pool = multiprocessing.Pool(processes)
+        try:
+            results = pool.map(_solve_component, jobs)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = map(_solve_component, jobs)
+
+    zeropoints = np.zeros(len(catalog_ids))
+    unreferenced = []
+    for (index, ids, net), z in zip(components, results):
+        if z is None:
+            unreferenced.append(ids)
+        else:
+            zeropoints[index] = z
+    return zeropoints, [c[1] for c in components], unreferenced
+
+
+def _solve_basinhopping(catalog_ids, network, use_cython, z0=None):
+    """Minimize the objective function with basinhopping."""
     if use_cython:
         # Cython version
         obj = _prep_cy_objective(catalog_ids, network)
@@ -84,7 +367,8 @@ def solve_network(session, bandpass, prior_zp_delta_key='zp_offset',
         obj = Objective(catalog_ids, network)
 
     # Run the optimization
-    z0 = 0.2 * np.random.randn(len(catalog_ids))
+    if z0 is None:
+        z0 = 0.2 * np.random.randn(len(catalog_ids))
     result = basinhopping(obj, z0,
                           niter=100,
                           T=1.0e8,
@@ -104,108 +388,105 @@ def solve_network(session, bandpass, prior_zp_delta_key='zp_offset',
     print "RESULT NITER", result.nit
     print "RESULT FUNC", result.fun
     print "RESULT X", result.x
-    zeropoints = result.x
+    return result.x
 
-    # Add the prior ZP to this result
-    # and also get the list of zeropoint reference catalogs
-    reference_catalog_ids = []
-    reference_priors = []
-    reference_solved_zps = []
-    for i, catalog_id in enumerate(catalog_ids):
-        result = session.query(Catalog.meta).\
-            filter(Catalog.id == catalog_id).\
-            one()
-        meta = result.meta
-        print catalog_id, meta
 
-        try:
-            prior_zp = meta[prior_zp_delta_key][str(bandpass.id)]['zp_delta']
-        except:
-            prior_zp = 0.
-        print "prior_zp", prior_zp
-        zeropoints[i] += prior_zp
+def _solve_gradient(catalog_ids, network, use_cython, method, z0=None):
+    """Minimize the objective function with a gradient-based optimizer
+    using the fused value-and-gradient call of the objective.
+    """
+    if use_cython:
+        obj = _prep_cy_objective(catalog_ids, network)
+    else:
+        obj = Objective(catalog_ids, network)
+    if z0 is None:
+        z0 = np.zeros(len(catalog_ids))
+    result = minimize(obj.value_and_grad, z0, jac=True, method=method,
+                      options={'maxiter': 100 * len(catalog_ids)})
+    print "RESULT MESSAGE", result.message
+    print "RESULT NITER", result.nit
+    print "RESULT FUNC", result.fun
+    return result.x
 
-        try:
-            if meta['intercal_reference'] == True:
-                print "Found intercal_reference"
-                reference_catalog_ids.append(catalog_id)
-                reference_priors.append(prior_zp)  # from prev try
-                reference_solved_zps.append(zeropoints[i])
-        except:
-            pass
 
-    print "reference_catalog_ids", reference_catalog_ids
-    print "reference_priors", reference_priors
-    print "reference_solved_zps", reference_solved_zps
-
-    # Fit a zp normalization so that the ZP of the reference fields matches
-    # that of the prior zp
-    reference_priors = np.array(reference_priors)
-    reference_solved_zps = np.array(reference_solved_zps)
-    diff = reference_priors - reference_solved_zps
-    corr = np.mean(diff)
-    # FIXME Is this the right way to assess normalization uncertainty?
-    # if len(diff) >= 5:
-    #     corr_err = np.std(diff)
-    # else:
-    #     corr_err = 0.
-    # Finally, normalize zeropoints
-    zeropoints += corr
+def _solve_linear(catalog_ids, network, is_reference, solver, z0=None):
+    """Solve the weighted linear least-squares problem directly."""
+    network = network[np.isfinite(network['delta'])
+                      & np.isfinite(network['delta_err'])
+                      & (network['delta_err'] > 0.)]
+    from_index, to_index = index_network(catalog_ids, network)
+    A, b = design_matrix(from_index, to_index,
+                         network['delta'], network['delta_err'],
+                         len(catalog_ids),
+                         reference_index=np.where(is_reference)[0])
+    with Timer() as timer:
+        zeropoints = solve_sparse(A, b, solver=solver, x0=z0)
+    print "Solved {0:d} fields with {1} in {2:.2f} s".format(
+        len(catalog_ids), solver, timer.interval)
+    return zeropoints
 
-    print 'ZEROPOINTS', zeropoints
-    print 'Correction', corr
-    print 'Correction scatter', diff.std()
-    print 'diffs', diff
-    # Persist the intercal zeropoint to the Catalog's metadata
-    for catalog_id, z in zip(catalog_ids, zeropoints):
-        catalog = session.query(Catalog).\
-            filter(Catalog.id == catalog_id).\
-            one()
-        meta = catalog.meta
-        if 'intercal' not in meta:
-            meta['intercal'] = {}
-        meta['intercal'][str(bandpass.id)] = {"zp": float(z),
-                                              "err": float(0.)}  # FIXME
-        print meta
-        catalog.meta = meta
-        session.query(Catalog).\
-            filter(Catalog.id == catalog_id).\
-            update({'meta': meta})
+
+def _zeropoint_errors(catalog_ids, network, is_reference):
+    """Estimate the zeropoint uncertainties of the network's catalogs."""
+    network = network[np.isfinite(network['delta'])
+                      & np.isfinite(network['delta_err'])
+                      & (network['delta_err'] > 0.)]
+    from_index, to_index = index_network(catalog_ids, network)
+    return zeropoint_errors(from_index, to_index, network['delta_err'],
+                            len(catalog_ids),
+                            reference_index=np.where(is_reference)[0])
 
 
 def _prep_cy_objective(catalog_ids, network):
     """Constructs the cython objective function."""
     n_terms = network.shape[0]
     # Translates catalog id to index in the parameter space of objective func
-    h = dict(zip(catalog_ids, range(len(catalog_ids))))
-    from_index = np.empty(n_terms, dtype=int)
-    to_index = np.empty(n_terms, dtype=int)
-    delta = np.empty(n_terms, dtype=float)
-    weight = np.empty(n_terms, dtype=float)
-    for i in xrange(n_terms):
-        from_index[i] = h[network[i]['from_id']]
-        to_index[i] = h[network[i]['to_id']]
-        delta[i] = network[i]['delta']
-        weight[i] = 1. / network[i]['delta_err'] ** 2.
-
-    objf = IntercalObjective(from_index, to_index, delta, weight, n_terms)
+    from_index, to_index = index_network(catalog_ids, network)
+    delta = np.ascontiguousarray(network['delta'], dtype=float)
+    weight = 1. / network['delta_err']
+
+    objf = IntercalObjective(from_index.astype(np.int_),
+                             to_index.astype(np.int_),
+                             delta, weight, n_terms, len(catalog_ids))
     return objf
 
 
 class Objective(object):
-    """Inter-field zeropoint objective function."""
+    """Inter-field zeropoint objective function.
+
+    The objective is the chi-square ``sum(((delta + z_i - z_j) /
+    delta_err) ** 2)`` over the edges, the same quantity minimized by the
+    sparse solvers of :mod:`starplex.intercal.linsolve`.
+
+    This is a NumPy-vectorized equivalent of
+    :class:`starplex.intercal.cyobj.IntercalObjective`.
+    """
     def __init__(self, catalog_ids, network):
         super(Objective, self).__init__()
-        self._net = network
-        self._n_edges = len(self._net)
-        self._hash = dict(zip(catalog_ids, range(len(catalog_ids))))
+        self._n_params = len(catalog_ids)
+        self._from_index, self._to_index = index_network(catalog_ids, network)
+        self._delta = np.asarray(network['delta'], dtype=float)
+        self._weight = 1. / network['delta_err']
+
+    def _terms(self, z):
+        return self._weight * (self._delta
+                               + z[self._from_index]
+                               - z[self._to_index])
 
     def __call__(self, z):
         """Objective function call."""
-        F = 0.
-        for k in xrange(self._n_edges):
-            i = self._hash[self._net[k]['from_id']]
-            j = self._hash[self._net[k]['to_id']]
-            F += ((self._net[k]['delta'] + z[i] - z[j])
-                  / self._net[k]['delta_err'] ** 2) ** 2.
-        return F
+        f = self._terms(z)
+        return np.dot(f, f)
+
+    def value_and_grad(self, z, parallel=False):
+        """Return the objective value and its gradient with respect to
+        ``z``. The gradient is accumulated with ``np.bincount`` scatter-adds;
+        ``parallel`` is accepted for compatibility with the Cython objective.
+        """
+        f = self._terms(z)
+        g = 2. * self._weight * f
+        grad = np.bincount(self._from_index, weights=g,
+                           minlength=self._n_params) \
+            - np.bincount(self._to_index, weights=g,
+                          minlength=self._n_params)
+        return np.dot(f, f), grad
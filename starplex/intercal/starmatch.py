@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Intercal cross-matches derived from compiled :class:`Star` memberships.
+
+Once the ``star`` table has been compiled with
+:class:`starplex.compile.spatialjoin.SpatialJoiner`, two catalog stars that
+belong to the same :class:`Star` are exactly the cross-matches that
+:func:`starplex.intercal.analyze._xmatch` recomputes with ``q3c_join``.
+:class:`StarMatches` reads the matched photometry of every edge at once with
+a self-join of ``catalog_star`` on ``star_id``, avoiding the per-edge
+overlap polygon query and spatial join.
+"""
+
+import numpy as np
+
+from sqlalchemy.orm import aliased
+
+from ..database import CatalogStar, Observation, IntercalEdge
+from .photcache import XMATCH_DTYPE
+
+
+class StarMatches(object):
+    """Matched photometry of a network's edges from compiled stars.
+
+    This has the same ``xmatch(edge)`` interface as
+    :class:`starplex.intercal.photcache.PhotometryCache`.
+
+    Parameters
+    ----------
+    session :
+        The active SQLAlchemy session instance.
+    bandpass_id : int
+        Bandpass of the network.
+    edge_ids : list
+        Optional list of :class:`IntercalEdge` IDs to restrict the matches
+        to. By default all edges of the bandpass are read.
+    """
+    def __init__(self, session, bandpass_id, edge_ids=None):
+        super(StarMatches, self).__init__()
+        self._s = session
+        self.bandpass_id = bandpass_id
+        self._edge_ids, self._ptr, self._data = self._load(edge_ids)
+
+    def _load(self, edge_ids):
+        """Read the matched photometry of all edges in one query, ordered by
+        edge.
+        """
+        from_cs = aliased(CatalogStar)
+        to_cs = aliased(CatalogStar)
+        from_obs = aliased(Observation)
+        to_obs = aliased(Observation)
+        q = self._s.query(IntercalEdge.id,
+                          from_obs.mag, from_obs.mag_err,
+                          to_obs.mag, to_obs.mag_err).\
+            join(from_cs, from_cs.catalog_id == IntercalEdge.from_id).\
+            join(to_cs, (to_cs.catalog_id == IntercalEdge.to_id)
+                 & (to_cs.star_id == from_cs.star_id)).\
+            join(from_obs, (from_obs.catalog_star_id == from_cs.id)
+                 & (from_obs.bandpass_id == IntercalEdge.bandpass_id)).\
+            join(to_obs, (to_obs.catalog_star_id == to_cs.id)
+                 & (to_obs.bandpass_id == IntercalEdge.bandpass_id)).\
+            filter(IntercalEdge.bandpass_id == self.bandpass_id).\
+            filter(from_cs.star_id != None)  # NOQA
+        if edge_ids is not None:
+            q = q.filter(IntercalEdge.id.in_(edge_ids))
+        q = q.order_by(IntercalEdge.id)
+        dt = np.dtype([('edge_id', int)] + XMATCH_DTYPE.descr)
+        rows = np.array(q.all(), dtype=dt)
+        ids, start = np.unique(rows['edge_id'], return_index=True)
+        ptr = np.append(start, len(rows))
+        data = np.empty(len(rows), dtype=XMATCH_DTYPE)
+        for name in XMATCH_DTYPE.names:
+            data[name] = rows[name]
+        return ids, ptr, data
+
+    @property
+    def n_edges(self):
+        """Number of edges with at least one matched star."""
+        return len(self._edge_ids)
+
+    def xmatch(self, edge):
+        """Matched photometry of an edge.
+
+        Returns
+        -------
+        data : ndarray
+            Structured array with ``from_mag``, ``from_mag_err``,
+            ``to_mag`` and ``to_mag_err`` fields (empty if the two catalogs
+            share no stars).
+        """
+        i = np.searchsorted(self._edge_ids, edge.id)
+        if i == len(self._edge_ids) or self._edge_ids[i] != edge.id:
+            return np.zeros(0, dtype=XMATCH_DTYPE)
+        # copy, since prior offsets are applied in place
+        return self._data[self._ptr[i]:self._ptr[i + 1]].copy()
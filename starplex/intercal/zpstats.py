@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Statistics of zeropoint differences between matched stars.
+"""
+
+import numpy as np
+
+
+def make_rng(seed=None):
+    """Build a random number generator from a seed.
+
+    A ``numpy.random.Generator`` is used if available (numpy >= 1.17),
+    otherwise a ``numpy.random.RandomState``. Existing generators are
+    passed through.
+    """
+    if hasattr(seed, 'randint') or hasattr(seed, 'integers'):
+        return seed
+    if hasattr(np.random, 'default_rng'):
+        return np.random.default_rng(seed)
+    return np.random.RandomState(seed)
+
+
+def _draw_indices(rng, n, size):
+    """Draw indices in ``[0, n)`` with either kind of generator."""
+    if hasattr(rng, 'integers'):
+        return rng.integers(0, n, size=size)
+    return rng.randint(0, n, size=size)
+
+
+def bootstrap_weighted_mean(delta, delta_err, n_boot=1000, rng=None,
+                            max_block_size=2 ** 22):
+    """Bootstrap the inverse-variance weighted mean of ``delta``.
+
+    Resampling indices are drawn as an ``(n_boot, n)`` matrix, in blocks of
+    at most ``max_block_size`` elements to bound memory, and the weighted
+    means of all resamples in a block are computed with two row reductions.
+
+    Parameters
+    ----------
+    delta : ndarray
+        Zeropoint differences.
+    delta_err : ndarray
+        Uncertainties of ``delta``.
+    n_boot : int
+        Number of bootstrap resamples.
+    rng :
+        Seed, ``numpy.random.Generator`` or ``numpy.random.RandomState``.
+    max_block_size : int
+        Maximum number of resampling indices held in memory at once.
+
+    Returns
+    -------
+    means : ndarray
+        Weighted mean of each of the ``n_boot`` resamples.
+    """
+    rng = make_rng(rng)
+    delta = np.asarray(delta, dtype=float)
+    w = 1. / np.asarray(delta_err, dtype=float) ** 2.
+    wd = w * delta
+    n = delta.shape[0]
+    block = int(max(1, min(n_boot, max_block_size // max(n, 1))))
+    means = np.empty(n_boot)
+    for start in xrange(0, n_boot, block):
+        size = min(block, n_boot - start)
+        idx = _draw_indices(rng, n, (size, n))
+        means[start:start + size] = wd[idx].sum(axis=1) / w[idx].sum(axis=1)
+    return means
+
+
+def batch_zp_deltas(edge_index, delta, delta_err, n_edges, sig=3.,
+                    iters=1, min_stars=5, n_boot=1000, rng=None,
+                    max_block_size=2 ** 22):
+    """Compute zeropoint offsets of many edges in one vectorized pass.
+
+    The matched star pairs of all edges are concatenated, with
+    ``edge_index`` labelling the edge of each pair. Sigma clipping,
+    weighted means and the bootstrap are computed as grouped reductions
+    over the pairs of each edge, following
+    :func:`starplex.intercal.analyze._compute_zp_delta`.
+
+    Parameters
+    ----------
+    edge_index : ndarray
+        Edge (``0 <= edge_index < n_edges``) of each matched pair.
+    delta : ndarray
+        Magnitude difference of each matched pair.
+    delta_err : ndarray
+        Uncertainty of each ``delta``.
+    n_edges : int
+        Number of edges.
+    sig : float
+        Clipping threshold, in standard deviations about the edge's median.
+    iters : int
+        Number of clipping iterations.
+    min_stars : int
+        Minimum number of pairs, before and after clipping, for an edge to
+        be measured.
+    n_boot : int
+        Number of bootstrap resamples.
+    rng :
+        Seed, ``numpy.random.Generator`` or ``numpy.random.RandomState``.
+    max_block_size : int
+        Maximum number of resampling indices held in memory at once.
+
+    Returns
+    -------
+    mean : ndarray
+        Weighted mean zeropoint offset of each edge; NaN for edges with too
+        few pairs.
+    mean_err : ndarray
+        Bootstrap uncertainty of ``mean``; NaN for edges with too few pairs.
+    n_used : ndarray
+        Number of pairs used for each edge.
+    """
+    rng = make_rng(rng)
+    edge_index = np.asarray(edge_index, dtype=np.int_)
+    delta = np.asarray(delta, dtype=float)
+    delta_err = np.asarray(delta_err, dtype=float)
+    n_raw = np.bincount(edge_index, minlength=n_edges)
+
+    good = np.isfinite(delta) & np.isfinite(delta_err) & (delta_err > 0.) \
+        & (n_raw[edge_index] >= min_stars)
+    for i in xrange(iters):
+        good &= ~_grouped_outliers(edge_index, delta, good, n_edges, sig)
+
+    e = edge_index[good]
+    d = delta[good]
+    w = 1. / delta_err[good] ** 2.
+    n_used = np.bincount(e, minlength=n_edges)
+    valid = n_used >= min_stars
+    keep = valid[e]
+    e, d, w = e[keep], d[keep], w[keep]
+    n_used[~valid] = 0
+
+    mean = np.empty(n_edges)
+    mean.fill(np.nan)
+    mean_err = mean.copy()
+    if e.shape[0] == 0:
+        return mean, mean_err, n_used
+
+    wsum = np.bincount(e, weights=w, minlength=n_edges)
+    wdsum = np.bincount(e, weights=w * d, minlength=n_edges)
+    mean[valid] = wdsum[valid] / wsum[valid]
+
+    # Bootstrap: each resample draws n_e pairs from each edge's segment
+    order = np.argsort(e, kind='mergesort')
+    e, wd, w = e[order], (w * d)[order], w[order]
+    edges = np.where(valid)[0]
+    starts = np.concatenate(([0], np.cumsum(n_used[edges])[:-1]))
+    seg_start = np.zeros(n_edges, dtype=np.int_)
+    seg_start[edges] = starts
+    n_pairs = e.shape[0]
+    block = int(max(1, min(n_boot, max_block_size // n_pairs)))
+    boot = np.empty((n_boot, edges.shape[0]))
+    for start in xrange(0, n_boot, block):
+        size = min(block, n_boot - start)
+        u = _draw_uniform(rng, (size, n_pairs))
+        idx = seg_start[e] + (u * n_used[e]).astype(np.int_)
+        boot[start:start + size] = np.add.reduceat(wd[idx], starts, axis=1) \
+            / np.add.reduceat(w[idx], starts, axis=1)
+    mean_err[edges] = np.std(boot, axis=0)
+    return mean, mean_err, n_used
+
+
+def _draw_uniform(rng, size):
+    """Draw uniform deviates in ``[0, 1)`` with either kind of generator."""
+    if hasattr(rng, 'random'):
+        return rng.random(size)
+    return rng.random_sample(size)
+
+
+def _grouped_outliers(edge_index, delta, good, n_edges, sig):
+    """Flag pairs deviating by more than ``sig`` standard deviations from
+    the median of their edge, using only the ``good`` pairs for the
+    statistics.
+    """
+    e = edge_index[good]
+    d = delta[good]
+    count = np.bincount(e, minlength=n_edges)
+    # Grouped median from a sort by (edge, delta)
+    order = np.lexsort((d, e))
+    d_sorted = d[order]
+    starts = np.concatenate(([0], np.cumsum(count)[:-1]))
+    has = count > 0
+    lo = starts + (count - 1) // 2
+    hi = starts + count // 2
+    median = np.zeros(n_edges)
+    median[has] = 0.5 * (d_sorted[lo[has]] + d_sorted[hi[has]])
+    # Grouped standard deviation
+    mean = np.zeros(n_edges)
+    mean[has] = np.bincount(e, weights=d, minlength=n_edges)[has] \
+        / count[has]
+    var = np.zeros(n_edges)
+    var[has] = np.bincount(e, weights=(d - mean[e]) ** 2.,
+                           minlength=n_edges)[has] / count[has]
+    std = np.sqrt(var)
+    outlier = np.abs(delta - median[edge_index]) > sig * std[edge_index]
+    return outlier & good
@@ -0,0 +1,28 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Test spherical geometry utilities.
+"""
+
+import math
+
+import numpy as np
+
+from starplex.database.meta.gistools import spherical_polygon_area
+from starplex.database.meta.gistools import sq_meter_to_sq_degree, R_EARTH
+
+
+def test_octant_area():
+    octant = [(0., 0.), (90., 0.), (0., 90.)]
+    area = spherical_polygon_area(octant)
+    assert np.allclose(area, 4. * math.pi * R_EARTH ** 2. / 8.)
+    # orientation and closure do not matter
+    assert np.allclose(spherical_polygon_area(octant[::-1] + [octant[-1]]),
+                       area)
+
+
+def test_small_box_area():
+    # a 0.1 x 0.1 degree box straddling RA = 0 at Dec = 60
+    box = [(359.95, 59.95), (0.05, 59.95), (0.05, 60.05), (359.95, 60.05)]
+    area = sq_meter_to_sq_degree(spherical_polygon_area(box))
+    assert np.allclose(area, 0.01 * math.cos(math.radians(60.)), rtol=1e-3)
@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Test the intercal objective functions and solvers on a synthetic network.
+"""
+
+import numpy as np
+
+from starplex.intercal.solve import Objective, _prep_cy_objective
+from starplex.intercal.linsolve import index_network, design_matrix, \
+    solve_sparse, zeropoint_errors
+from starplex.intercal.components import backbone_edges
+
+
+def mock_network(n_fields=50, n_edges=300, seed=0):
+    """Create a random network with known zeropoints."""
+    rs = np.random.RandomState(seed)
+    catalog_ids = np.arange(100, 100 + n_fields)
+    zp = 0.1 * rs.randn(n_fields)
+    zp[0] = 0.
+    i = rs.randint(0, n_fields, n_edges)
+    j = (i + rs.randint(1, n_fields, n_edges)) % n_fields
+    dt = [('from_id', int), ('to_id', int), ('delta', float),
+          ('delta_err', float)]
+    network = np.zeros(n_edges, dtype=np.dtype(dt))
+    network['from_id'] = catalog_ids[i]
+    network['to_id'] = catalog_ids[j]
+    network['delta_err'] = rs.uniform(0.005, 0.02, n_edges)
+    network['delta'] = zp[j] - zp[i] \
+        + network['delta_err'] * rs.randn(n_edges)
+    return catalog_ids.tolist(), network, zp
+
+
+class TestIntercalObjective(object):
+
+    catalog_ids, network, zp = mock_network()
+
+    def test_gradient(self):
+        obj = Objective(self.catalog_ids, self.network)
+        z = 0.1 * np.random.RandomState(1).randn(len(self.catalog_ids))
+        F, grad = obj.value_and_grad(z)
+        assert np.allclose(F, obj(z))
+        eps = 1e-6
+        for k in (0, 7, 23):
+            dz = np.zeros_like(z)
+            dz[k] = eps
+            fd = (obj(z + dz) - obj(z - dz)) / (2. * eps)
+            assert np.allclose(fd, grad[k], rtol=1e-4)
+
+    def test_chi2(self):
+        # The objective is the chi-square of the weighted design matrix
+        obj = Objective(self.catalog_ids, self.network)
+        from_index, to_index = index_network(self.catalog_ids, self.network)
+        n_edges = len(self.network)
+        A, b = design_matrix(from_index, to_index,
+                             self.network['delta'], self.network['delta_err'],
+                             len(self.catalog_ids))
+        z = 0.1 * np.random.RandomState(3).randn(len(self.catalog_ids))
+        chi2 = np.sum((A[:n_edges] * z - b[:n_edges]) ** 2.)
+        assert np.allclose(obj(z), chi2)
+        assert np.allclose(obj.value_and_grad(z)[1],
+                           2. * A[:n_edges].T * (A[:n_edges] * z
+                                                 - b[:n_edges]))
+
+    def test_cython_matches_python(self):
+        pyobj = Objective(self.catalog_ids, self.network)
+        cyobj = _prep_cy_objective(self.catalog_ids, self.network)
+        z = 0.1 * np.random.RandomState(2).randn(len(self.catalog_ids))
+        F0, g0 = pyobj.value_and_grad(z)
+        for parallel in (False, True):
+            F1, g1 = cyobj.value_and_grad(z, parallel)
+            assert np.allclose(F0, F1)
+            assert np.allclose(g0, g1)
+
+
+class TestSparseSolve(object):
+
+    catalog_ids, network, zp = mock_network()
+
+    def test_recovery(self):
+        from_index, to_index = index_network(self.catalog_ids, self.network)
+        A, b = design_matrix(from_index, to_index,
+                             self.network['delta'], self.network['delta_err'],
+                             len(self.catalog_ids), reference_index=[0])
+        for solver in ('lsqr', 'lsmr', 'normal'):
+            z = solve_sparse(A, b, solver=solver)
+            assert np.std(z - self.zp) < 0.01
+
+    def test_unreferenced_component(self):
+        # A second component, without a reference field, must not make the
+        # normal equations singular
+        catalog_ids, network, zp = mock_network(n_fields=20, n_edges=60,
+                                                seed=3)
+        n = len(self.catalog_ids)
+        from_index, to_index = index_network(self.catalog_ids, self.network)
+        other_from, other_to = index_network(catalog_ids, network)
+        A, b = design_matrix(np.concatenate((from_index, n + other_from)),
+                             np.concatenate((to_index, n + other_to)),
+                             np.concatenate((self.network['delta'],
+                                             network['delta'])),
+                             np.concatenate((self.network['delta_err'],
+                                             network['delta_err'])),
+                             n + len(catalog_ids), reference_index=[0])
+        for solver in ('lsqr', 'lsmr', 'normal'):
+            z = solve_sparse(A, b, solver=solver)
+            assert np.all(np.isfinite(z))
+            assert np.std(z[:n] - self.zp) < 0.01
+            assert np.std(z[n:] - zp) < 0.01
+            assert abs(np.mean(z[n:])) < 1e-6
+
+    def test_warm_start(self):
+        from_index, to_index = index_network(self.catalog_ids, self.network)
+        A, b = design_matrix(from_index, to_index,
+                             self.network['delta'], self.network['delta_err'],
+                             len(self.catalog_ids), reference_index=[0])
+        z = solve_sparse(A, b, solver='lsqr')
+        for solver in ('lsqr', 'lsmr'):
+            z_warm = solve_sparse(A, b, solver=solver, x0=self.zp)
+            assert np.allclose(z_warm, z, atol=1e-6)
+
+    def test_errors(self):
+        from_index, to_index = index_network(self.catalog_ids, self.network)
+        n = len(self.catalog_ids)
+        A, _ = design_matrix(from_index, to_index,
+                             self.network['delta'], self.network['delta_err'],
+                             n, reference_index=[0])
+        dense = np.sqrt(np.diag(np.linalg.inv((A.T * A).toarray())))
+        zp_err = zeropoint_errors(from_index, to_index,
+                                  self.network['delta_err'], n,
+                                  reference_index=[0])
+        assert np.allclose(zp_err, dense)
+        assert zp_err[0] < 1e-5
+
+    def test_errors_without_reference(self):
+        # Without a reference the solution has zero mean, so the errors are
+        # those of the pseudo-inverse of the normal matrix
+        from_index, to_index = index_network(self.catalog_ids, self.network)
+        n = len(self.catalog_ids)
+        A, _ = design_matrix(from_index, to_index,
+                             self.network['delta'], self.network['delta_err'],
+                             n)
+        edges = A[:-1]
+        dense = np.sqrt(np.diag(np.linalg.pinv((edges.T * edges).toarray())))
+        zp_err = zeropoint_errors(from_index, to_index,
+                                  self.network['delta_err'], n)
+        assert np.allclose(zp_err, dense)
+
+
+class TestBackbone(object):
+
+    catalog_ids, network, zp = mock_network()
+
+    def test_spanning_forest(self):
+        n = len(self.catalog_ids)
+        from_index, to_index = index_network(self.catalog_ids, self.network)
+        backbone = backbone_edges(n, from_index, to_index,
+                                  self.network['delta_err'])
+        # a spanning tree of a connected network has n - 1 edges
+        assert backbone.sum() == n - 1
+        connected = np.zeros(n, dtype=bool)
+        connected[0] = True
+        for _ in range(n):
+            reached = connected[from_index[backbone]] \
+                | connected[to_index[backbone]]
+            connected[from_index[backbone][reached]] = True
+            connected[to_index[backbone][reached]] = True
+        assert connected.all()
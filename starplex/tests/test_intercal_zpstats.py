@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Test zeropoint difference statistics for intercal.
+"""
+
+import numpy as np
+
+from starplex.intercal.zpstats import bootstrap_weighted_mean, \
+    batch_zp_deltas
+
+
+class TestBootstrap(object):
+
+    rs = np.random.RandomState(0)
+    delta = 0.1 + 0.05 * rs.randn(200)
+    delta_err = np.repeat(0.05, 200)
+
+    def test_reproducible(self):
+        m0 = bootstrap_weighted_mean(self.delta, self.delta_err, rng=42)
+        m1 = bootstrap_weighted_mean(self.delta, self.delta_err, rng=42)
+        assert np.array_equal(m0, m1)
+
+    def test_block_size(self):
+        m0 = bootstrap_weighted_mean(self.delta, self.delta_err, rng=1)
+        m1 = bootstrap_weighted_mean(self.delta, self.delta_err, rng=1,
+                                     max_block_size=1000)
+        assert np.allclose(m0, m1)
+
+    def test_error_of_mean(self):
+        means = bootstrap_weighted_mean(self.delta, self.delta_err,
+                                        n_boot=2000, rng=2)
+        assert means.shape == (2000,)
+        expected = 0.05 / np.sqrt(200.)
+        assert abs(np.std(means) - expected) < 0.2 * expected
+
+
+def mock_edges(n_pairs, offsets, seed=1):
+    """Concatenated matched-pair differences of several edges."""
+    rs = np.random.RandomState(seed)
+    edge_index = np.concatenate([np.repeat(i, n)
+                                 for i, n in enumerate(n_pairs)])
+    delta = np.concatenate([o + 0.05 * rs.randn(n)
+                            for o, n in zip(offsets, n_pairs)])
+    return edge_index, delta
+
+
+class TestBatchZPDeltas(object):
+
+    n_pairs = [50, 3, 200, 0, 30]
+    edge_index, delta = mock_edges(n_pairs, [0.1, 0., -0.2, 0., 0.05])
+    delta[5] = 10.  # an outlier
+    delta_err = np.repeat(0.05, len(delta))
+
+    def test_matches_single_edge(self):
+        mean, mean_err, n_used = batch_zp_deltas(
+            self.edge_index, self.delta, self.delta_err, len(self.n_pairs),
+            rng=3)
+        for i in (0, 2, 4):
+            s = self.edge_index == i
+            d = self.delta[s]
+            keep = np.abs(d - np.median(d)) <= 3. * np.std(d)
+            assert n_used[i] == keep.sum()
+            assert np.allclose(mean[i], np.mean(d[keep]))
+            single = bootstrap_weighted_mean(d[keep], self.delta_err[s][keep],
+                                             rng=3)
+            assert abs(mean_err[i] - np.std(single)) < 0.2 * np.std(single)
+        assert n_used[0] == 49  # outlier clipped
+
+    def test_too_few_stars(self):
+        mean, mean_err, n_used = batch_zp_deltas(
+            self.edge_index, self.delta, self.delta_err, len(self.n_pairs))
+        assert np.isnan(mean[1]) and np.isnan(mean_err[1])
+        assert np.isnan(mean[3]) and n_used[3] == 0
@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Test HEALPix multi-order coverage interval operations.
+"""
+
+import numpy as np
+
+from starplex.database.meta.moc import MOC, union, intersecting_pairs
+from starplex.database.meta.moc import SKY_AREA
+
+
+class TestMOC(object):
+
+    def test_normalize(self):
+        moc = MOC([[20, 30], [0, 5], [5, 10], [2, 4]])
+        assert np.array_equal(moc.intervals, [[0, 10], [20, 30]])
+
+    def test_union(self):
+        a = MOC([[0, 10], [20, 30]])
+        b = MOC([[8, 22]])
+        assert np.array_equal((a | b).intervals, [[0, 30]])
+        assert union([a, b]) == a | b
+
+    def test_intersection(self):
+        a = MOC([[0, 10], [20, 30]])
+        b = MOC([[8, 22]])
+        assert np.array_equal((a & b).intervals, [[8, 10], [20, 22]])
+        assert not a.intersects(MOC([[10, 20]]))
+
+    def test_area(self):
+        sky = MOC.from_cells(0, range(12))
+        assert np.allclose(sky.area, SKY_AREA)
+        half = MOC.from_cells(1, range(24))
+        assert np.allclose(half.area, SKY_AREA / 2.)
+        assert MOC().area == 0.
+
+    def test_array_roundtrip(self):
+        moc = MOC.from_cells(3, [5, 6, 7, 100])
+        assert MOC.from_array(moc.to_array()) == moc
+
+    def test_intersecting_pairs(self):
+        np.random.seed(0)
+        mocs = [MOC.from_cells(6, np.random.randint(0, 200, size=5))
+                for i in range(20)]
+        mocs.append(MOC())
+        expected = [(i, j) for i in range(len(mocs))
+                    for j in range(i + 1, len(mocs))
+                    if mocs[i].intersects(mocs[j])]
+        pairs = intersecting_pairs(mocs)
+        assert [tuple(p) for p in pairs] == expected
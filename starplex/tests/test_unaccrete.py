@@ -0,0 +1,33 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Test the re-aggregation of star positions after unaccreting a catalog.
+"""
+
+import numpy as np
+
+from starplex.compile.unaccrete import spherical_mean
+
+
+class TestSphericalMean(object):
+
+    def test_ra_wrap(self):
+        # one star straddling RA = 0/360, one far from it
+        index = np.array([0, 0, 1, 1, 1])
+        ra = np.array([359.9999, 0.0001, 10., 10.0002, 10.0001])
+        dec = np.array([30., 30.0002, -5., -5., -5.0003])
+        ra_mean, dec_mean, ra_err, dec_err = spherical_mean(index, ra, dec, 2)
+        assert ra_mean[0] < 1e-6 or ra_mean[0] > 360. - 1e-6
+        assert np.allclose(dec_mean, [30.0001, -5.0001], atol=1e-6)
+        assert np.allclose(ra_mean[1], 10.0001, atol=1e-6)
+        # the scatter is that of the wrapped RA offsets
+        assert np.allclose(ra_err[0], np.std([-1e-4, 1e-4], ddof=1),
+                           rtol=1e-3)
+        assert np.allclose(dec_err[1], np.std([0., 0., -3e-4], ddof=1),
+                           rtol=1e-3)
+
+    def test_single_member(self):
+        ra_mean, dec_mean, ra_err, dec_err = spherical_mean(
+            np.array([0]), np.array([123.4]), np.array([-45.6]), 1)
+        assert np.allclose([ra_mean[0], dec_mean[0]], [123.4, -45.6])
+        assert np.isnan(ra_err[0]) and np.isnan(dec_err[0])